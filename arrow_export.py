@@ -0,0 +1,114 @@
+import sys
+import logging
+import argparse
+import numpy as np
+from covid_matrix import load_cases, load_deaths
+
+# pyarrow is optional. It is only needed by this module, so it is imported
+# when one of the functions is used.
+
+
+def _pa():
+    try:
+        import pyarrow
+    except ImportError:
+        logging.critical("pyarrow is needed for Arrow and Parquet output. " +
+                         "Install it with 'pip install pyarrow'.")
+        raise
+    return pyarrow
+
+
+def matrix_table(matrix):
+    """
+    Wide Arrow table of a CountyMatrix: fips, county, state, population and
+    one column per date. The values are laid out column by column once, so
+    every date column is an Arrow view of the same NumPy buffer and
+    to_numpy()/to_pandas() on the numbers do not copy.
+    """
+    pa = _pa()
+    values = np.asfortranarray(matrix.values)
+    columns = [pa.array(matrix.fips), pa.array(matrix.county),
+               pa.array(matrix.state), pa.array(matrix.population)]
+    columns += [pa.array(values[:, i]) for i in range(values.shape[1])]
+    names = ["fips", "county", "state", "population"] + \
+            [d.isoformat() for d in matrix.dates]
+    return pa.Table.from_arrays(columns, names=names)
+
+
+def long_table(cases_matrix, deaths_matrix):
+    """
+    Long Arrow table with one row per county and date: fips, county, state,
+    date, month, cumulative cases and deaths, and new cases and deaths. Every
+    column is built from whole NumPy arrays.
+    """
+    pa = _pa()
+    dates = sorted(set(cases_matrix.dates) & set(deaths_matrix.dates))
+    cases_matrix = cases_matrix.on_dates(dates)
+    deaths_matrix = deaths_matrix.align_to(cases_matrix.fips).on_dates(dates)
+    counties, days = cases_matrix.values.shape
+
+    dates = np.array(cases_matrix.dates, dtype="datetime64[D]")
+    months = np.array([d.month for d in cases_matrix.dates], dtype=np.int8)
+
+    columns = {
+        "fips": np.repeat(cases_matrix.fips, days),
+        "county": np.repeat(cases_matrix.county, days),
+        "state": np.repeat(cases_matrix.state, days),
+        "date": np.tile(dates, counties),
+        "month": np.tile(months, counties),
+        "cases": cases_matrix.values.ravel(),
+        "deaths": deaths_matrix.values.ravel(),
+        "new_cases": cases_matrix.daily().ravel(),
+        "new_deaths": deaths_matrix.daily().ravel(),
+    }
+    return pa.table({name: pa.array(col) for name, col in columns.items()})
+
+
+def state_table(covid_data):
+    """
+    Arrow table of a StateCovidData: state, population, median_age and one
+    deaths column per period, made from the NumPy arrays of
+    StateCovidData.columns(), the same arrays the command tables use.
+    """
+    pa = _pa()
+    return pa.table({str(name): pa.array(column)
+                     for name, column in covid_data.columns().items()})
+
+
+def numpy_column(table, name):
+    """
+    A read only NumPy view of a numeric column. Raises if a copy would be
+    needed.
+    """
+    return table.column(name).combine_chunks().to_numpy(zero_copy_only=True)
+
+
+def write_parquet(table, path: str):
+    """
+    Writes a long table as Parquet files partitioned by state and month,
+    e.g. path/state=TX/month=5/*.parquet.
+    """
+    _pa()
+    import pyarrow.parquet as pq
+
+    logging.debug(f"write_parquet(): writing {table.num_rows} rows to {path}")
+    pq.write_to_dataset(table, root_path=path,
+                        partition_cols=["state", "month"])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the county data as partitioned Parquet")
+
+    parser.add_argument("path", metavar="<path>", type=str,
+                        help="Directory for the Parquet dataset")
+
+    args = parser.parse_args()
+
+    table = long_table(load_cases(), load_deaths())
+    write_parquet(table, args.path)
+    print(f"Wrote {table.num_rows} rows to {args.path}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+import io
+import os
+import sys
+import json
+import logging
+import argparse
+import warnings
+import threading
+import matplotlib
+import matplotlib.pyplot as plt
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+import covid_cases
+import covid_deaths
+import combined
+import hotspots
+import materialize as mat
+from covid_matrix import load_cases, load_deaths, footprint
+
+# pyplot keeps one global figure state, so reports that draw take turns
+_plot_lock = threading.Lock()
+
+CASES_COMMANDS = ["states", "months"]
+DEATHS_COMMANDS = ["print", "deaths", "state"]
+COMMANDS = CASES_COMMANDS + DEATHS_COMMANDS + ["combined", "top"]
+
+
+class BatchData:
+    """
+    Every dataset a report can ask for, loaded once and shared by all the
+    reports of a batch. tables are the materialized report tables of the
+    data, when they were built.
+    """
+
+    def __init__(self, cases=None, deaths=None, covid_data=None,
+                 low_memory: bool = False):
+        logging.debug("BatchData(): loading datasets")
+        if cases is None and deaths is None and covid_data is None:
+            # the loader of the combined script
+            covid_data, cases, deaths = combined.load_combined(
+                low_memory=low_memory)
+        if cases is None:
+            cases = load_cases(low_memory=low_memory)
+        if deaths is None:
+            deaths = load_deaths(low_memory=low_memory)
+        self.cases = cases
+        self.deaths = deaths
+        logging.debug("BatchData(): memory used\n" +
+                      footprint({"cases": cases, "deaths": deaths}))
+        if covid_data is None:
+            covid_data = covid_deaths.load_covid_data(low_memory=low_memory)
+        self.covid_data = covid_data
+        self.tables = None
+
+
+class ReportOutput:
+    """
+    Stands in for sys.stdout while a batch runs. What a report prints goes
+    to the buffer of the thread running it, so the tables of reports that
+    run at the same time do not mix; anything else goes to the real stdout.
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def _stream(self):
+        buffer = getattr(self.local, "buffer", None)
+        return self.stdout if buffer is None else buffer
+
+    def write(self, text):
+        return self._stream().write(text)
+
+    def flush(self):
+        self._stream().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+    def capture(self, report, *args):
+        """
+        Runs a report with its prints going to a buffer of its own.
+        Returns the result of the report and what it printed.
+        """
+        self.local.buffer = io.StringIO()
+        try:
+            result = report(*args)
+            return result, self.local.buffer.getvalue()
+        finally:
+            self.local.buffer = None
+
+
+def read_specs(file_name: str) -> list:
+    """
+    Reads a JSON list of report specs, or an object with a "reports" list.
+    """
+    with open(file_name, "r", encoding="utf-8") as spec_file:
+        specs = json.load(spec_file)
+
+    if isinstance(specs, dict):
+        specs = specs["reports"]
+
+    for spec in specs:
+        if spec.get("command") not in COMMANDS:
+            raise ValueError(f"Unknown command in report spec: {spec}")
+        if spec.get("month") is not None:
+            # "5" is read as the month 5, as it is on the command line
+            try:
+                spec["month"] = int(spec["month"])
+            except (TypeError, ValueError):
+                raise ValueError("The month of a report spec must be a " +
+                                 f"number: {spec}") from None
+    return specs
+
+
+def _plot_file(spec):
+    if spec.get("plot_file"):
+        return spec["plot_file"]
+    if spec.get("output"):
+        return os.path.splitext(spec["output"])[0] + ".png"
+    return None
+
+
+def run_report(data: BatchData, spec: dict):
+    """
+    Runs one report spec against the loaded data. Outputs go to the spec's
+    "output" file and any chart is saved to "plot_file".
+    """
+    command = spec["command"]
+    month = spec.get("month")
+    state = spec.get("state")
+    outfile = spec.get("output")
+    plot = spec.get("plot", False)
+
+    if command in CASES_COMMANDS:
+        if command == "months" and state is None:
+            raise ValueError("The months command needs a state.")
+        args = SimpleNamespace(command=command, which_month=str(month),
+                               which_state=state, o_file=outfile,
+                               plot=bool(plot))
+        store = covid_cases.table_store(args, data.tables)
+        report = lambda: getattr(covid_cases, command)(args, data.cases,
+                                                       store)
+
+    elif command in DEATHS_COMMANDS:
+        report = lambda: covid_deaths.run_command(
+            data.covid_data, command, spec.get("sort", "population"),
+            spec.get("agg", "total"), state, bool(plot), outfile,
+            tables=data.tables, deaths_matrix=data.deaths)
+
+    elif command == "combined":
+        sort_order = spec.get("sort", "population")
+
+        def report():
+            df = None
+            if data.tables is not None:
+                df = data.tables.get(mat.combined_name(month, sort_order))
+            if df is None:
+                df = combined.covid_for_states(data.covid_data, sort_order,
+                                               month, data.cases)
+            if outfile is not None:
+                df.to_csv(outfile, index=False)
+            if plot:
+                plot_type = plot if isinstance(plot, str) else "scatter"
+                totals = None
+                if plot_type == "pie":
+                    totals = combined.national_totals(data.cases, data.deaths,
+                                                      month)
+                combined.run_plot(df, plot_type, state, sort_order, month,
+                                  totals)
+            return df
+
+    else:
+        args = SimpleNamespace(metric=spec.get("rate", "case_rate"),
+                               k=spec.get("k", 10),
+                               level=spec.get("level", "county"),
+                               month=month, start=spec.get("start"),
+                               end=spec.get("end"), state=state,
+                               per_state=spec.get("per_state", False),
+                               outfile=outfile, plot=bool(plot))
+        report = lambda: hotspots.top(args, data.cases, data.deaths)
+
+    if not plot:
+        return report()
+
+    with _plot_lock:
+        with warnings.catch_warnings():
+            # plt.show() does nothing with the Agg backend
+            warnings.simplefilter("ignore", UserWarning)
+            result = report()
+        plot_file = _plot_file(spec)
+        if plot_file is not None:
+            logging.debug(f"run_report(): saving chart to {plot_file}")
+            plt.savefig(plot_file)
+        plt.close("all")
+    return result
+
+
+def run_batch(specs: list, data: BatchData = None, max_workers: int = None,
+              materialize: bool = False):
+    """
+    Runs every report spec concurrently against one loaded dataset. Returns
+    the results in the order of the specs, and what the reports without an
+    output file print goes to stdout in that order too. With materialize,
+    every report table is built first and the reports only look them up.
+    Charts are drawn with the backend the caller has selected; main()
+    selects Agg, so they only go to files.
+    """
+    if data is None:
+        data = BatchData()
+    if materialize and data.tables is None:
+        data.tables = mat.materialize(data.cases, data.covid_data,
+                                      data.deaths)
+
+    output = ReportOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(output.capture, run_report, data, spec)
+                       for spec in specs]
+            results = []
+            for future in futures:
+                result, text = future.result()
+                output.stdout.write(text)
+                results.append(result)
+            return results
+    finally:
+        sys.stdout = output.stdout
+
+
+def main():
+    covid_deaths.setup_logging()
+
+    parser = argparse.ArgumentParser(
+        description="Run many reports against one loaded dataset")
+
+    parser.add_argument("spec_file", metavar="<spec_file>", type=str,
+                        help="JSON file with a list of report specs")
+
+    parser.add_argument("-w", "--workers", dest="workers", type=int,
+                        default=None,
+                        help="Number of reports to run at the same time")
+
+    parser.add_argument("-m", "--materialize", dest="materialize",
+                        action="store_true", default=False,
+                        help="Build every report table before the reports run")
+
+    parser.add_argument("--low-memory", dest="low_memory",
+                        action="store_true", default=False,
+                        help="Store counts as int32 and populations as " +
+                             "uint32 to halve the memory used")
+
+    args = parser.parse_args()
+
+    # the charts are saved to files, never shown
+    matplotlib.use("Agg")
+    run_batch(read_specs(args.spec_file),
+              BatchData(low_memory=args.low_memory),
+              max_workers=args.workers, materialize=args.materialize)
+
+
+if __name__ == '__main__':
+    main()
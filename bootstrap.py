@@ -0,0 +1,118 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+import state_registry
+from concurrent.futures import ProcessPoolExecutor
+
+RESAMPLES = 1000
+BATCH = 100
+CONFIDENCE = 0.95
+SEED = 2020
+
+METRICS = ["death_rate", "case_rate", "deaths_to_cases"]
+
+
+def county_counts(cases_matrix, deaths_matrix, period=None):
+    """
+    Cases, deaths and population of every county with a population, for a
+    month or for March - July when period is None, ordered by state.
+    Returns (state codes, cases, deaths, population, start row of every
+    state).
+    """
+    month = None if period is None else int(period)
+    deaths_matrix = deaths_matrix.align_to(cases_matrix.fips)
+    keep = np.flatnonzero((cases_matrix.population > 0) &
+                          (cases_matrix.state_id >= 0))
+    keep = keep[np.argsort(cases_matrix.state_id[keep], kind="stable")]
+
+    ids, starts = np.unique(cases_matrix.state_id[keep], return_index=True)
+    return (state_registry.decode(ids),
+            cases_matrix.period_values(month)[keep].astype(np.float64),
+            deaths_matrix.period_values(month)[keep].astype(np.float64),
+            cases_matrix.population[keep].astype(np.float64), starts)
+
+
+def _rates(cases, deaths, population):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {"death_rate": deaths / population,
+                "case_rate": cases / population,
+                "deaths_to_cases": deaths / cases}
+
+
+def resample_batch(cases, deaths, population, starts, size, seed):
+    """
+    size bootstrap resamples of the counties of every state at once. In
+    each resample every state draws as many counties as it has, with
+    replacement, from its own counties. Returns {metric: size x states}.
+    """
+    rng = np.random.default_rng(seed)
+    counts = np.diff(np.append(starts, len(cases)))
+    group = np.repeat(np.arange(len(starts)), counts)
+
+    # one uniform draw per county slot picks a county of the same state
+    picks = starts[group] + (rng.random((size, len(cases))) *
+                             counts[group]).astype(np.int64)
+    totals = [np.add.reduceat(a[picks], starts, axis=1)
+              for a in (cases, deaths, population)]
+    return _rates(*totals)
+
+
+def _resample_job(args):
+    return resample_batch(*args)
+
+
+def bootstrap(cases_matrix, deaths_matrix, period=None,
+              resamples: int = RESAMPLES, confidence: float = CONFIDENCE,
+              seed: int = SEED, batch: int = BATCH, max_workers: int = None):
+    """
+    Percentile bootstrap confidence intervals of the death rate, case rate
+    and deaths-to-cases ratio of every state, resampling counties within
+    states. The resamples run in batches on a process pool; every batch has
+    its own seed spawned from seed, so the intervals are the same for any
+    number of workers.
+    """
+    states, cases, deaths, population, starts = county_counts(
+        cases_matrix, deaths_matrix, period)
+
+    sizes = [min(batch, resamples - s) for s in range(0, resamples, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(cases, deaths, population, starts, n, s)
+            for n, s in zip(sizes, seeds)]
+
+    if max_workers == 1 or len(jobs) == 1:
+        results = [_resample_job(j) for j in jobs]
+    else:
+        workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+        logging.debug(f"bootstrap(): {len(jobs)} batches on " +
+                      f"{workers} processes")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_resample_job, jobs))
+
+    point = _rates(*[np.add.reduceat(a, starts)
+                     for a in (cases, deaths, population)])
+    tail = (1 - confidence) / 2 * 100
+    df = pd.DataFrame({"state": states})
+    for metric in METRICS:
+        samples = np.concatenate([r[metric] for r in results])
+        low, high = np.nanpercentile(samples, [tail, 100 - tail], axis=0)
+        df[metric] = point[metric]
+        df[metric + "_low"] = low
+        df[metric + "_high"] = high
+    return df
+
+
+def error_bars(df, intervals, metric: str, values=None):
+    """
+    The asymmetric error bars of a metric lined up with the states of a
+    frame, as [below, above] for matplotlib's yerr. values are the plotted
+    points; they default to the bootstrap point estimates.
+    """
+    bounds = intervals.set_index("state")
+    low = df["state"].map(bounds[metric + "_low"]).to_numpy(dtype=np.float64)
+    high = df["state"].map(bounds[metric + "_high"]).to_numpy(dtype=np.float64)
+    if values is None:
+        values = df["state"].map(bounds[metric]).to_numpy(dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    return np.nan_to_num(np.vstack([np.clip(values - low, 0, None),
+                                    np.clip(high - values, 0, None)]))
@@ -4,11 +4,27 @@ import argparse
 import logging
 import matplotlib.pyplot as plt
 import sys
-from collections import defaultdict
-from covid_deaths import StateCovidData, StateCovid
-from covid_cases import StateCountyData, StateCounty
-
-def plot_data(x: list, y: list, sort_order, period):
+from covid_deaths import StateCovidData, covid_data_from_matrix
+from state_registry import CHOICES
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from covid_matrix import (CountyMatrix, read_population, load_cases,
+                          CASES_FILE, DEATHS_FILE, POPULATION_FILE,
+                          FIRST_MONTH, LAST_MONTH)
+import lag_analysis
+import covariates
+import sources
+from sqlite_store import open_store
+from query_cache import cached
+from bootstrap import bootstrap, error_bars
+
+# the columns of the covid_for_states frame it can be sorted by. Any other
+# sort order is a covariate
+FRAME_SORTS = ["population", "median_age", "state"]
+
+def plot_data(x: list, y: list, sort_order, period, lagged=False,
+              yerr=None):
+    if yerr is not None:
+        plt.errorbar(x, y, yerr=yerr, fmt="none", ecolor="grey", capsize=2)
     plt.scatter(x, y)
     plt.xticks(rotation=90)
 
@@ -19,88 +35,149 @@ def plot_data(x: list, y: list, sort_order, period):
         plt.title(f'Death rates by state for {period}/2020')
         plt.xlabel('States in order of increasing population')
         plt.ylabel('Ratio of deaths to cases')
-    elif sort_order == 'median_age':
+    elif sort_order != 'state':
         plt.title(f'Death rates by state for {period}/2020')
-        plt.xlabel('States in order of increasing median age')
+        plt.xlabel('States in order of increasing ' +
+                   sort_order.replace('_', ' '))
         plt.ylabel('Ratio of deaths to cases')
     else:
         plt.title(f'Death rates by state for {period}/2020')
         plt.xlabel('States in alphabetical order')
         plt.ylabel('Ratio of deaths to cases')
 
-    plt.show()
-
-def group_counties_to_states(period, states):
-    cases = StateCountyData()
-    cases_sorted = cases.sort_by_state()
-
-    month_dict = {'3' : 'March', '4' : 'April', '5' : 'May', '6' : 'June',
-                    '7' : 'July'}
-    period_as_month = month_dict[str(period)]
-
-    cases_dict = defaultdict(list)
-
-    for i in cases_sorted:
-        if i.month == period_as_month:
-            if i.state not in states:
-                continue
-
-            if i.state not in cases_dict:
-                cases_dict[i.state] = i.case_num
-                continue
-
-            cases_dict[i.state] = cases_dict[i.state] + i.case_num
+    if lagged:
+        plt.ylabel('Ratio of deaths to cases reported at the best lag')
 
-    return cases_dict
+    plt.show()
 
 def get_covid_deaths(file_name):
     return StateCovidData()
 
-def covid_for_states(deaths, sort_order, period):
-    if period is None:
-        start = 3
-        end = 8
-    else:
-        start = period
-        end = period + 1
-
-    df = None
-
-    for i in range(start, end):
-        cases = group_counties_to_states(i, deaths.data.keys())
-        deaths_for_period = deaths.get_deaths_for_period(i)
-        if df is None:
-            df = pd.DataFrame(deaths_for_period, columns=["state", "population", "median_age", "deaths-" + str(i)])
-            df = df.sort_values(by="state")
-            df["cases-" + str(i)] = cases.values()
-            continue
-
-        temp = pd.DataFrame(deaths_for_period, columns=["state", "population", "median_age", "deaths"])
-        temp = temp.sort_values(by="state")
-        temp["cases"] = cases.values()
-
-        df[str("cases-" + str(i))] = temp["cases"]
-        df[str("deaths-" + str(i))] = temp["deaths"]
-
-    df = df.sort_values(by=sort_order)
-
-    rtnDf = pd.DataFrame()
-    rtnDf["state"] = df["state"]
-    rtnDf["population"] = df["population"]
-    rtnDf["median_age"] = df["median_age"]
-    rtnDf["cases"] = 0
-    rtnDf["deaths"] = 0
-
-    for i in range(start, end):
-        rtnDf["cases"] = rtnDf["cases"] + df["cases-" + str(i)]
-        rtnDf["deaths"] = rtnDf["deaths"] + df["deaths-" + str(i)]
-
-    return rtnDf
-
-def plot_state_to_total_comparison(df, state, period):
-    tot_pop = sum(df["population"])
-    tot_cases = sum(df["cases"])
-    tot_deaths = sum(df["deaths"])
+def _parse_matrix(file_name, low_memory, measure, source=None):
+    # runs in a worker process, the matrix is sent back pickled
+    return CountyMatrix.from_csv(file_name, low_memory=low_memory,
+                                 source=source, measure=measure)
+
+def _with_population(matrix, file_name, source, populations):
+    # the populations are completed with any places of the feed, like
+    # New York City in the NYT file
+    populations = sources.find(file_name, source).populations(file_name,
+                                                              populations)
+    return matrix.with_population(populations)
+
+def load_combined(cases_file=CASES_FILE, deaths_file=DEATHS_FILE,
+                  population_file=POPULATION_FILE,
+                  age_file="state_median_age.csv", low_memory=False,
+                  max_workers=None, source=None):
+    # reads every input at the same time: the two feeds are parsed in
+    # worker processes while the population and median age files are read
+    # in threads, then everything is joined. source names the layout of
+    # the feeds (see sources.SOURCES), found from their headers when None.
+    # returns the StateCovidData, built from the deaths matrix like
+    # covid_deaths.load_covid_data, and the cases and deaths matrices
+    reader = StateCovidData("no_file.txt", True)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as processes, \
+            ThreadPoolExecutor(max_workers=3) as threads:
+        cases = processes.submit(_parse_matrix, cases_file, low_memory,
+                                 "cases", source)
+        deaths = processes.submit(_parse_matrix, deaths_file, low_memory,
+                                  "deaths", source)
+        county_population = threads.submit(read_population, population_file)
+        state_population = threads.submit(reader._get_populations,
+                                          population_file)
+        median_age = threads.submit(reader._get_median_age, age_file)
+
+        cases_matrix = _with_population(cases.result(), cases_file, source,
+                                        county_population.result())
+        deaths_matrix = _with_population(deaths.result(), deaths_file, source,
+                                         county_population.result())
+        covid_data = covid_data_from_matrix(deaths.result(),
+                                            state_population.result(),
+                                            median_age.result(), low_memory)
+
+    if low_memory:
+        cases_matrix = cases_matrix.downcast()
+        deaths_matrix = deaths_matrix.downcast()
+    return covid_data, cases_matrix, deaths_matrix
+
+def covid_for_states(deaths, sort_order, period, cases_matrix=None):
+    # the frame is cached by the versions of the datasets and the query, and
+    # each caller gets its own copy
+    return cached("covid_for_states", [deaths, cases_matrix],
+                  [sort_order, period],
+                  lambda: _covid_for_states(deaths, sort_order, period,
+                                            cases_matrix)).copy()
+
+def _covid_for_states(deaths, sort_order, period, cases_matrix=None):
+    # built from the NumPy columns of the deaths data and the state rollup
+    # of the cases matrix, without lists of tuples
+    if cases_matrix is None:
+        # the cases file is only read when no matrix is loaded
+        cases_matrix = load_cases()
+
+    months = range(FIRST_MONTH, LAST_MONTH + 1) if period is None \
+        else [int(period)]
+    columns = deaths.columns()
+    states = columns["state"]
+
+    rollup = cases_matrix.rollup()
+    cases = rollup.period_values("state", None if period is None
+                                 else int(period))
+
+    df = pd.DataFrame({"state": states,
+                       "population": columns["population"],
+                       "median_age": columns["median_age"],
+                       "deaths": sum(columns[m] for m in months)})
+    df.insert(3, "cases", df["state"].map(dict(zip(rollup.names["state"],
+                                                   cases)))
+              .fillna(0).astype(np.int64))
+    # ties keep the alphabetical order of the states
+    return df.sort_values(by="state").sort_values(by=sort_order,
+                                                  kind="stable")
+
+def rates_for_states(cases_matrix, deaths_matrix, sort_order, period):
+    # the combined calculations for every state, worked out from the county
+    # matrices instead of StateCovidData and StateCountyData
+    return cached("rates_for_states", [cases_matrix, deaths_matrix],
+                  [sort_order, period],
+                  lambda: _rates_for_states(cases_matrix, deaths_matrix,
+                                            sort_order, period)).copy()
+
+def _rates_for_states(cases_matrix, deaths_matrix, sort_order, period):
+    month = None if period is None else int(period)
+    rollup = cases_matrix.rollup()
+    states = rollup.names["state"]
+    cases = rollup.period_values("state", month)
+    population = rollup.population["state"]
+    d_states = deaths_matrix.rollup().names["state"]
+    deaths = deaths_matrix.rollup().period_values("state", month)
+
+    df = pd.DataFrame({"state": states, "population": population,
+                       "cases": cases})
+    df["deaths"] = df["state"].map(dict(zip(d_states, deaths))).fillna(0) \
+        .astype(np.int64)
+    df["death_rate"] = calc_death_rate(df["deaths"], df["population"])
+    df["case_rate"] = calc_case_rate(df["cases"], df["population"])
+    df["deaths_to_cases"] = calc_deaths_to_cases(df["deaths"], df["cases"])
+
+    if sort_order in df.columns:
+        df = df.sort_values(by=sort_order)
+    return df.reset_index(drop=True)
+
+def national_totals(cases_matrix, deaths_matrix, period):
+    # population, cases and deaths of the nation from the precomputed rollups
+    month = None if period is None else int(period)
+    pop, cases = cases_matrix.rollup().totals("nation", "US", month)
+    _, deaths = deaths_matrix.rollup().totals("nation", "US", month)
+    return {"population": pop, "cases": cases, "deaths": deaths}
+
+def plot_state_to_total_comparison(df, state, period, totals=None):
+    if totals is None:
+        totals = df[["population", "cases", "deaths"]].sum()
+    tot_pop = int(totals["population"])
+    tot_cases = int(totals["cases"])
+    tot_deaths = int(totals["deaths"])
     st = df[df.state == state]
 
     vals_pop = np.array([tot_pop, st["population"].sum()])
@@ -153,15 +230,18 @@ def plot_state_to_total_comparison(df, state, period):
 
     plt.show()
 
-def plot_bar_chart(cases, deaths, state, sort_order, period):
+def plot_bar_chart(cases, deaths, state, sort_order, period, case_err=None,
+                   death_err=None):
     labels = state
 
     x = np.arange(len(labels))  # the label locations
     width = 0.35  # the width of the bars
 
     fig, ax = plt.subplots()
-    rects1 = ax.bar(x - width/2, deaths, width, label='Deaths')
-    rects2 = ax.bar(x + width/2, cases, width, label='Cases')
+    rects1 = ax.bar(x - width/2, deaths, width, label='Deaths',
+                    yerr=death_err, capsize=2)
+    rects2 = ax.bar(x + width/2, cases, width, label='Cases',
+                    yerr=case_err, capsize=2)
 
     # Add some text for labels, title and custom x-axis tick labels, etc.
     ax.set_xticks(x)
@@ -175,10 +255,11 @@ def plot_bar_chart(cases, deaths, state, sort_order, period):
         ax.set_title(f'Comparison of case rates and death rates for {period}/2020')
         ax.set_ylabel('Ratio of deaths/cases to population')
         ax.set_xlabel('States in order of increasing population')
-    elif sort_order == 'median_age':
+    elif sort_order != 'state':
         ax.set_title(f'Comparison of case rates and death rates for {period}/2020')
         ax.set_ylabel('Ratio of deaths/cases to population')
-        ax.set_xlabel('States in order of increasing median_age')
+        ax.set_xlabel('States in order of increasing ' +
+                      sort_order.replace('_', ' '))
     else:
         ax.set_title(f'Comparison of case rates and death rates for {period}/2020')
         ax.set_ylabel('Ratio of deaths/cases to population')
@@ -187,6 +268,71 @@ def plot_bar_chart(cases, deaths, state, sort_order, period):
     plt.xticks(rotation=90)
     plt.show()
 
+def sort_states(df, sort_order, store, cases_matrix=None):
+    # sorts a frame of states by one of its columns or by any covariate,
+    # which is added to the frame as a column
+    if sort_order not in df.columns:
+        df = store.join(df, [sort_order], cases_matrix)
+    return df.sort_values(by=sort_order, kind="stable")
+
+def _state_rates(df):
+    # unrounded rates of a frame of states
+    population = df["population"].to_numpy(dtype=np.float64)
+    cases = df["cases"].to_numpy(dtype=np.float64)
+    deaths = df["deaths"].to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {"case_rate": cases / population,
+                "death_rate": deaths / population,
+                "deaths_to_cases": deaths / cases}
+
+def group_by_covariate(df, name, store, groups=4, cases_matrix=None):
+    # puts the states of a frame in groups of about the same size by a
+    # covariate, lowest values first, and sums their population, cases and
+    # deaths with np.bincount
+    values = store.for_states(df["state"].to_numpy(dtype=str), name,
+                              cases_matrix)
+    ids, edges = covariates.quantile_groups(values, groups)
+    known = ids >= 0
+
+    def total(column):
+        weights = df[column].to_numpy(dtype=np.float64)[known]
+        return np.bincount(ids[known], weights=weights,
+                           minlength=groups).astype(np.int64)
+
+    grouped = pd.DataFrame({"group": np.arange(1, groups + 1),
+                            name + "_from": edges[:-1],
+                            name + "_to": edges[1:],
+                            "states": np.bincount(ids[known],
+                                                  minlength=groups),
+                            "population": total("population"),
+                            "cases": total("cases"),
+                            "deaths": total("deaths")})
+    grouped["case_rate"] = calc_case_rate(grouped["cases"],
+                                          grouped["population"])
+    grouped["death_rate"] = calc_death_rate(grouped["deaths"],
+                                            grouped["population"])
+    grouped["deaths_to_cases"] = calc_deaths_to_cases(grouped["deaths"],
+                                                      grouped["cases"])
+    return grouped
+
+def correlate_covariates(df, names, store, cases_matrix=None):
+    # the pearson and spearman correlation of each rate of the states with
+    # every covariate in names
+    codes = df["state"].to_numpy(dtype=str)
+    rates = _state_rates(df)
+    rows = []
+    for name in names:
+        values = store.for_states(codes, name, cases_matrix)
+        for metric, rate in rates.items():
+            known = ~(np.isnan(values) | np.isnan(rate))
+            rows.append((name, metric,
+                         round(covariates.correlation(values, rate), 4),
+                         round(covariates.correlation(values, rate,
+                                                      "spearman"), 4),
+                         int(known.sum())))
+    return pd.DataFrame(rows, columns=["covariate", "rate", "pearson",
+                                       "spearman", "states"])
+
 def calc_death_rate(deaths, population):
     return round(deaths/population, 4)
 
@@ -196,15 +342,34 @@ def calc_case_rate(cases, population):
 def calc_deaths_to_cases(deaths, cases):
     return round(deaths/cases, 4)
 
-def main():
+def build_parser():
+    # the command line of this script, also used by the session shell
     parser = argparse.ArgumentParser(
         description="Parse command line arguments")
 
     parser.add_argument("-s", "--sort", dest="sort_order",
                         type=str,
-                        choices=["population", "median_age", "state"],
                         default="population",
-                        help="")
+                        help="population, state or any covariate, e.g. " +
+                             "median_age")
+
+    parser.add_argument("-c", "--covariates", dest="covariate_files",
+                        action="append", default=None,
+                        help="A per-state or per-county attribute file to " +
+                             "read next to state_median_age.csv. Can be " +
+                             "given more than once")
+
+    parser.add_argument("--group", dest="group", type=str, default=None,
+                        help="Print the rates of the states grouped by a " +
+                             "covariate instead of plotting")
+
+    parser.add_argument("--groups", dest="groups", type=int, default=4,
+                        help="Number of groups of --group")
+
+    parser.add_argument("--correlate", dest="correlate", nargs="*",
+                        default=None,
+                        help="Print the correlations of the rates with the " +
+                             "given covariates, or with all of them")
 
     parser.add_argument("-m", "--month", dest="month",
                         type=int,
@@ -218,37 +383,175 @@ def main():
                         help="")
 
     parser.add_argument("-l", "--location", dest="state",
-                        choices = ['HI','AK','WA','OR','CA','NV','ID','UT',
-                        'AZ','MT','WY','CO','NM','ND','SD','NE','KS','OK',
-                        'TX','MN','IA','MO','AR','LA','WI','MI','IL','IN',
-                        'KY','TN','MS','AL','GA','FL','SC','NC','VA','MD',
-                        'DE','DC','WV','OH','PA','NJ','NY','CT','RI','MA',
-                        'VT','NH','ME'],
+                        choices=CHOICES,
                         type=str, help="")
 
-    args = parser.parse_args()
+    parser.add_argument("-d", "--db", dest="db_file",
+                        type=str, default=None,
+                        help="SQLite database to aggregate the data in")
+
+    parser.add_argument("-b", "--bootstrap", dest="bootstrap",
+                        type=int, default=None,
+                        help="Number of bootstrap resamples of the counties " +
+                             "of each state. Draws 95%% intervals as error bars")
+
+    parser.add_argument("-g", "--lag", dest="lag",
+                        action="store_true", default=False,
+                        help="Scatter the deaths-to-cases ratios with cases " +
+                             "moved by the best reporting lag of each state")
+
+    parser.add_argument("--low-memory", dest="low_memory",
+                        action="store_true", default=False,
+                        help="Store counts as int32 and populations as " +
+                             "uint32 to halve the memory used")
+
+    parser.add_argument("--cases-file", dest="cases_file",
+                        type=str, default=None,
+                        help=f"County cases feed, {CASES_FILE} by default")
+
+    parser.add_argument("--deaths-file", dest="deaths_file",
+                        type=str, default=None,
+                        help=f"County deaths feed, {DEATHS_FILE} by default. " +
+                             "The NYT file holds both")
+
+    parser.add_argument("--source", dest="source",
+                        type=str, choices=list(sources.SOURCES), default=None,
+                        help="Layout of the feeds, found from their headers " +
+                             "when not given")
 
+    return parser
+
+
+def main():
+    run_args(build_parser().parse_args())
+
+
+def run_args(args, loaded=None, tables=None):
+    """
+    Runs a parsed command line. loaded is (death_data, cases_matrix,
+    deaths_matrix) as returned by load_combined, when the data is already
+    in memory. tables are materialized tables of that data; without loaded
+    data the ones materialize.py saved for the data files are used.
+    """
     sort_order = args.sort_order
     period = args.month
     state = args.state
     plot = args.plot
 
-    death_data = get_covid_deaths("covid.data.txt")
-    plot_data_df = covid_for_states(death_data, sort_order, period)
-
+    store = covariates.load_store(args.covariate_files)
+    used = [args.group] if args.group else []
+    if args.correlate is not None:
+        used += args.correlate or store.names()
+    if sort_order not in FRAME_SORTS:
+        used.append(sort_order)
+    for name in used:
+        if name not in store:
+            known = FRAME_SORTS + [n for n in store.names()
+                                   if n not in FRAME_SORTS]
+            print(f"Unknown covariate {name}. Choose from " +
+                  f"{', '.join(known)}.")
+            sys.exit()
+    county_level = any(store.level(n) == "county" for n in used)
+    frame_sort = sort_order if sort_order in FRAME_SORTS else "state"
+    # materialize.py saves the tables of the default feeds only
+    default_feeds = args.cases_file is None and args.deaths_file is None \
+        and args.source is None
+    load = lambda: load_combined(args.cases_file or CASES_FILE,
+                                 args.deaths_file or DEATHS_FILE,
+                                 low_memory=args.low_memory,
+                                 source=args.source)
+
+    cases_matrix = deaths_matrix = None
+    plot_data_df = totals = None
+    if args.db_file is not None:
+        plot_data_df = open_store(args.db_file).rates_for_states(frame_sort,
+                                                                 period)
+    elif not (args.lag or args.bootstrap or county_level):
+        # the lag, the bootstrap and county covariates need the matrices
+        import materialize
+        if tables is None and loaded is None and default_feeds:
+            tables = materialize.open_tables()
+        if tables is not None:
+            plot_data_df = tables.get(materialize.combined_name(period,
+                                                                frame_sort))
+            totals = tables.get(materialize.totals_name(period))
+
+    if plot_data_df is None:
+        if loaded is None:
+            loaded = load()
+        death_data, cases_matrix, deaths_matrix = loaded
+        plot_data_df = covid_for_states(death_data, frame_sort, period,
+                                        cases_matrix)
+
+    if (args.lag or args.bootstrap or county_level) and cases_matrix is None:
+        if loaded is None:
+            loaded = load()
+        death_data, cases_matrix, deaths_matrix = loaded
+
+    if sort_order != frame_sort:
+        plot_data_df = sort_states(plot_data_df, sort_order, store,
+                                   cases_matrix)
+
+    if args.group or args.correlate is not None:
+        if args.group:
+            print(group_by_covariate(plot_data_df, args.group, store,
+                                     args.groups, cases_matrix)
+                  .to_string(index=False))
+        if args.correlate is not None:
+            print(correlate_covariates(plot_data_df,
+                                       args.correlate or store.names(),
+                                       store, cases_matrix)
+                  .to_string(index=False))
+        return None
+
+    lag_ratios = None
+    if args.lag:
+        lag_ratios = lag_analysis.analyze(cases_matrix, deaths_matrix,
+                                          period).best_ratios()
+
+    intervals = None
+    if args.bootstrap:
+        intervals = bootstrap(cases_matrix, deaths_matrix, period,
+                              resamples=args.bootstrap)
+
+    if plot == "pie" and cases_matrix is not None:
+        totals = national_totals(cases_matrix, deaths_matrix, period)
+
+    run_plot(plot_data_df, plot, state, sort_order, period, totals=totals,
+             lag_ratios=lag_ratios, intervals=intervals)
+
+def run_plot(plot_data_df, plot, state, sort_order, period, totals=None,
+             lag_ratios=None, intervals=None):
+    # draws one of the charts from a frame made by covid_for_states. totals
+    # are the national_totals the pie chart compares a state with; without
+    # them the frame is summed. the bootstrap intervals, when given, are
+    # drawn as error bars
     if plot == "pie":
         if state is None:
             print("To create a pie chart, I need a state. Use the '-l' argument and supply a 2 letter state code.")
             sys.exit()
 
-        plot_state_to_total_comparison(plot_data_df, state, period)
+        plot_state_to_total_comparison(plot_data_df, state, period, totals)
     elif plot == "bar":
         death_rate = calc_death_rate(plot_data_df["deaths"], plot_data_df["population"])
         case_rate = calc_case_rate(plot_data_df["cases"], plot_data_df["population"])
-        plot_bar_chart(case_rate, death_rate, plot_data_df["state"], sort_order, period)
+        case_err = death_err = None
+        if intervals is not None:
+            case_err = error_bars(plot_data_df, intervals, "case_rate",
+                                  case_rate)
+            death_err = error_bars(plot_data_df, intervals, "death_rate",
+                                   death_rate)
+        plot_bar_chart(case_rate, death_rate, plot_data_df["state"], sort_order, period,
+                       case_err, death_err)
+    elif lag_ratios is not None:
+        rate = plot_data_df["state"].map(lag_ratios)
+        plot_data(plot_data_df["state"], rate, sort_order, period, lagged=True)
     else:
         rate = calc_deaths_to_cases(plot_data_df["deaths"], plot_data_df["cases"])
-        plot_data(plot_data_df["state"], rate, sort_order, period)
+        yerr = None
+        if intervals is not None:
+            yerr = error_bars(plot_data_df, intervals, "deaths_to_cases", rate)
+        plot_data(plot_data_df["state"], rate, sort_order, period, yerr=yerr)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,64 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import logging
+
+# archives of the USAFacts files, tried in this order when the plain file
+# is not there
+SUFFIXES = [".gz", ".zst", ".bz2", ".xz"]
+
+
+def _zstd():
+    # zstandard is optional. It is only needed for .zst files
+    try:
+        import zstandard
+    except ImportError:
+        logging.critical("zstandard is needed to read .zst files. " +
+                         "Install it with 'pip install zstandard'.")
+        raise
+    return zstandard
+
+
+def resolve(file_name: str) -> str:
+    """
+    The file to read for file_name: the file itself when it exists,
+    otherwise the first compressed copy of it (file_name.gz, .zst, ...).
+    """
+    if os.path.exists(file_name):
+        return file_name
+    for suffix in SUFFIXES:
+        if os.path.exists(file_name + suffix):
+            logging.debug(f"resolve(): reading {file_name + suffix}")
+            return file_name + suffix
+    return file_name
+
+
+def exists(file_name: str) -> bool:
+    """
+    True when file_name or a compressed copy of it exists.
+    """
+    return os.path.exists(resolve(file_name))
+
+
+def open_text(file_name: str, encoding: str = None, newline: str = None):
+    """
+    Opens a plain, .gz, .zst, .bz2 or .xz file for reading text. Compressed
+    files are decompressed as they are read, so they are never written out
+    or held in memory in full.
+    """
+    file_name = resolve(file_name)
+
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, "rt", encoding=encoding, newline=newline)
+    if file_name.endswith(".bz2"):
+        return bz2.open(file_name, "rt", encoding=encoding, newline=newline)
+    if file_name.endswith(".xz"):
+        return lzma.open(file_name, "rt", encoding=encoding, newline=newline)
+    if file_name.endswith(".zst"):
+        raw = open(file_name, "rb")
+        reader = _zstd().ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(io.BufferedReader(reader), encoding=encoding,
+                                newline=newline)
+    return open(file_name, "r", encoding=encoding, newline=newline)
@@ -0,0 +1,311 @@
+import os
+import re
+import logging
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+import state_registry
+from compressed import open_text, resolve
+
+AGE_FILE = "state_median_age.csv"
+
+# the covariate files the command line tools always read. More can be
+# given with their -c option
+COVARIATE_FILES = [AGE_FILE]
+
+# header names (lower case) of the column that says which state or county
+# a row is about
+STATE_KEYS = ["state", "state code", "province_state"]
+COUNTY_KEYS = ["countyfips", "fips", "county fips"]
+
+# columns that only describe a row, like the names and the stateFIPS code
+# of the USAFacts county files
+_LABELS = ["county name", "county", "name", "state name", "admin2",
+           "statefips", "state fips"]
+
+# state and territory names -> two letter codes, for files that use names
+_NAME_CODES = dict(zip(state_registry.NAMES.tolist(),
+                       state_registry.CODES.tolist()))
+
+# every table gets a new version, which the query cache keys on
+_versions = itertools.count(1)
+
+# {file: ((modification time, size), table)} of the files load_store() read
+_tables = dict()
+
+
+def _covariate_name(text: str) -> str:
+    # "Median Household Income" -> "median_household_income"
+    return re.sub(r"[^0-9a-z]+", "_", text.strip().lower()).strip("_")
+
+
+class CovariateTable:
+    """
+    The covariates of one file. level is "state" or "county". keys are the
+    state_registry ids of the states or the FIPS codes of the counties,
+    sorted, and every covariate is a float64 array in the order of keys with
+    nan for missing values. align() lines a covariate up with any array of
+    keys with one searchsorted, so no row is looked up in a dictionary.
+    A table is never changed after it is made.
+    """
+
+    def __init__(self, level: str, keys, columns: dict, file_name: str = None):
+        keys = np.asarray(keys, dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        self.level = level
+        self.keys = keys[order]
+        self.columns = {name: np.asarray(values, dtype=np.float64)[order]
+                        for name, values in columns.items()}
+        self.file_name = file_name
+        self.version = next(_versions)
+
+    def __repr__(self) -> str:
+        return (f"CovariateTable({self.level}, {len(self.keys)} rows, " +
+                f"{', '.join(self.columns)})")
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def names(self) -> list:
+        return list(self.columns)
+
+    def align(self, keys, name: str = None):
+        """
+        The values of a covariate (the only one when name is None) for an
+        array of keys, nan where a key has no row.
+        """
+        values = self.columns[name or self.names()[0]]
+        keys = np.asarray(keys, dtype=np.int64)
+        if len(self.keys) == 0:
+            return np.full(len(keys), np.nan)
+        pos = np.clip(np.searchsorted(self.keys, keys), 0, len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, values[pos], np.nan)
+
+    def as_dict(self, name: str = None) -> dict:
+        """
+        {state code: value} of a state covariate, or {fips: value} of a
+        county covariate, leaving out missing values.
+        """
+        values = self.columns[name or self.names()[0]]
+        keys = self.keys.tolist()
+        if self.level == "state":
+            keys = state_registry.decode(self.keys).tolist()
+        return {k: v for k, v in zip(keys, values.tolist()) if not np.isnan(v)}
+
+
+def read_table(file_name: str) -> CovariateTable:
+    """
+    Reads a per-state or per-county attribute file. The rows are keyed by a
+    State column (two letter codes or names) or by a countyFIPS/fips column,
+    and every other numeric column is a covariate named after its header in
+    lower case with underscores. A state_<name> or county_<name> file with a
+    single covariate names it after the file instead, so
+    state_median_age.csv holds median_age. The BOM some of these files
+    start with is dropped by the utf-8-sig encoding.
+    """
+    logging.debug(f"read_table(): Reading {file_name}")
+    with open_text(file_name, "utf-8-sig") as data_file:
+        df = pd.read_csv(data_file, dtype=str, keep_default_na=False)
+    headers = [h.strip().lower() for h in df.columns]
+
+    county = [c for c, h in zip(df.columns, headers) if h in COUNTY_KEYS]
+    state = [c for c, h in zip(df.columns, headers) if h in STATE_KEYS]
+    if county:
+        level, key = "county", county[0]
+        keys = pd.to_numeric(df[key], errors="coerce").to_numpy()
+    elif state:
+        level, key = "state", state[0]
+        codes = df[key].str.strip()
+        codes = codes.map(_NAME_CODES).fillna(codes)
+        keys = state_registry.encode(codes.to_numpy(dtype=str))
+        keys = np.where(keys == state_registry.UNKNOWN, np.nan, keys)
+    else:
+        raise ValueError(f"{file_name} has no State or countyFIPS column")
+
+    known = ~np.isnan(keys)
+    if not known.all():
+        logging.debug(f"read_table(): {len(known) - known.sum()} rows of " +
+                      f"{file_name} have an unknown {key}")
+
+    skip = {key} | {c for c, h in zip(df.columns, headers)
+                    if h in _LABELS + STATE_KEYS + COUNTY_KEYS}
+    columns = dict()
+    for column in df.columns:
+        if column in skip:
+            continue
+        values = pd.to_numeric(df[column].str.replace(",", ""),
+                               errors="coerce").to_numpy(dtype=np.float64)
+        if np.isnan(values).all():
+            continue
+        columns[_covariate_name(column)] = values[known]
+
+    name = os.path.basename(file_name).split(".")[0].lower()
+    if len(columns) == 1 and re.match(r"(state|county)_", name):
+        name = re.sub(r"^(state|county)_", "", name)
+        columns = {_covariate_name(name): next(iter(columns.values()))}
+    return CovariateTable(level, keys[known], columns, file_name)
+
+
+class CovariateStore:
+    """
+    The covariates of every file read, by name. State covariates line up
+    with state codes directly. County covariates line up with counties by
+    FIPS, and with states as the population weighted mean of the counties
+    of a CountyMatrix. A name that is in more than one file comes from the
+    last one added.
+    """
+
+    def __init__(self, tables=()):
+        self.tables = dict()
+        for table in tables:
+            self.add(table)
+
+    def __repr__(self) -> str:
+        return f"CovariateStore({', '.join(self.names())})"
+
+    def __contains__(self, name) -> bool:
+        return name in self.tables
+
+    def add(self, table: CovariateTable):
+        for name in table.names():
+            self.tables[name] = table
+
+    def names(self) -> list:
+        return sorted(self.tables)
+
+    @property
+    def version(self) -> tuple:
+        # the versions of the tables, so a store with a changed file has a
+        # new one
+        return tuple(table.version for table in self.tables.values())
+
+    def level(self, name: str) -> str:
+        return self._table(name).level
+
+    def _table(self, name):
+        if name not in self.tables:
+            raise ValueError(f"Unknown covariate {name}. Known covariates: " +
+                             f"{', '.join(self.names())}")
+        return self.tables[name]
+
+    def for_states(self, codes, name: str, matrix=None):
+        """
+        A covariate lined up with an array of state codes. A county
+        covariate needs the county matrix to weight its counties by
+        population.
+        """
+        table = self._table(name)
+        ids = state_registry.encode(codes)
+        if table.level == "state":
+            values = table.align(ids, name)
+        else:
+            if matrix is None:
+                raise ValueError(f"{name} is a county covariate and needs " +
+                                 "the county data to be loaded")
+            county = table.align(matrix.fips, name)
+            weights = np.where(np.isnan(county), 0,
+                               matrix.population.astype(np.float64))
+            sums = state_registry.bincount(matrix.state_id,
+                                           np.nan_to_num(county) * weights)
+            totals = state_registry.bincount(matrix.state_id, weights)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                means = np.where(totals > 0, sums / totals, np.nan)
+            values = means[np.clip(ids, 0, None)]
+        return np.where(ids >= 0, values, np.nan)
+
+    def for_counties(self, matrix, name: str):
+        """
+        A covariate lined up with the rows of a county matrix. Every county
+        gets the value of its state for a state covariate.
+        """
+        table = self._table(name)
+        if table.level == "county":
+            return table.align(matrix.fips, name)
+        values = table.align(matrix.state_id, name)
+        return np.where(matrix.state_id >= 0, values, np.nan)
+
+    def join(self, df, names: list, matrix=None):
+        """
+        A copy of a frame with a state column, with a column added for each
+        covariate.
+        """
+        df = df.copy()
+        codes = df["state"].to_numpy(dtype=str)
+        for name in names:
+            df[name] = self.for_states(codes, name, matrix)
+        return df
+
+
+def _read_once(file_name: str) -> CovariateTable:
+    # a file is read again only when its modification time or size changed
+    stat = os.stat(resolve(file_name))
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if file_name not in _tables or _tables[file_name][0] != signature:
+        _tables[file_name] = (signature, read_table(file_name))
+    return _tables[file_name][1]
+
+
+def load_store(files: list = None) -> CovariateStore:
+    """
+    A store of COVARIATE_FILES and any other files given. The tables of
+    files that did not change since they were last read are reused.
+    """
+    return CovariateStore(_read_once(f)
+                          for f in COVARIATE_FILES + list(files or []))
+
+
+def quantile_groups(values, groups: int = 4):
+    """
+    The group (0 to groups - 1) of every value when the values are split
+    into groups of about the same size, and the group edges. Missing values
+    are in group -1.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    known = ~np.isnan(values)
+    if not known.any():
+        return np.full(len(values), -1), np.full(groups + 1, np.nan)
+    edges = np.quantile(values[known], np.linspace(0, 1, groups + 1))
+    ids = np.clip(np.searchsorted(edges[1:-1], values, side="right"), 0,
+                  groups - 1)
+    return np.where(known, ids, -1), edges
+
+
+def correlation(x, y, method: str = "pearson") -> float:
+    """
+    The pearson or spearman (rank) correlation of two arrays, leaving out
+    pairs with a missing value.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    known = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[known], y[known]
+    if len(x) < 2 or x.std() == 0 or y.std() == 0:
+        return np.nan
+    if method == "spearman":
+        # ties get their average rank
+        x = pd.Series(x).rank().to_numpy()
+        y = pd.Series(y).rank().to_numpy()
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List the covariates of state and county attribute files")
+
+    parser.add_argument("files", metavar="<file_name>", type=str, nargs="*",
+                        help="Attribute files to read next to " +
+                             f"{', '.join(COVARIATE_FILES)}")
+
+    args = parser.parse_args()
+
+    store = load_store(args.files)
+    for name in store.names():
+        table = store.tables[name]
+        values = table.columns[name]
+        print(f"{name}: {table.level}, {len(table)} rows from " +
+              f"{table.file_name}, {np.nanmin(values)} - {np.nanmax(values)}")
+
+
+if __name__ == '__main__':
+    main()
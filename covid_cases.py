@@ -1,6 +1,16 @@
 import csv, logging, argparse, sys
+import numpy as np
 import matplotlib.pyplot as plt
+import sources
 from collections import defaultdict
+from query import CountyQuery
+from state_registry import CHOICES, state_id
+from sqlite_store import open_store
+from query_cache import cached
+from compressed import open_text
+from datetime import timedelta
+from covid_matrix import month_end, CASES_FILE, DEATHS_FILE
+from projection import Projection, fit_log_linear, WINDOW, HORIZON
 
 
 class StateCounty:
@@ -67,7 +77,8 @@ class StateCountyData:
 
     def _build_object_1(self):
         # set up the state, county and pop attributes of StateCounty objects
-        with open('covid_county_population_usafacts.csv', 'r') as file_1:
+        # the files may also be compressed copies, e.g. .csv.gz
+        with open_text('covid_county_population_usafacts.csv') as file_1:
             dialect1 = csv.Sniffer().sniff(file_1.read(2))
             reader1 = csv.reader(file_1, dialect1)
             fips_state_dict = defaultdict(list)
@@ -90,7 +101,7 @@ class StateCountyData:
 
     def _build_object_2(self, fips_state_dict, fips_county_dict, fips_pop_dict):
         # set up the num_cases attribute of StateCounty objects
-        with open('covid_confirmed_usafacts.csv', 'r') as file_2:
+        with open_text('covid_confirmed_usafacts.csv') as file_2:
             dialect2 = csv.Sniffer().sniff(file_2.read(2))
             reader2 = csv.reader(file_2, dialect2)
             mar_dict = defaultdict(list)
@@ -118,6 +129,12 @@ class StateCountyData:
 
         #logging.debug('may dictionary: %s' % may_dict)
 
+        # the cumulative columns sometimes go down after corrections
+        negative = sum(1 for d in (mar_dict, apr_dict, may_dict, jun_dict,
+                        jul_dict) for v in d.values() if v[0] < 0)
+        if negative > 0:
+            logging.info('%s county months have negative cases' % negative)
+
         self._build_object_3(fips_state_dict, fips_county_dict, fips_pop_dict,
                             mar_dict, apr_dict, may_dict, jun_dict, jul_dict)
 
@@ -234,10 +251,50 @@ def months_write(args, rate_dict, month_dict):
 
         plt.show()
 
-def states(args):
+def state_rates(matrix, which_month):
+    # the rate dictionary of the 'states' command, built from a CountyMatrix
+    # instead of StateCounty objects. repeated queries on the same matrix
+    # come from the query cache
+    return cached('states', [matrix], [int(which_month)],
+                  lambda: _state_rates(matrix, which_month))
+
+def _state_rates(matrix, which_month):
+    rollup = matrix.rollup()
+    states = rollup.names["state"]
+    case_totals = rollup.period_values("state", int(which_month))
+    pop_totals = rollup.population["state"]
+
+    return {(str(s), int(p)) : (int(c) * 100) / int(p)
+            for s, p, c in zip(states, pop_totals, case_totals)}
+
+def county_rates(matrix, which_month, which_state):
+    # the rate dictionary of the 'months' command, built from a CountyMatrix.
+    # counties are ordered by population like sort_by_state does
+    return cached('months', [matrix], [int(which_month), which_state],
+                  lambda: _county_rates(matrix, which_month, which_state))
+
+def _county_rates(matrix, which_month, which_state):
+    cases = matrix.period_values(int(which_month))
+    rows = np.flatnonzero((matrix.state_id == state_id(which_state)) & \
+                            (matrix.population > 0))
+    rows = rows[np.lexsort((matrix.county[rows], matrix.population[rows]))]
+
+    return {(str(matrix.county[i]), int(matrix.population[i])) : \
+            (int(cases[i]) * 100) / int(matrix.population[i]) for i in rows}
+
+def states(args, matrix=None, store=None):
     # what happens when the command 'states' is given
     month_dict = {'3' : 'March', '4' : 'April', '5' : 'May', '6' : 'June',
                     '7' : 'July'}
+    if store is not None:
+        rate_dict = store.state_rates(args.which_month)
+        states_write(args, rate_dict, month_dict)
+        return rate_dict
+    if matrix is not None:
+        rate_dict = state_rates(matrix, args.which_month)
+        states_write(args, rate_dict, month_dict)
+        return rate_dict
+
     obj = StateCountyData().sort_by_state()
     cases_dict = defaultdict(list)
     pop_dict = defaultdict(list)
@@ -257,11 +314,20 @@ def states(args):
 
     return rate_dict
 
-def months(args):
+def months(args, matrix=None, store=None):
     # what happens when the command 'months' is given
 
     month_dict = {'3' : 'March', '4' : 'April', '5' : 'May', '6' : 'June',
                     '7' : 'July'}
+    if store is not None:
+        rate_dict = store.county_rates(args.which_month, args.which_state)
+        months_write(args, rate_dict, month_dict)
+        return rate_dict
+    if matrix is not None:
+        rate_dict = county_rates(matrix, args.which_month, args.which_state)
+        months_write(args, rate_dict, month_dict)
+        return rate_dict
+
     obj = StateCountyData().sort_by_state()
     rate_dict = {}
     for i in obj:
@@ -276,37 +342,141 @@ def months(args):
 
     return rate_dict
 
+def project_write(args, projection, month_dict):
+    # writes the output for the 'project' command and makes a plot if '-p'
+    # is given in the command line
+    rows = list(projection.rows())
+    fieldnames = ['name', 'state', 'population', 'last_total', 'daily_growth',
+                  'doubling_days', 'projected_new', 'projected_total']
+    if args.o_file is None:
+        writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        with open(args.o_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    if args.plot:
+        # the daily counts of the five places with the most projected new
+        # counts, with their fitted lines carried on into the projection
+        top = np.argsort(projection.new)[::-1][:5]
+        daily = np.diff(projection.values[top], axis=1)[:, -projection.window:]
+        intercept, slope = fit_log_linear(daily, projection.window)
+        past = np.arange(-projection.window + 1, 1)
+        ahead = np.arange(0, projection.horizon + 1)
+
+        fig, ax = plt.subplots()
+        for i, row in enumerate(top):
+            line, = ax.plot(past, daily[i], label=projection.names[row])
+            ax.plot(ahead, np.expm1(intercept[i] + slope[i] * ahead), '--',
+                    color=line.get_color())
+        ax.axvline(0, color='grey', linewidth=0.5)
+        what = 'deaths' if args.deaths else 'cases'
+        plt.title(f'Daily {what} and {projection.horizon} day projection ' +
+                  f'from the end of {month_dict[args.which_month]} 2020')
+        plt.xlabel(f'Days after {projection.end}')
+        plt.ylabel(f'New {what} per day')
+        ax.legend()
+        plt.show()
+
+def project(args, matrix=None):
+    # what happens when the command 'project' is given. counties of the
+    # chosen state are projected with '-s', every county with '--counties'
+    # and otherwise every state
+    month_dict = {'3' : 'March', '4' : 'April', '5' : 'May', '6' : 'June',
+                    '7' : 'July'}
+    end = month_end(int(args.which_month))
+    if matrix is None:
+        # only the columns of the fitting window are read
+        if args.deaths:
+            file_name = args.deaths_file or DEATHS_FILE
+        else:
+            file_name = args.cases_file or CASES_FILE
+        query = CountyQuery(file_name, low_memory=args.low_memory,
+                            measure='deaths' if args.deaths else 'cases',
+                            source=args.source) \
+            .between(end - timedelta(days=args.window), end)
+        if args.which_state is not None:
+            query = query.where(state=args.which_state)
+        matrix = query.load()
+    matrix = matrix.on_dates(matrix.dates[:matrix.date_column(end) + 1])
+    if len(matrix.dates) < args.window + 1:
+        # the fit needs the cumulative count of the day before the window
+        build_parser().error('--window %d needs %d days of data up to %s, '
+                             'there are %d' % (args.window, args.window + 1,
+                                               end, len(matrix.dates)))
+
+    projection = Projection(matrix, args.which_state, args.counties,
+                            args.window, args.horizon)
+    project_write(args, projection, month_dict)
+
+    return projection
+
+def table_store(args, tables):
+    # the materialized tables when they hold the rates args asks for
+    import materialize
+    state = args.which_state if args.command == 'months' else None
+    if tables is None or (args.command == 'months' and state is None):
+        return None
+    if materialize.rates_name(args.which_month, state) not in tables:
+        return None
+    return tables
+
 def arguments(args):
     #logging.debug('args.command is %s' % args.command)
     # this function handles the 'command' argument
+    if args.command == 'project':
+        project(args)
+        return
+    if args.db is not None:
+        # the aggregation is done in SQL
+        store = open_store(args.db)
+    elif args.cases_file is None and args.source is None:
+        # the rates materialize.py saved for the data files are only read
+        import materialize
+        store = table_store(args, materialize.open_tables())
+    else:
+        store = None
+    if store is not None:
+        if args.command == 'states':
+            states(args, store=store)
+        if args.command == 'months':
+            if args.which_state is None:
+                print('You must choose a state.')
+                sys.exit(1)
+            months(args, store=store)
+        return
+
+    # only the columns of the chosen month (and for 'months' only the rows
+    # of the chosen state) are read from the data file
+    query = CountyQuery(args.cases_file or CASES_FILE,
+                        low_memory=args.low_memory, source=args.source) \
+        .for_month(int(args.which_month))
     if args.command == 'states':
-        states(args)
+        states(args, query.load())
     if args.command == 'months':
         if args.which_state is None:
             print('You must choose a state.')
             sys.exit(1)
         else:
-            months(args)
+            months(args, query.where(state=args.which_state).load())
 
-def parse_my_args(input):
-    # setting up the argument parser
+def build_parser():
+    # setting up the argument parser, also used by the session shell
     parser = argparse.ArgumentParser(description=\
                         'Covid data for March through July 2020')
 
     parser.add_argument('command', metavar='<command>',
-                        choices=['states','months'],
+                        choices=['states','months','project'],
                         help='choose how to display data')
     parser.add_argument('which_month', metavar='<which_month>',
                         choices=['3','4','5','6','7'],
                         help='choose a month from March to July')
     # must be selected if command is 'months'
     parser.add_argument('-s', '--which_state', metavar='<which_state>',
-                        choices = ['HI','AK','WA','OR','CA','NV','ID','UT',
-                        'AZ','MT','WY','CO','NM','ND','SD','NE','KS','OK',
-                        'TX','MN','IA','MO','AR','LA','WI','MI','IL','IN',
-                        'KY','TN','MS','AL','GA','FL','SC','NC','VA','MD',
-                        'DE','DC','WV','OH','PA','NJ','NY','CT','RI','MA',
-                        'VT','NH','ME'], help='required when <command> is months')
+                        choices=CHOICES, help='required when <command> is months')
     # optional command to name a csv file for output. if not used, output
     # prints to console
     parser.add_argument('-o', '--o_file', metavar='<outfile>',
@@ -314,8 +484,42 @@ def parse_my_args(input):
     # optional command to plot data
     parser.add_argument('-p', '--plot', action='store_true',
                         help='to create a plot')
+    # optional SQLite database to aggregate in. it is built from the csv
+    # files when it does not exist
+    parser.add_argument('-d', '--db', metavar='<database>', default=None,
+                        help='the name of a SQLite database to use')
+
+    # optional command to store the numbers in smaller types
+    parser.add_argument('--low-memory', action='store_true',
+                        help='store counts as int32 and populations as uint32')
+
+    # optional feeds to read instead of the USAFacts files, in any layout
+    # of sources.py
+    parser.add_argument('--cases-file', metavar='<file>', default=None,
+                        help='the county cases feed, %s by default' %
+                             CASES_FILE)
+    parser.add_argument('--deaths-file', metavar='<file>', default=None,
+                        help='the county deaths feed of --deaths, %s by '
+                             'default' % DEATHS_FILE)
+    parser.add_argument('--source', choices=list(sources.SOURCES),
+                        default=None,
+                        help='the layout of the feeds, found from their '
+                             'headers when not given')
+
+    # options of the 'project' command
+    parser.add_argument('--deaths', action='store_true',
+                        help='project deaths instead of cases')
+    parser.add_argument('--counties', action='store_true',
+                        help='project every county instead of every state')
+    parser.add_argument('--window', type=int, default=WINDOW,
+                        help='days of daily counts each projection is fitted to')
+    parser.add_argument('--horizon', type=int, default=HORIZON,
+                        help='days to project ahead')
+
+    return parser
 
-    args = parser.parse_args(input)
+def parse_my_args(input):
+    args = build_parser().parse_args(input)
 
     logging.debug('Args is %s' % args)
 
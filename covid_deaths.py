@@ -1,5 +1,4 @@
 import csv
-import os
 import sys
 import requests
 import argparse
@@ -10,6 +9,21 @@ import numpy as np
 import pandas as pd
 from datetime import timedelta, date
 from collections import namedtuple, defaultdict
+import compressed
+import covariates
+import sources
+from covid_matrix import (CountyMatrix, load_deaths, DEATHS_FILE,
+                          POPULATION_FILE, FIRST_MONTH, LAST_MONTH)
+from state_registry import CHOICES
+from itertools import count
+from query_cache import cached
+
+# StateCovid and StateCovidData objects get a new version number for the
+# query cache when they are created and whenever they are changed
+_versions = count(1)
+
+# the columns of the deaths tables. Any other sort order is a covariate
+SORT_COLUMNS = ["population", "median_age", "state"]
 
 
 class StateCovid:
@@ -19,6 +33,7 @@ class StateCovid:
         self.population = population
         self.median_age = median_age
         self.state_data = dict()
+        self.version = next(_versions)
     
     def __repr__(self) -> str:
         """
@@ -43,6 +58,7 @@ class StateCovid:
 
     def add_deaths(self, period: int, number_of_deaths: int):
         # logging.debug(f"{self.state} - {period}: {number_of_deaths}")
+        self.version = next(_versions)
         if int(period) not in self.state_data.keys():
             self.state_data[int(period)] = number_of_deaths
             return None
@@ -56,12 +72,14 @@ class StateCovid:
 
     def set_population(self, population):
         self.population = population
+        self.version = next(_versions)
 
     def get_population(self):
         return self.population
 
     def set_median_age(self, median_age):
         self.median_age = median_age
+        self.version = next(_versions)
 
     def get_median_age(self):
         return self.median_age
@@ -85,6 +103,9 @@ class StateCovid:
 class StateCovidData:
     def __init__(self, data_file_name: str = "covid.data.txt", test_flag: bool = False):
         self.data = defaultdict()
+        self._version = next(_versions)
+        # columns() gives float32 median ages in low memory mode
+        self.low_memory = False
 
         if not test_flag:
             self._load_data(data_file_name)
@@ -106,8 +127,17 @@ class StateCovidData:
 
         return rtn_str
 
+    @property
+    def version(self):
+        # a change to a state gives it a version newer than any before, so
+        # the newest state version changes with it. add_state_data bumps
+        # _version, which covers putting in a state made earlier
+        states = max((s.version for s in self.data.values()), default=0)
+        return (self._version, states)
+
     def add_state_data(self, state_data: StateCovid):
         self.data[state_data.state] = state_data
+        self._version = next(_versions)
 
     # from stackoverflow
     def _daterange(self, start_date, end_date):
@@ -120,27 +150,39 @@ class StateCovidData:
 
     def _load_data(self, data_file_name: str):
         logging.debug(f"_load_data(): Loading data from {data_file_name}.")
-        if not os.path.exists(data_file_name):
+        if not compressed.exists(data_file_name):
             logging.debug(f"{data_file_name} not found. Need to create it.")
             self._create_data_files(data_file_name)
             return None
 
+        if not self._cache_is_current(data_file_name):
+            logging.info(f"{data_file_name} was written before Statewide " +
+                         "Unallocated rows were left out. Rebuilding it.")
+            self._create_data_files(data_file_name)
+            return None
+
         logging.debug(f"_load_data(): Loading data from {data_file_name}.")
         self._get_data_from_file(data_file_name)
         self._write_object_data_to_file("from_object.csv")
 
-    def _create_data_files(self, data_file_name: str):
-        logging.debug("_create_data_files(): Getting population data")
-        population = self._get_populations("population.csv")
-        median_age = self._get_median_age("state_median_age.csv")
+    def _cache_is_current(self, data_file_name: str) -> bool:
+        # data files written since the Statewide Unallocated rows are left
+        # out start with a header row. Older ones still count those deaths
+        with compressed.open_text(data_file_name, "utf-8") as data_file:
+            return data_file.readline().startswith("State,")
 
+    def _create_data_files(self, data_file_name: str):
+        # the data file holds what load_covid_data() builds, so it gives the
+        # same totals as every other loader
         deaths_url = "https://usafactsstatic.blob.core.windows.net/" + \
                      "public/data/covid-19/covid_deaths_usafacts.csv"
-        self._get_covid_data("deaths.csv", deaths_url)
+        if not compressed.exists("deaths.csv"):
+            self._get_web_data(deaths_url, "deaths.csv")
 
-        for state, data in self.data.items():
-            self.data[state].set_population(population[state])
-            self.data[state].set_median_age(median_age[state])
+        logging.debug("_create_data_files(): Building the data")
+        for state_data in load_covid_data("deaths.csv", "population.csv",
+                                          "state_median_age.csv").data.values():
+            self.add_state_data(state_data)
 
         self._write_object_data_to_file(data_file_name)
 
@@ -149,6 +191,7 @@ class StateCovidData:
             csv_columns = ["State", "Population", "Median Age", "Period", "Deaths"]
             writer = csv.DictWriter(data_file, fieldnames=csv_columns)
             logging.debug(f"_write_object_data_to_file(): Writing data to {file_name}")
+            writer.writeheader()
             for state, sdata in self.data.items():
                 st = state
                 pop = sdata.get_population()
@@ -165,13 +208,16 @@ class StateCovidData:
                     writer.writerow(row_data)
 
     def _get_data_from_file(self, file_name):
-        with open(file_name, "r", encoding="utf-8") as data_file:
+        with compressed.open_text(file_name, "utf-8") as data_file:
             logging.debug(f"_get_data_from_file(): Getting data from {file_name}")
             csv_columns = ["State", "Population", "Median Age", "Period", "Deaths"]
             reader = csv.DictReader(data_file, fieldnames=csv_columns)
 
             for r in reader:
                 # logging.debug(r)
+                if r["State"] == "State":
+                    # the header row
+                    continue
                 if r["State"] not in self.data:
                     self.data[r["State"]] = StateCovid(r["State"])
                     self.data[r["State"]].set_population(int(r["Population"]))
@@ -180,14 +226,15 @@ class StateCovidData:
                 self.data[r["State"]].add_deaths(r["Period"], int(r["Deaths"]))
 
     def _get_covid_data(self, file_name, url):
-        if not os.path.exists(file_name):
+        if not compressed.exists(file_name):
             self._get_web_data(url, file_name)
 
         start_month = 3
         end_month = 7
 
         logging.debug(f"_get_covid_data(): Read data from {file_name}")
-        with open(file_name, "r", encoding="utf-8-sig") as data_file:
+        negative_totals = 0
+        with compressed.open_text(file_name, "utf-8-sig") as data_file:
             data_file
             reader = csv.DictReader(data_file)
 
@@ -201,7 +248,10 @@ class StateCovidData:
                     logging.debug(f"_get_median_age: Key error, {k}")
                     state_flag = row["\ufeffcountyFIPS"]
 
-                if state_flag != 0:
+                # unallocated rows are left out, as validation.unallocated_rows
+                # does for the county matrices
+                if int(state_flag) != 0 and \
+                        "Unallocated" not in row["County Name"]:
                     # the data is cumulative by column, so I will subtract the
                     # last period from the current to get the amount.
                     date_key = self._format_date_key(start_month-1)
@@ -214,14 +264,20 @@ class StateCovidData:
 
                         state_data = self.data[row["State"]]
                         month_total = int(row[date_key]) - previous_value
+                        if month_total < 0:
+                            negative_totals += 1
                         
                         state_data.add_deaths(month, month_total)
 
                         self.data[row["State"]] = state_data
                         previous_value = int(row[date_key])
 
+        if negative_totals > 0:
+            logging.info(f"_get_covid_data(): {negative_totals} county " +
+                            f"months in {file_name} have negative deaths")
+
     def _get_populations(self, pop_file_name) -> dict:
-        if not os.path.exists(pop_file_name):
+        if not compressed.exists(pop_file_name):
             pop_url = "https://usafactsstatic.blob.core.windows.net/" + \
                       "public/data/covid-19/" + \
                       "covid_county_population_usafacts.csv"
@@ -229,7 +285,7 @@ class StateCovidData:
 
         state_totals = dict()
 
-        with open(pop_file_name, "r", encoding="utf-8") as data_file:
+        with compressed.open_text(pop_file_name, "utf-8") as data_file:
             reader = csv.DictReader(data_file)
             for p in reader:
                 if p["State"] in state_totals.keys():
@@ -240,22 +296,11 @@ class StateCovidData:
         return state_totals
     
     def _get_median_age(self, age_file_name):
-        if not os.path.exists(age_file_name):
+        if not compressed.exists(age_file_name):
             raise FileNotFoundError
 
-        state_median = defaultdict()
-
-        with open(age_file_name, encoding="utf-8") as data_file:
-            reader = csv.DictReader(data_file)
-
-            for p in reader:
-                try:
-                    state_median[p["State"]] = float(p["Median"])
-                except KeyError as k:
-                    logging.debug(f"_get_median_age: {k}")
-                    state_median[p["\ufeffState"]] = float(p["Median"])
-                
-        return state_median
+        # {state: median age} of the covariate table of the file
+        return covariates.read_table(age_file_name).as_dict()
 
     def _get_web_data(self, data_url, file_name: str):
         logging.debug("Getting data from remote.")
@@ -280,14 +325,37 @@ class StateCovidData:
         If the files exists, it is opened and the data is loaded into a
         str object and is returned with the data.
         """
-        if not os.path.exists(data_file_name):
+        if not compressed.exists(data_file_name):
             raise FileNotFoundError
 
-        with open(data_file_name, "r", encoding="utf-8") as original_file:
+        with compressed.open_text(data_file_name, "utf-8") as original_file:
             file_stuff = original_file.read()
 
         return file_stuff
 
+    def columns(self) -> dict:
+        """
+        The data as one NumPy array per column: state, population,
+        median_age and the deaths of every period, keyed by the period as
+        an int. The tables of the commands and the Arrow table of
+        arrow_export.state_table are built from these arrays. The median
+        ages are float32 in low memory mode.
+        """
+        states = list(self.data.values())
+        periods = sorted({int(p) for s in states for p in s.state_data})
+        columns = {
+            "state": np.array([s.state for s in states], dtype=str),
+            "population": np.array([s.population for s in states],
+                                   dtype=np.int64),
+            "median_age": np.array([s.median_age for s in states],
+                                   dtype=np.float32 if self.low_memory
+                                   else np.float64),
+        }
+        for period in periods:
+            columns[period] = np.array([s.state_data.get(period, 0)
+                                        for s in states], dtype=np.int64)
+        return columns
+
     def get_deaths_for_period(self, period):
         rates = []
         for key, obj in self.data.items():
@@ -310,21 +378,62 @@ class StateCovidData:
         return self.data[state]
 
 
+def covid_data_from_matrix(deaths_matrix, state_population: dict,
+                           median_age: dict,
+                           low_memory: bool = False) -> StateCovidData:
+    """
+    The monthly state deaths of a deaths matrix, joined with the state
+    populations and median ages.
+    """
+    covid_data = StateCovidData("no_file.txt", True)
+    covid_data.low_memory = low_memory
+    rollup = deaths_matrix.rollup()
+    monthly = {m: rollup.period_values("state", m)
+               for m in range(FIRST_MONTH, LAST_MONTH + 1)}
+
+    # the states in the order of the file, as the legacy loader adds them
+    index = {s: i for i, s in enumerate(rollup.names["state"].tolist()) if s}
+    for state in dict.fromkeys(deaths_matrix.state.tolist()):
+        if state not in index:
+            continue
+        i = index[state]
+        state_covid = StateCovid(state, state_population.get(state, 0),
+                                 median_age.get(state, 0))
+        for month, deaths in monthly.items():
+            state_covid.add_deaths(month, int(deaths[i]))
+        covid_data.add_state_data(state_covid)
+    return covid_data
+
+
+def load_covid_data(deaths_file: str = DEATHS_FILE,
+                    population_file: str = POPULATION_FILE,
+                    age_file: str = covariates.AGE_FILE, source: str = None,
+                    low_memory: bool = False) -> StateCovidData:
+    """
+    The StateCovidData of a deaths feed in any layout of sources.SOURCES.
+    The command line tools, the batch runner and the session all build
+    their deaths data from a CountyMatrix this way, so they report the same
+    state totals.
+    """
+    reader = StateCovidData("no_file.txt", True)
+    deaths = CountyMatrix.from_csv(deaths_file, source=source,
+                                   measure="deaths", low_memory=low_memory)
+    return covid_data_from_matrix(deaths,
+                                  reader._get_populations(population_file),
+                                  reader._get_median_age(age_file),
+                                  low_memory)
+
+
 def write_to_file(covid_data_df, outfile):
-    headers = covid_data_df.columns.values
+    # to_csv writes the float32 median ages of low memory mode as they are,
+    # where a row of Python floats would print 39.400001525878906
     if outfile is None:
         import sys
-        writer = csv.writer(sys.stdout)
-        writer.writerow(headers)
-        for index, row in covid_data_df.iterrows():
-            writer.writerow(row)
+        covid_data_df.to_csv(sys.stdout, index=False, lineterminator="\r\n")
     else:
         logging.debug(f"Writing data to {outfile}.")
-        with open(outfile, "w", encoding="utf-8") as outfile:
-            writer = csv.writer(outfile)
-            writer.writerow(headers)
-            for index, row in covid_data_df.iterrows():
-                writer.writerow(row)
+        with open(outfile, "w", encoding="utf-8", newline="") as outfile:
+            covid_data_df.to_csv(outfile, index=False, lineterminator="\r\n")
 
 
 def setup_logging():
@@ -394,18 +503,14 @@ def plot_line_chart(keys, values, state, population, median_age):
     plt.xticks(rotation=45)
     plt.show()
 
-def process_all_periods(covid_data, sort_order):
-    df = pd.DataFrame(columns=["state", "population", "median_age"])
-    for state, sdata in covid_data.data.items():
-        state_header = [state, sdata.get_population(), sdata.get_median_age()]
-        df_temp = pd.DataFrame([state_header], columns=["state", "population", "median_age"])
-
-        for key, val in sdata.state_data.items():
-            df_temp[key] = val
-
-        df = df.append(df_temp, ignore_index=True)
-        df.sort_values(by=sort_order)
-    return df
+def process_all_periods(covid_data, sort_order, store=None, matrix=None):
+    # one column per period, keyed by the period. a sort order that is not
+    # a column is a covariate of the store, a county covariate is weighted
+    # by the counties of the matrix
+    df = pd.DataFrame(covid_data.columns())
+    if sort_order not in df.columns:
+        df = store.join(df, [sort_order], matrix)
+    return df.sort_values(by=sort_order, kind="stable")
 
 
 def print_all_periods(covid_df, plot, outfile, sort_order):
@@ -450,14 +555,8 @@ def plot_data(x: list, y: list, sort_order):
     plt.show()
 
 
-def main():
-    setup_logging()
-
-    file_name = "covid_data.csv"
-
-    logging.debug("Create Data class.")
-    logging.debug(sys.getdefaultencoding())
-
+def build_parser():
+    # the command line of this script, also used by the session shell
     parser = argparse.ArgumentParser(
         description="Parse command line arguments")
 
@@ -468,24 +567,28 @@ def main():
                         help="Command to print")
 
     parser.add_argument("-l", "--location", dest="state",
-                        choices = ['HI','AK','WA','OR','CA','NV','ID','UT',
-                        'AZ','MT','WY','CO','NM','ND','SD','NE','KS','OK',
-                        'TX','MN','IA','MO','AR','LA','WI','MI','IL','IN',
-                        'KY','TN','MS','AL','GA','FL','SC','NC','VA','MD',
-                        'DE','DC','WV','OH','PA','NJ','NY','CT','RI','MA',
-                        'VT','NH','ME'],
+                        choices=CHOICES,
                         type=str, help="Two letter state code, e.g., TX or DC.")
 
     parser.add_argument("-s", "--sort", dest="sort_order",
                         type=str,
-                        choices=["population", "median_age", "state"],
                         default="population",
-                        help="Sorting can be done by population, median_age, or state.")
+                        help="Sorting can be done by population, median_age, " +
+                             "state or any state covariate.")
+
+    parser.add_argument("-c", "--covariates", dest="covariate_files",
+                        action="append", default=None,
+                        help="A per-state attribute file whose columns can " +
+                             "be sorted by. Can be given more than once")
 
     parser.add_argument("-f", "--file_name", dest="file_name",
                         type=str,
-                        help="File name for data file",
-                        default="covid.data.txt")
+                        help="A data file written by StateCovidData, such " +
+                             "as covid.data.txt, to read instead of " +
+                             f"{DEATHS_FILE}. covid.data.txt used to be " +
+                             "read by default, now it is only read when " +
+                             "given here",
+                        default=None)
 
     parser.add_argument("-o", "--ofile", dest="outfile",
                         type=str, default=None,
@@ -495,6 +598,11 @@ def main():
                         action="store_true", default=False,
                         help="Display a matplotlib plot")
 
+    parser.add_argument("-d", "--db", dest="db_file",
+                        type=str, default=None,
+                        help="SQLite database to aggregate the data in. " +
+                             "It is built when it does not exist.")
+
     parser.add_argument("-a", "--agg", dest="agg",
                         type=str,
                         choices=["total", "max", "all"],
@@ -502,7 +610,32 @@ def main():
                         help="The data can be returned as a total of all " +
                              "deaths, maximum value, or all periods separated.")
 
-    args = parser.parse_args()
+    parser.add_argument("--deaths-file", dest="deaths_file",
+                        type=str, default=None,
+                        help=f"County deaths feed, {DEATHS_FILE} by default")
+
+    parser.add_argument("--source", dest="source",
+                        type=str, choices=list(sources.SOURCES), default=None,
+                        help="Layout of the deaths feed, found from its " +
+                             "header when not given")
+
+    parser.add_argument("--low-memory", dest="low_memory",
+                        action="store_true", default=False,
+                        help="Store deaths as int32 and median ages as " +
+                             "float32 to save memory")
+
+    return parser
+
+
+def main():
+    setup_logging()
+
+    file_name = "covid_data.csv"
+
+    logging.debug("Create Data class.")
+    logging.debug(sys.getdefaultencoding())
+
+    args = build_parser().parse_args()
 
     command_param = args.command
     sort_order = args.sort_order
@@ -519,32 +652,135 @@ def main():
     logging.debug(f"Arg outfile = {outfile}")
     logging.debug(f"Arg state = {state}")
 
-    covid_data = StateCovidData(file_name)
+    default_feeds = args.deaths_file is None and args.source is None
+    if args.db_file is None and file_name is None and default_feeds and \
+            not args.low_memory:
+        # a table materialize.py saved for the data files is only read
+        import materialize
+        table = materialized_table(materialize.open_tables(), command_param,
+                                   agg, sort_order)
+        if table is not None:
+            show_table(table, command_param, sort_order, agg, plot, outfile)
+            return
+
+    if args.db_file is not None:
+        from sqlite_store import open_store
+        covid_data = open_store(args.db_file).covid_data()
+    elif file_name is not None:
+        covid_data = StateCovidData(file_name)
+    else:
+        covid_data = load_covid_data(args.deaths_file or DEATHS_FILE,
+                                     source=args.source,
+                                     low_memory=args.low_memory)
+    covid_data.low_memory = args.low_memory
+
+    deaths_matrix = None
+    if county_covariate(sort_order,
+                        covariates.load_store(args.covariate_files)):
+        # the county populations weight the covariate
+        deaths_matrix = load_deaths(args.deaths_file or DEATHS_FILE,
+                                    low_memory=args.low_memory,
+                                    source=args.source)
+
+    run_command(covid_data, command_param, sort_order, agg, state, plot,
+                outfile, args.covariate_files, deaths_matrix=deaths_matrix)
+
+
+def deaths_table(covid_data, agg, sort_order, store=None, matrix=None):
+    """
+    The frame of the print and deaths commands for an aggregation ("total",
+    "max" or "all"). A sort order that is not a column is a covariate of a
+    covariates.CovariateStore (covariates.load_store() by default), added
+    as a column. A county covariate is averaged over the counties of the
+    deaths matrix, weighted by their population. Tables are cached by the
+    versions of covid_data, the store and the matrix, so an edited
+    covariate file gives a new table, and every caller gets its own copy.
+    """
+    if store is None:
+        store = covariates.load_store()
+    return cached("deaths_table", [covid_data, store, matrix],
+                  [agg, sort_order],
+                  lambda: _deaths_table(covid_data, agg, sort_order,
+                                        store, matrix)).copy()
+
+
+def _deaths_table(covid_data, agg, sort_order, store=None, matrix=None):
+    if store is None and sort_order not in SORT_COLUMNS:
+        store = covariates.load_store()
+    if agg == "all":
+        return process_all_periods(covid_data, sort_order, store, matrix)
+
+    columns = covid_data.columns()
+    periods = [k for k in columns if isinstance(k, int)]
+    deaths = np.array([columns.pop(p) for p in periods], dtype=np.int64) \
+        .reshape(len(periods), len(columns["state"]))
+    if agg == "max" and periods:
+        columns["num_deaths"] = deaths.max(axis=0)
+    else:
+        columns["num_deaths"] = deaths.sum(axis=0)
 
-    if agg =="all":
-        cd_values = process_all_periods(covid_data, sort_order)
-        print_all_periods(cd_values, plot, outfile, sort_order)
-        return None
+    covid_data_df = pd.DataFrame(columns)
+    if sort_order not in covid_data_df.columns:
+        covid_data_df = store.join(covid_data_df, [sort_order], matrix)
+    return covid_data_df.sort_values(by=sort_order, kind="stable")
 
-    if agg == "max":
-        cd_values = covid_data.get_max_deaths()
-    else:
-        cd_values = covid_data.get_state_totals()
 
-    covid_data_df = pd.DataFrame(cd_values, 
-                                 columns=["state", "population",
-                                          "median_age", "num_deaths"])
-    covid_data_df = covid_data_df.sort_values(by=sort_order)
+def county_covariate(sort_order, store) -> bool:
+    # a county covariate needs the deaths matrix to be averaged by state
+    return sort_order not in SORT_COLUMNS and sort_order in store.names() \
+        and store.level(sort_order) == "county"
 
-    if command_param == "print":
-        write_to_file(covid_data_df, outfile)
+
+def materialized_table(tables, command_param, agg, sort_order):
+    """
+    The frame of a print or deaths command from materialized tables, or
+    None when it was not materialized.
+    """
+    import materialize
+    if tables is None or (command_param == "state" and agg != "all"):
         return None
+    return tables.get(materialize.deaths_name(agg, sort_order))
+
 
-    if command_param == "deaths":
+def show_table(covid_data_df, command_param, sort_order, agg, plot, outfile):
+    """
+    Prints, writes or plots the frame of the print and deaths commands.
+    """
+    if agg == "all":
+        print_all_periods(covid_data_df, plot, outfile, sort_order)
+    elif command_param == "print":
+        write_to_file(covid_data_df, outfile)
+    elif command_param == "deaths":
         covid_deaths(covid_data_df, sort_order, plot, outfile)
+
+
+def run_command(covid_data, command_param, sort_order, agg, state, plot,
+                outfile, covariate_files=None, tables=None,
+                deaths_matrix=None):
+    """
+    Runs one command against data that is already loaded. A frame that is
+    in the materialized tables is not worked out again. Sorting by a county
+    covariate needs the deaths matrix with its county populations.
+    """
+    table = materialized_table(tables, command_param, agg, sort_order)
+    if table is not None:
+        show_table(table, command_param, sort_order, agg, plot, outfile)
         return None
-    
-    if command_param == "state":
+
+    # the covariate files are read once for the whole command
+    store = covariates.load_store(covariate_files)
+    if sort_order not in SORT_COLUMNS:
+        names = [n for n in store.names() if n not in SORT_COLUMNS]
+        if sort_order not in names:
+            build_parser().error(f"unknown sort order {sort_order}. Sorting " +
+                                 "can be done by " +
+                                 f"{', '.join(SORT_COLUMNS + names)}")
+        if county_covariate(sort_order, store) and deaths_matrix is None:
+            build_parser().error(f"{sort_order} is a county covariate and " +
+                                 "needs the county deaths data, which is " +
+                                 "not loaded")
+
+    if command_param == "state" and agg != "all":
         if state is None:
             print("To create a pie chart, I need a state. Use the '-l' " +
                   "argument and supply a 2 letter state code.")
@@ -552,5 +788,10 @@ def main():
         state_data(covid_data, state, plot, outfile)
         return None
 
+    covid_data_df = deaths_table(covid_data, agg, sort_order, store,
+                                 deaths_matrix)
+    show_table(covid_data_df, command_param, sort_order, agg, plot, outfile)
+    return None
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,474 @@
+import csv
+import sys
+import calendar
+import logging
+import argparse
+import itertools
+import numpy as np
+import validation
+import state_registry
+from rollups import Rollup
+from delta_encoding import EncodedValues, encode
+from compressed import open_text
+from datetime import date, datetime
+
+CASES_FILE = "covid_confirmed_usafacts.csv"
+DEATHS_FILE = "deaths.csv"
+POPULATION_FILE = "covid_county_population_usafacts.csv"
+
+# the USAFacts files are cumulative, so a month is the difference between
+# the last day of the month and the last day of the month before it.
+FIRST_MONTH = 3
+LAST_MONTH = 7
+
+# dtypes of the low memory mode. Counts and FIPS codes fit in int32 and
+# populations in uint32
+LOW_MEMORY = {"fips": np.int32, "values": np.int32, "population": np.uint32}
+
+# every CountyMatrix gets its own version number, which query_cache uses to
+# tell datasets apart. Setting the population gives it a new one
+_versions = itertools.count(1)
+
+# arrays that can not be set again once a matrix is built
+_READ_ONLY = ("fips", "county", "state", "state_id", "dates", "values")
+
+
+def parse_date(text: str) -> date:
+    """
+    Converts a USAFacts column header such as 3/31/20 or 3/31/2020 to a date.
+    """
+    for fmt in ("%m/%d/%y", "%m/%d/%Y"):
+        try:
+            return datetime.strptime(text.strip(), fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date column: {text}")
+
+
+def month_end(month: int) -> date:
+    return date(2020, month, calendar.monthrange(2020, month)[1])
+
+
+class CountyMatrix:
+    """
+    Column oriented view of a cumulative USAFacts county file. Every county
+    is a row and every date is a column of the values matrix, with the
+    fips, county name, state and population held as parallel arrays.
+    Query results are cached by version. Setting the population gives the
+    matrix a new version; the other arrays can not be set again, and
+    methods such as take() return a new matrix instead.
+    """
+
+    def __init__(self, fips, county, state, dates, values, population=None):
+        self.fips = _ints(fips)
+        self.county = np.asarray(county, dtype=str)
+        self.state = np.asarray(state, dtype=str)
+        self.state_id = state_registry.encode(self.state)
+        self.dates = list(dates)
+        self.values = _ints(values)
+        self._rollup = None
+        if population is None:
+            population = np.zeros(len(self.fips), dtype=self.values.dtype)
+        self.population = population
+        self.version = next(_versions)
+
+    def __setattr__(self, name, value):
+        if name in _READ_ONLY and "version" in self.__dict__:
+            raise AttributeError(f"CountyMatrix.{name} can not be set, " +
+                                 "build a new matrix instead")
+        super().__setattr__(name, value)
+
+    def __repr__(self) -> str:
+        return (f"CountyMatrix({len(self.fips)} counties, " +
+                f"{len(self.dates)} dates)")
+
+    def __len__(self):
+        return len(self.fips)
+
+    @property
+    def population(self):
+        return self._population
+
+    @population.setter
+    def population(self, population):
+        # the rollup sums the populations, so it is built again on next use,
+        # and cached query results of the old populations are not used
+        self._population = _ints(population)
+        self._rollup = None
+        if "version" in self.__dict__:
+            self.version = next(_versions)
+
+    @property
+    def low_memory(self) -> bool:
+        return self.values.dtype == LOW_MEMORY["values"]
+
+    @classmethod
+    def from_csv(cls, file_name: str, population_file: str = None,
+                 drop_unallocated: bool = True, policy: str = "none",
+                 states=None, fips=None, start: date = None,
+                 end: date = None, low_memory: bool = False,
+                 source: str = None, measure: str = "cases"):
+        """
+        Reads a county feed. The layout is found from the header of the file
+        unless source names one of sources.SOURCES: a wide USAFacts file
+        (countyFIPS, County Name, State, stateFIPS and a column per date), a
+        wide JHU or long NYT file, or a .npz written by save(). measure is
+        the column to read from files that hold both cases and deaths.
+        Unallocated rows (see validation.unallocated_rows) are dropped by
+        default, as they are by every loader. When a population file is given, counties
+        without a population record are dropped as well. A .npz keeps its
+        own populations when no population file is given.
+
+        states and fips filters are applied while the file is scanned, so
+        rows that do not match are skipped before their numbers are
+        converted. With start and end dates, only the columns from the last
+        date on or before start up to end are kept.
+
+        The raw data is checked first and any problems are logged. policy is
+        one of validation.POLICIES and says how cumulative series that go
+        down are repaired; None skips the check.
+
+        With low_memory, the numbers are parsed straight into the small
+        dtypes of downcast().
+        """
+        import sources
+        dtype = LOW_MEMORY["values"] if low_memory else np.int64
+        source = sources.find(file_name, source)
+        fips, county, state, dates, values = source.scan(
+            file_name, states, fips, start, end, dtype, measure)
+
+        matrix = cls(fips, county, state, dates, values)
+        populations = None
+        if population_file is not None:
+            populations = read_population(population_file)
+        populations = source.populations(file_name, populations)
+        if policy is not None:
+            validation.log_report(validation.check(matrix, populations),
+                                  file_name)
+            matrix = validation.repair(matrix, policy)
+
+        if drop_unallocated:
+            matrix = matrix.take(np.flatnonzero(
+                ~validation.unallocated_rows(matrix)))
+        if populations is not None:
+            matrix = matrix.with_population(populations)
+        if low_memory:
+            matrix = matrix.downcast()
+        return matrix
+
+    def save(self, file_name: str, compact: bool = False):
+        """
+        Writes the matrix to a .npz file that load() reads back. With
+        compact, the values are delta encoded (see delta_encoding) and the
+        file is compressed, which makes it many times smaller.
+        """
+        arrays = dict(fips=self.fips, county=self.county, state=self.state,
+                      population=self.population,
+                      dates=np.array(self.dates, dtype="datetime64[D]"))
+        if compact:
+            np.savez_compressed(file_name, **arrays, **self.encode().arrays())
+        else:
+            np.savez(file_name, values=self.values, **arrays)
+
+    @classmethod
+    def load(cls, file_name: str):
+        with np.load(file_name) as data:
+            dates = data["dates"].astype(object).tolist()
+            if "deltas" in data:
+                values = EncodedValues.from_arrays(data).decode()
+            else:
+                values = data["values"]
+            return cls(data["fips"], data["county"], data["state"], dates,
+                       values, data["population"])
+
+    def encode(self):
+        """
+        The values as an EncodedValues, a fraction of their size in memory.
+        decode() gives them back.
+        """
+        return encode(self.values)
+
+    def with_population(self, populations: dict):
+        """
+        Returns the counties that have a record in a {fips: population}
+        dictionary, with their populations filled in.
+        """
+        known = np.array([f in populations for f in self.fips.tolist()],
+                         dtype=bool)
+        matrix = self
+        if not known.all():
+            logging.debug(f"with_population(): {len(known) - known.sum()} " +
+                          "counties have no population record")
+            matrix = self.take(np.flatnonzero(known))
+        return CountyMatrix(matrix.fips, matrix.county, matrix.state,
+                            matrix.dates, matrix.values,
+                            matrix.join(populations))
+
+    def downcast(self):
+        """
+        Returns a copy that stores FIPS codes and counts as int32 and
+        populations as uint32, half the memory of int64. Arrays whose values
+        do not fit are kept as they are.
+        """
+        arrays = dict()
+        for name, dtype in LOW_MEMORY.items():
+            array = getattr(self, name)
+            info = np.iinfo(dtype)
+            if len(array) and (array.min() < info.min or array.max() > info.max):
+                logging.warning(f"downcast(): {name} does not fit in {dtype}")
+                arrays[name] = array
+            else:
+                arrays[name] = array.astype(dtype)
+        return CountyMatrix(arrays["fips"], self.county, self.state,
+                            self.dates, arrays["values"],
+                            arrays["population"])
+
+    def nbytes(self) -> dict:
+        """
+        Bytes used by every component of the matrix, including the rollup
+        when it has been built.
+        """
+        sizes = {name: getattr(self, name).nbytes
+                 for name in ("fips", "county", "state", "state_id", "values",
+                              "population")}
+        sizes["dates"] = sys.getsizeof(self.dates) + \
+            sum(sys.getsizeof(d) for d in self.dates)
+        if self._rollup is not None:
+            sizes["rollup"] = self._rollup.nbytes()
+        return sizes
+
+    def take(self, rows):
+        """
+        Returns a new CountyMatrix holding only the given row indices.
+        """
+        return CountyMatrix(self.fips[rows], self.county[rows],
+                            self.state[rows], self.dates, self.values[rows],
+                            self.population[rows])
+
+    def on_dates(self, dates):
+        """
+        Returns a new CountyMatrix holding only the given date columns.
+        """
+        cols = [self.dates.index(d) for d in dates]
+        return CountyMatrix(self.fips, self.county, self.state, dates,
+                            self.values[:, cols], self.population)
+
+    def join(self, fips_values: dict, default=0):
+        """
+        Lines up a {fips: value} dictionary with the rows of the matrix.
+        """
+        return np.array([fips_values.get(f, default) for f in self.fips.tolist()])
+
+    def align_to(self, fips):
+        """
+        Returns a CountyMatrix with its rows reordered to match the given fips
+        array. Counties missing from this matrix are filled with zeros.
+        """
+        fips = np.asarray(fips, dtype=np.int64)
+        order = np.argsort(self.fips)
+        pos = np.searchsorted(self.fips, fips, sorter=order)
+        pos = np.clip(pos, 0, len(order) - 1)
+        rows = order[pos]
+        found = self.fips[rows] == fips
+
+        values = np.zeros((len(fips), len(self.dates)), dtype=self.values.dtype)
+        values[found] = self.values[rows[found]]
+        population = np.zeros(len(fips), dtype=self.population.dtype)
+        population[found] = self.population[rows[found]]
+        county = np.where(found, self.county[rows], "")
+        state = np.where(found, self.state[rows], "")
+        return CountyMatrix(fips, county, state, self.dates, values, population)
+
+    def date_column(self, day: date) -> int:
+        """
+        Index of the last column on or before the given day.
+        """
+        ordinals = np.array([d.toordinal() for d in self.dates])
+        col = np.searchsorted(ordinals, day.toordinal(), side="right") - 1
+        if col < 0:
+            raise KeyError(f"{day} is before the first date in the data")
+        return int(col)
+
+    def period_columns(self, month: int = None, start: date = None,
+                       end: date = None):
+        """
+        The (start, end) columns of a period. With a month, the period is
+        that month; with start and end dates, the days after start up to and
+        including end; with neither, March through July. A period that
+        starts before the first date or ends after the last date of the
+        matrix raises KeyError.
+        """
+        if month is not None:
+            start = month_end(month - 1)
+            end = month_end(month)
+        if start is None:
+            start = month_end(FIRST_MONTH - 1)
+        if end is None:
+            end = month_end(LAST_MONTH)
+
+        if self.dates and end > self.dates[-1]:
+            raise KeyError(f"{end} is after the last date in the data")
+        return self.date_column(start), self.date_column(end)
+
+    def period_values(self, month: int = None, start: date = None,
+                      end: date = None):
+        """
+        New counts per county for a period, see period_columns.
+        """
+        first, last = self.period_columns(month, start, end)
+        return self.values[:, last] - self.values[:, first]
+
+    def rollup(self):
+        """
+        The state, division, region and nation totals of this matrix. They
+        are built on first use and kept.
+        """
+        if self._rollup is None:
+            self._rollup = Rollup(self)
+        return self._rollup
+
+    def daily(self):
+        """
+        Daily new counts, one column per date.
+        """
+        return np.diff(self.values, axis=1, prepend=0)
+
+
+def _ints(array, dtype=np.int64):
+    # integer arrays keep their dtype, so downcast matrices stay small
+    array = np.asarray(array)
+    if array.dtype.kind in "iu":
+        return array
+    return array.astype(dtype)
+
+
+def date_window(dates, start: date = None, end: date = None):
+    """
+    The (first, last) slice of sorted dates that keeps the last date on or
+    before start up to end, so counts after start can still be worked out.
+    """
+    ordinals = np.array([d.toordinal() for d in dates])
+    first = 0
+    last = len(dates)
+    if start is not None:
+        first = max(int(np.searchsorted(ordinals, start.toordinal(),
+                                        side="right")) - 1, 0)
+    if end is not None:
+        last = int(np.searchsorted(ordinals, end.toordinal(), side="right"))
+    return first, last
+
+
+def _scan(file_name, states=None, fips=None, start=None, end=None,
+          dtype=np.int64):
+    """
+    Reads the rows of a wide USAFacts file that pass the filters. Only the
+    first four fields of a row are split off before the filters are checked.
+    """
+    logging.debug(f"_scan(): Reading {file_name}")
+    states = None if states is None else set(states)
+    fips = None if fips is None else set(int(f) for f in fips)
+
+    with open_text(file_name, "utf-8-sig") as data_file:
+        header = next(csv.reader([data_file.readline()]))
+        dates = [parse_date(d) for d in header[4:]]
+        first, last = date_window(dates, start, end)
+        dates = dates[first:last]
+
+        heads = []
+        rows = []
+        for line in data_file:
+            if '"' in line:
+                # quoted county names need the csv module
+                fields = next(csv.reader([line]))
+                head, numbers = fields[:4], fields[4:]
+            else:
+                fields = line.rstrip("\r\n").split(",", 4)
+                if len(fields) < 5:
+                    continue
+                head, numbers = fields[:4], None
+
+            if states is not None and head[2] not in states:
+                continue
+            if fips is not None and int(head[0]) not in fips:
+                continue
+
+            if numbers is None:
+                numbers = fields[4].split(",")
+            heads.append(head)
+            rows.append(numbers[first:last])
+
+    values = np.array(rows, dtype=dtype).reshape(len(rows), len(dates))
+    return (np.array([int(h[0]) for h in heads], dtype=np.int64),
+            np.array([h[1] for h in heads], dtype=str),
+            np.array([h[2] for h in heads], dtype=str),
+            dates, values)
+
+
+def read_population(file_name: str = POPULATION_FILE) -> dict:
+    """
+    Returns a {fips: population} dictionary from a USAFacts population file.
+    """
+    populations = dict()
+    with open_text(file_name, "utf-8-sig") as data_file:
+        reader = csv.reader(data_file)
+        next(reader)
+        for row in reader:
+            if row:
+                populations[int(row[0])] = int(row[3])
+    return populations
+
+
+def load_cases(file_name: str = CASES_FILE,
+               population_file: str = POPULATION_FILE, policy: str = "none",
+               low_memory: bool = False):
+    return CountyMatrix.from_csv(file_name, population_file, policy=policy,
+                                 low_memory=low_memory)
+
+
+def load_deaths(file_name: str = DEATHS_FILE,
+                population_file: str = POPULATION_FILE, policy: str = "none",
+                low_memory: bool = False, source: str = None):
+    return CountyMatrix.from_csv(file_name, population_file, policy=policy,
+                                 low_memory=low_memory, source=source,
+                                 measure="deaths")
+
+
+def footprint(datasets: dict) -> str:
+    """
+    A report of the bytes used by every component of every named matrix.
+    """
+    lines = [f"{'dataset':<10}{'component':<12}{'dtype':<8}{'bytes':>14}"]
+    total = 0
+    for name, matrix in datasets.items():
+        for component, size in matrix.nbytes().items():
+            array = getattr(matrix, component, None)
+            dtype = str(array.dtype) if isinstance(array, np.ndarray) else ""
+            lines.append(f"{name:<10}{component:<12}{dtype:<8}{size:>14,}")
+            total += size
+    lines.append(f"{'total':<30}{total:>14,}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memory used by the county matrices")
+
+    parser.add_argument("--low-memory", dest="low_memory",
+                        action="store_true", default=False,
+                        help="Store counts as int32 and populations as " +
+                             "uint32 to halve the memory used")
+
+    args = parser.parse_args()
+
+    cases = load_cases(low_memory=args.low_memory)
+    deaths = load_deaths(low_memory=args.low_memory)
+    cases.rollup()
+    deaths.rollup()
+    print(footprint({"cases": cases, "deaths": deaths}))
+    for name, matrix in (("cases", cases), ("deaths", deaths)):
+        print(f"{name} values delta encoded: {matrix.encode().nbytes():,} " +
+              "bytes")
+
+
+if __name__ == '__main__':
+    main()
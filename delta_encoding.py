@@ -0,0 +1,82 @@
+import numpy as np
+
+# daily changes are stored in this type. The few that do not fit are kept
+# apart as patches
+DELTA_DTYPE = np.int16
+
+
+class EncodedValues:
+    """
+    A compact form of a cumulative county x date matrix. Most counties are
+    zero for weeks before their first count and then change by small
+    amounts each day, so every row is kept as the column of its first
+    non-zero value (start) and the daily changes from there on, all rows
+    one after the other in one int16 array. Changes that do not fit in
+    int16 are stored as 0 there and listed in patch_at / patch.
+    """
+
+    def __init__(self, shape, dtype, start, deltas, patch_at, patch):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.start = np.asarray(start, dtype=np.int32)
+        self.deltas = np.asarray(deltas, dtype=DELTA_DTYPE)
+        self.patch_at = np.asarray(patch_at, dtype=np.int64)
+        self.patch = np.asarray(patch, dtype=np.int64)
+
+    def __repr__(self) -> str:
+        return (f"EncodedValues({self.shape[0]} x {self.shape[1]}, " +
+                f"{len(self.deltas)} deltas, {len(self.patch)} patches)")
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.start, self.deltas, self.patch_at,
+                                      self.patch))
+
+    def arrays(self) -> dict:
+        """
+        The arrays to save, see from_arrays.
+        """
+        return {"shape": np.array(self.shape), "dtype": np.array(self.dtype.str),
+                "start": self.start, "deltas": self.deltas,
+                "patch_at": self.patch_at, "patch": self.patch}
+
+    @classmethod
+    def from_arrays(cls, data):
+        return cls(data["shape"], str(data["dtype"]), data["start"],
+                   data["deltas"], data["patch_at"], data["patch"])
+
+    def _mask(self):
+        # True from the start column of every row on, in the order the
+        # deltas are stored in
+        return np.arange(self.shape[1]) >= self.start[:, np.newaxis]
+
+    def decode(self):
+        """
+        The full matrix. The deltas are scattered into a zero matrix and
+        summed along the rows, with no loop over the counties.
+        """
+        flat = self.deltas.astype(np.int64)
+        flat[self.patch_at] = self.patch
+        daily = np.zeros(self.shape, dtype=np.int64)
+        daily[self._mask()] = flat
+        return np.cumsum(daily, axis=1).astype(self.dtype, copy=False)
+
+
+def encode(values) -> EncodedValues:
+    """
+    Encodes a cumulative matrix, see EncodedValues.
+    """
+    values = np.asarray(values)
+    nonzero = values != 0
+    start = np.where(nonzero.any(axis=1), nonzero.argmax(axis=1),
+                     values.shape[1])
+
+    daily = np.diff(values.astype(np.int64), axis=1, prepend=0)
+    mask = np.arange(values.shape[1]) >= start[:, np.newaxis]
+    flat = daily[mask]
+
+    info = np.iinfo(DELTA_DTYPE)
+    patch_at = np.flatnonzero((flat < info.min) | (flat > info.max))
+    patch = flat[patch_at]
+    flat[patch_at] = 0
+    return EncodedValues(values.shape, values.dtype, start, flat, patch_at,
+                         patch)
@@ -0,0 +1,244 @@
+import csv
+import sys
+import argparse
+import logging
+import numpy as np
+import matplotlib.pyplot as plt
+from datetime import date
+from covid_matrix import load_cases, load_deaths, parse_date, footprint
+from rollups import LEVELS
+import state_registry
+
+METRICS = ["case_rate", "death_rate", "deaths_to_cases"]
+
+
+def top_k(values, k: int):
+    """
+    Indices of the k largest values, largest first. Uses a partial selection,
+    so only the k winners are sorted. NaN values are never selected.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    candidates = np.flatnonzero(~np.isnan(values))
+    if k <= 0 or len(candidates) == 0:
+        return np.array([], dtype=np.int64)
+
+    if k < len(candidates):
+        part = np.argpartition(-values[candidates], k - 1)[:k]
+        candidates = candidates[part]
+
+    return candidates[np.argsort(-values[candidates], kind="stable")]
+
+
+def top_k_per_group(values, groups, k: int):
+    """
+    Indices of the k largest values within every group, using a partial
+    selection inside each group. The result is ordered by group and then by
+    value, largest first. NaN values are never selected.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    groups = np.asarray(groups)
+    keep = np.flatnonzero(~np.isnan(values))
+    if k <= 0 or len(keep) == 0:
+        return np.array([], dtype=np.int64)
+
+    # bucket the rows by group, then select the k winners of every bucket
+    # with top_k, so no bucket is sorted in full
+    names, inverse = np.unique(groups[keep], return_inverse=True)
+    buckets = keep[np.argsort(inverse, kind="stable")]
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(names)))[:-1]
+    return np.concatenate([bucket[top_k(values[bucket], k)]
+                           for bucket in np.split(buckets, bounds)])
+
+
+def metric_values(metric: str, cases, deaths, population):
+    """
+    Unrounded version of the combined.calc_* rates for whole arrays. Rates
+    that can not be calculated (zero population or zero cases) are NaN.
+    """
+    cases = np.asarray(cases, dtype=np.float64)
+    deaths = np.asarray(deaths, dtype=np.float64)
+    population = np.asarray(population, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if metric == "case_rate":
+            rate = cases / population
+        elif metric == "death_rate":
+            rate = deaths / population
+        elif metric == "deaths_to_cases":
+            rate = deaths / cases
+        else:
+            raise ValueError(f"Unknown metric: {metric}")
+
+    rate[~np.isfinite(rate)] = np.nan
+    return rate
+
+
+def rank_hotspots(cases_matrix, deaths_matrix, metric: str = "case_rate",
+                  k: int = 10, level: str = "county", month: int = None,
+                  start: date = None, end: date = None, state: str = None,
+                  per_state: bool = False):
+    """
+    Returns the k counties or states with the highest metric for a period as
+    a list of (name, state, population, cases, deaths, rate) tuples. level is
+    one of rollups.LEVELS. With per_state, the k highest are returned for
+    every state.
+    """
+    if level == "county":
+        deaths_matrix = deaths_matrix.align_to(cases_matrix.fips)
+        cases = cases_matrix.period_values(month, start, end)
+        deaths = deaths_matrix.period_values(month, start, end)
+        population = cases_matrix.population
+        names = cases_matrix.county
+        states = cases_matrix.state
+        groups = cases_matrix.state_id
+    else:
+        rollup = cases_matrix.rollup()
+        names = rollup.names[level]
+        cases = rollup.period_values(level, month, start, end)
+        population = rollup.population[level]
+        d_rollup = deaths_matrix.rollup()
+        d_totals = dict(zip(d_rollup.names[level],
+                            d_rollup.period_values(level, month, start, end)))
+        deaths = np.array([d_totals.get(n, 0) for n in names])
+        states = names
+        groups = np.arange(len(names))
+
+    rate = metric_values(metric, cases, deaths, population)
+
+    if state is not None:
+        rate = np.where(states == state, rate, np.nan)
+
+    if per_state:
+        rows = top_k_per_group(rate, groups, k)
+    else:
+        rows = top_k(rate, k)
+
+    return [(names[i], states[i], int(population[i]), int(cases[i]),
+             int(deaths[i]), round(float(rate[i]), 4)) for i in rows]
+
+
+def top_write(ranking, metric, outfile):
+    headers = ["name", "state", "population", "cases", "deaths", metric]
+    if outfile is None:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(headers)
+        writer.writerows(ranking)
+    else:
+        logging.debug(f"Writing data to {outfile}.")
+        with open(outfile, "w", newline="", encoding="utf-8") as output:
+            writer = csv.writer(output)
+            writer.writerow(headers)
+            writer.writerows(ranking)
+
+
+def plot_top(ranking, metric, level):
+    labels = [f"{r[0]}, {r[1]}" if level == "county" else r[0]
+              for r in ranking]
+    values = [r[5] for r in ranking]
+
+    fig, ax = plt.subplots()
+    ax.barh(labels[::-1], values[::-1])
+    ax.set_title(f"Highest {metric.replace('_', ' ')} by {level}")
+    ax.set_xlabel(metric)
+    plt.tight_layout()
+    plt.show()
+
+
+def top(args, cases_matrix=None, deaths_matrix=None):
+    # what happens when the command 'top' is given
+    low_memory = getattr(args, "low_memory", False)
+    if cases_matrix is None:
+        cases_matrix = load_cases(low_memory=low_memory)
+    if deaths_matrix is None:
+        deaths_matrix = load_deaths(low_memory=low_memory)
+    logging.debug("top(): memory used\n" +
+                  footprint({"cases": cases_matrix, "deaths": deaths_matrix}))
+
+    start = parse_date(args.start) if args.start else None
+    end = parse_date(args.end) if args.end else None
+
+    ranking = rank_hotspots(cases_matrix, deaths_matrix, args.metric, args.k,
+                            args.level, args.month, start, end,
+                            args.state, args.per_state)
+
+    top_write(ranking, args.metric, args.outfile)
+
+    if args.plot:
+        plot_top(ranking, args.metric, args.level)
+
+    return ranking
+
+
+def parse_my_args(input):
+    parser = argparse.ArgumentParser(
+        description="Counties or states with the highest rates")
+
+    parser.add_argument("command", metavar="<command>",
+                        choices=["top"],
+                        help="Command to run")
+
+    parser.add_argument("-k", dest="k", type=int, default=10,
+                        help="How many counties or states to return")
+
+    parser.add_argument("-r", "--rate", dest="metric",
+                        choices=METRICS, default="case_rate",
+                        help="The rate to rank by")
+
+    parser.add_argument("-g", "--level", dest="level",
+                        choices=LEVELS[:-1], default="county",
+                        help="Rank counties, states, census divisions " +
+                             "or census regions")
+
+    parser.add_argument("-m", "--month", dest="month",
+                        type=int, choices=[3, 4, 5, 6, 7],
+                        help="Month to rank. Defaults to March - July.")
+
+    parser.add_argument("--start", dest="start", type=str,
+                        help="Start date, e.g. 5/14/20. Counts after this day.")
+
+    parser.add_argument("--end", dest="end", type=str,
+                        help="End date, e.g. 5/21/20. Counts up to this day.")
+
+    parser.add_argument("-l", "--location", dest="state", type=str,
+                        choices=state_registry.CHOICES,
+                        help="Only rank counties in this state")
+
+    parser.add_argument("--per-state", dest="per_state",
+                        action="store_true", default=False,
+                        help="Return the top k counties of every state")
+
+    parser.add_argument("-o", "--ofile", dest="outfile", type=str,
+                        default=None,
+                        help="The file to which output should be written")
+
+    parser.add_argument("-p", "--plot", dest="plot",
+                        action="store_true", default=False,
+                        help="Display a matplotlib plot")
+
+    parser.add_argument("--low-memory", dest="low_memory",
+                        action="store_true", default=False,
+                        help="Store counts as int32 and populations as " +
+                             "uint32 to halve the memory used")
+
+    args = parser.parse_args(input)
+    # the options only pick counties, so they mean nothing at other levels
+    if args.level != "county":
+        if args.per_state:
+            parser.error("--per-state only works with -g county")
+        if args.state is not None:
+            parser.error("-l only works with -g county")
+
+    logging.debug(f"Args is {args}")
+
+    return args
+
+
+def main():
+    args = parse_my_args(sys.argv[1:])
+
+    if args.command == "top":
+        top(args)
+
+
+if __name__ == '__main__':
+    main()
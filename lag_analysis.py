@@ -0,0 +1,155 @@
+import sys
+import csv
+import argparse
+import numpy as np
+from covid_matrix import load_cases, load_deaths
+
+# deaths are usually reported two to four weeks after the cases
+MAX_LAG = 45
+
+
+class LagResult:
+    """
+    Lagged deaths-to-cases ratios of every state. correlation and ratios have
+    one row per state and one column per lag (0 to max_lag days). best_lag is
+    the lag at which daily deaths correlate best with daily cases and
+    best_ratio is the ratio at that lag.
+    """
+
+    def __init__(self, states, correlation, ratios):
+        self.states = states
+        self.lags = np.arange(correlation.shape[1])
+        self.correlation = correlation
+        self.ratios = ratios
+        self.best_lag = np.argmax(np.nan_to_num(correlation, nan=-np.inf),
+                                  axis=1)
+        self.best_ratio = ratios[np.arange(len(states)), self.best_lag]
+
+    def __repr__(self) -> str:
+        return f"LagResult({len(self.states)} states, lags 0-{self.lags[-1]})"
+
+    def best_ratios(self) -> dict:
+        return {str(s): round(float(r), 4)
+                for s, r in zip(self.states, self.best_ratio)}
+
+    def rows(self):
+        for i, state in enumerate(self.states):
+            yield (str(state), int(self.best_lag[i]),
+                   round(float(self.correlation[i, self.best_lag[i]]), 4),
+                   round(float(self.ratios[i, 0]), 4),
+                   round(float(self.best_ratio[i]), 4))
+
+
+def state_series(cases_matrix, deaths_matrix):
+    """
+    Cumulative state series of cases and deaths on the dates and states the
+    two matrices have in common.
+    """
+    cases_rollup = cases_matrix.rollup()
+    deaths_rollup = deaths_matrix.rollup()
+
+    states = np.intersect1d(cases_rollup.names["state"],
+                            deaths_rollup.names["state"])
+    c_rows = np.searchsorted(cases_rollup.names["state"], states)
+    d_rows = np.searchsorted(deaths_rollup.names["state"], states)
+
+    dates = sorted(set(cases_matrix.dates) & set(deaths_matrix.dates))
+    c_cols = [cases_matrix.dates.index(d) for d in dates]
+    d_cols = [deaths_matrix.dates.index(d) for d in dates]
+
+    cases = cases_rollup.values["state"][np.ix_(c_rows, c_cols)]
+    deaths = deaths_rollup.values["state"][np.ix_(d_rows, d_cols)]
+    return states, dates, cases, deaths
+
+
+def cross_correlation(deaths_daily, cases_daily, max_lag: int = MAX_LAG):
+    """
+    Normalised cross-correlation of every row of deaths with the same row of
+    cases shifted by 0 to max_lag days, from one FFT of the whole matrix.
+    """
+    days = deaths_daily.shape[1]
+    x = deaths_daily - deaths_daily.mean(axis=1, keepdims=True)
+    y = cases_daily - cases_daily.mean(axis=1, keepdims=True)
+
+    # zero padding to twice the length keeps the correlation linear
+    n = 1 << int(np.ceil(np.log2(2 * days)))
+    spectrum = np.fft.rfft(x, n, axis=1) * np.conj(np.fft.rfft(y, n, axis=1))
+    corr = np.fft.irfft(spectrum, n, axis=1)[:, :max_lag + 1]
+
+    norm = np.sqrt((x ** 2).sum(axis=1) * (y ** 2).sum(axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return corr / norm[:, np.newaxis]
+
+
+def lagged_ratios(cases, deaths, first: int, last: int,
+                  max_lag: int = MAX_LAG):
+    """
+    Deaths after column first up to column last divided by the cases of the
+    same window moved back by every lag from 0 to max_lag days.
+    """
+    padded = np.concatenate([np.zeros((cases.shape[0], max_lag)), cases],
+                            axis=1)
+    lags = np.arange(max_lag + 1)
+    window_cases = padded[:, last + max_lag - lags] - \
+        padded[:, first + max_lag - lags]
+    window_deaths = (deaths[:, last] - deaths[:, first])[:, np.newaxis]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = window_deaths / window_cases
+    ratios[~np.isfinite(ratios)] = np.nan
+    return ratios
+
+
+def analyze(cases_matrix, deaths_matrix, period: int = None,
+            max_lag: int = MAX_LAG):
+    """
+    Lagged deaths-to-cases ratios for every state and every lag from 0 to
+    max_lag days, for a month or for March - July when period is None.
+    """
+    states, dates, cases, deaths = state_series(cases_matrix, deaths_matrix)
+    cases = cases.astype(np.float64)
+    deaths = deaths.astype(np.float64)
+
+    correlation = cross_correlation(np.diff(deaths, axis=1, prepend=0),
+                                    np.diff(cases, axis=1, prepend=0),
+                                    max_lag)
+
+    first, last = cases_matrix.period_columns(period)
+    first = dates.index(cases_matrix.dates[first])
+    last = dates.index(cases_matrix.dates[last])
+    ratios = lagged_ratios(cases, deaths, first, last, max_lag)
+
+    return LagResult(states, correlation, ratios)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Lagged deaths-to-cases ratios by state")
+
+    parser.add_argument("-m", "--month", dest="month", type=int,
+                        choices=[3, 4, 5, 6, 7],
+                        help="Month to use. Defaults to March - July.")
+
+    parser.add_argument("-x", "--max-lag", dest="max_lag", type=int,
+                        default=MAX_LAG,
+                        help="Largest lag in days")
+
+    parser.add_argument("--low-memory", dest="low_memory",
+                        action="store_true", default=False,
+                        help="Store counts as int32 and populations as " +
+                             "uint32 to halve the memory used")
+
+    args = parser.parse_args()
+
+    result = analyze(load_cases(low_memory=args.low_memory),
+                     load_deaths(low_memory=args.low_memory),
+                     args.month, args.max_lag)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["state", "best_lag", "correlation", "ratio_lag_0",
+                     "ratio_best_lag"])
+    writer.writerows(result.rows())
+
+
+if __name__ == '__main__':
+    main()
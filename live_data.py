@@ -0,0 +1,195 @@
+import os
+import logging
+import threading
+from types import MappingProxyType
+import combined
+import materialize
+import compressed
+from batch import BatchData
+from covid_matrix import CASES_FILE, DEATHS_FILE, POPULATION_FILE
+
+AGE_FILE = "state_median_age.csv"
+
+# seconds between checks of the source files
+INTERVAL = 60
+
+
+def signature(files) -> tuple:
+    """
+    (file, modification time, size) of every source file. Missing files
+    have a time and size of None.
+    """
+    sig = []
+    for file_name in files:
+        try:
+            stat = os.stat(compressed.resolve(file_name))
+            sig.append((file_name, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            sig.append((file_name, None, None))
+    return tuple(sig)
+
+
+def _freeze(matrix):
+    # readers share the arrays, so nobody may write to them. The rollup is
+    # built now and frozen too
+    rollup = matrix.rollup()
+    arrays = [matrix.fips, matrix.county, matrix.state, matrix.state_id,
+              matrix.values, matrix.population, rollup.state_id]
+    for level in rollup.names:
+        arrays += [rollup.names[level], rollup.values[level],
+                   rollup.population[level]]
+    for array in arrays:
+        array.flags.writeable = False
+    return matrix
+
+
+def _freeze_covid_data(covid_data):
+    # the states and their deaths become read only views, so adding a state
+    # or deaths raises a TypeError
+    for state in covid_data.data.values():
+        state.state_data = MappingProxyType(state.state_data)
+    covid_data.data = MappingProxyType(covid_data.data)
+    return covid_data
+
+
+class Snapshot(BatchData):
+    """
+    One complete, read only version of the datasets. A snapshot is built in
+    full before anyone can see it and is never changed afterwards, so a query
+    that holds on to it sees the same data from start to finish.
+
+    The arrays of the matrices and their rollups and the deaths of every
+    state are read only. The population and median age of a state are plain
+    attributes, so set_population() and set_median_age() must not be called
+    on them. tables.get() returns a copy of a table, but tables.put() must
+    not be called once the snapshot is served.
+    """
+
+    def __init__(self, version: int, sources: tuple, cases, deaths,
+                 covid_data):
+        super().__init__(_freeze(cases), _freeze(deaths),
+                         _freeze_covid_data(covid_data))
+        self.version = version
+        self.sources = sources
+
+    def __repr__(self) -> str:
+        return f"Snapshot(version {self.version}, {self.cases}, {self.deaths})"
+
+
+class LiveDataset:
+    """
+    Serves the latest snapshot of the datasets to long running consumers.
+    reload() builds a new snapshot when a source file has changed and swaps
+    it in with a single assignment, so current() returns either the old or
+    the new snapshot, never a partly loaded one. start() checks the files in
+    a background thread. With materialize, every report table of a new
+    snapshot is built into its tables before the snapshot is swapped in.
+    """
+
+    def __init__(self, cases_file: str = CASES_FILE,
+                 deaths_file: str = DEATHS_FILE,
+                 population_file: str = POPULATION_FILE,
+                 age_file: str = AGE_FILE, interval: float = INTERVAL,
+                 materialize: bool = False, low_memory: bool = False):
+        self.cases_file = cases_file
+        self.deaths_file = deaths_file
+        self.population_file = population_file
+        self.age_file = age_file
+        self.interval = interval
+        self.materialize = materialize
+        self.low_memory = low_memory
+        self.files = (cases_file, deaths_file, population_file, age_file)
+
+        self._snapshot = None
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reload()
+
+    def __repr__(self) -> str:
+        return f"LiveDataset({self._snapshot})"
+
+    def current(self) -> Snapshot:
+        """
+        The latest snapshot. Take it once per query and use it throughout.
+        """
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def _build(self, version: int, sources: tuple) -> Snapshot:
+        # the same loader as the combined script, so the snapshot gives the
+        # same numbers as the command line tools
+        covid_data, cases, deaths = combined.load_combined(
+            self.cases_file, self.deaths_file, self.population_file,
+            self.age_file, self.low_memory)
+        snapshot = Snapshot(version, sources, cases, deaths, covid_data)
+        if self.materialize:
+            # the report tables are ready before the snapshot is served
+            snapshot.tables = materialize.materialize(
+                snapshot.cases, snapshot.covid_data, snapshot.deaths)
+        return snapshot
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Builds and swaps in a new snapshot if the source files changed since
+        the current one was built. Returns True when a new snapshot was
+        swapped in. If the files change again while they are read, the new
+        snapshot is thrown away and the next check tries again.
+        """
+        with self._reload_lock:
+            sources = signature(self.files)
+            current = self._snapshot
+            if current is not None and not force and \
+                    sources == current.sources:
+                return False
+
+            version = 1 if current is None else current.version + 1
+            logging.debug(f"LiveDataset.reload(): building version {version}")
+            try:
+                snapshot = self._build(version, sources)
+            except Exception:
+                if current is None:
+                    raise
+                logging.exception("LiveDataset.reload(): reload failed, " +
+                                  f"keeping version {current.version}")
+                return False
+
+            if signature(self.files) != sources:
+                logging.warning("LiveDataset.reload(): source files changed " +
+                                "while loading, will try again")
+                if current is not None:
+                    return False
+
+            self._snapshot = snapshot
+            logging.info(f"LiveDataset.reload(): now serving version {version}")
+            return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            self.reload()
+
+    def start(self):
+        """
+        Starts checking the source files every interval seconds.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch,
+                                            name="LiveDataset", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,217 @@
+import os
+import copy
+import time
+import pickle
+import hashlib
+import logging
+import argparse
+import covid_cases
+import covid_deaths
+import combined
+import state_registry
+from pipeline import file_hash
+from covariates import AGE_FILE
+from covid_matrix import (FIRST_MONTH, LAST_MONTH, CASES_FILE, DEATHS_FILE,
+                          POPULATION_FILE)
+
+MONTHS = list(range(FIRST_MONTH, LAST_MONTH + 1))
+SORT_ORDERS = ["population", "median_age", "state"]
+AGGREGATIONS = ["total", "max", "all"]
+
+# the files every table is worked out from, and the folder the tables of
+# each version of them are saved in
+INPUT_FILES = (CASES_FILE, DEATHS_FILE, POPULATION_FILE, AGE_FILE)
+TABLE_DIR = "materialized"
+
+# written when every table of a folder is saved
+DONE_FILE = "done"
+
+
+def rates_name(month, state=None) -> str:
+    # the rates of the covid_cases 'states' command, or of its 'months'
+    # command when a state is given
+    if state is None:
+        return f"states {int(month)}"
+    return f"months {int(month)} {state}"
+
+
+def deaths_name(agg, sort_order) -> str:
+    return f"deaths {agg} {sort_order}"
+
+
+def combined_name(period, sort_order) -> str:
+    return f"combined {period} {sort_order}"
+
+
+def totals_name(period) -> str:
+    return f"totals {period}"
+
+
+class TableStore:
+    """
+    The report tables of one version of the data files. With a folder every
+    table is a pickle file in it, so the command line tools read a table
+    that materialize.py saved instead of the data files. Without a folder
+    the tables are kept in memory. The state_rates() and county_rates()
+    lookups are the ones of SqliteStore, so covid_cases can use either.
+    """
+
+    def __init__(self, folder: str = None):
+        self.folder = folder
+        self.tables = dict()
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f"TableStore({self.folder or 'memory'}, {len(self)} tables)"
+
+    def __len__(self) -> int:
+        if self.folder is None:
+            return len(self.tables)
+        return len([f for f in os.listdir(self.folder) if f.endswith(".pkl")])
+
+    def __contains__(self, name) -> bool:
+        if self.folder is None:
+            return name in self.tables
+        return os.path.exists(self._path(name))
+
+    def _path(self, name):
+        return os.path.join(self.folder, name.replace(" ", "_") + ".pkl")
+
+    def get(self, name: str):
+        """
+        A copy of a table, or None when it was not materialized.
+        """
+        if self.folder is None:
+            return copy.copy(self.tables.get(name))
+        try:
+            with open(self._path(name), "rb") as table_file:
+                return pickle.load(table_file)
+        except FileNotFoundError:
+            return None
+
+    def put(self, name: str, table):
+        if self.folder is None:
+            self.tables[name] = table
+            return
+        # a reader never finds a partly written file
+        path = self._path(name)
+        with open(path + ".tmp", "wb") as table_file:
+            pickle.dump(table, table_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def complete(self) -> bool:
+        return self.folder is None or \
+            os.path.exists(os.path.join(self.folder, DONE_FILE))
+
+    def finish(self):
+        if self.folder is not None:
+            with open(os.path.join(self.folder, DONE_FILE), "w") as done:
+                done.write(f"{len(self)}\n")
+
+    def state_rates(self, which_month):
+        return self.get(rates_name(which_month))
+
+    def county_rates(self, which_month, which_state):
+        return self.get(rates_name(which_month, which_state))
+
+
+def table_folder(files=INPUT_FILES, root: str = TABLE_DIR) -> str:
+    """
+    The folder of the tables of the files, named after a hash of their
+    contents. The tables of edited files go to another folder.
+    """
+    digest = hashlib.sha256()
+    for file_name in files:
+        digest.update(file_hash(file_name).encode())
+    return os.path.join(root, digest.hexdigest()[:16])
+
+
+def open_tables(files=INPUT_FILES, root: str = TABLE_DIR):
+    """
+    The saved tables of the files, or None when materialize.py has not
+    finished saving them for this version of the files.
+    """
+    try:
+        folder = table_folder(files, root)
+    except FileNotFoundError:
+        return None
+    if not os.path.exists(os.path.join(folder, DONE_FILE)):
+        return None
+    logging.debug(f"open_tables(): reading tables from {folder}")
+    return TableStore(folder)
+
+
+def report_tables(cases, covid_data, deaths):
+    """
+    (name, compute) for every table the command line tools can ask for:
+    the 'states' rates of every month, the 'months' rates of every state
+    and month, the deaths tables of every aggregation and sort order, the
+    combined frame of every period and sort order and the national totals
+    of every period. The tables are worked out without the query cache.
+    """
+    states = [s for s in cases.rollup().names["state"].tolist()
+              if s in state_registry.CHOICES]
+
+    for month in MONTHS:
+        yield (rates_name(month),
+               lambda m=month: covid_cases._state_rates(cases, m))
+        for state in states:
+            yield (rates_name(month, state),
+                   lambda m=month, s=state: covid_cases._county_rates(cases,
+                                                                     m, s))
+
+    for agg in AGGREGATIONS:
+        for sort_order in SORT_ORDERS:
+            yield (deaths_name(agg, sort_order),
+                   lambda a=agg, o=sort_order:
+                   covid_deaths._deaths_table(covid_data, a, o))
+
+    for period in [None] + MONTHS:
+        for sort_order in SORT_ORDERS:
+            yield (combined_name(period, sort_order),
+                   lambda p=period, o=sort_order:
+                   combined._covid_for_states(covid_data, o, p, cases))
+        yield (totals_name(period),
+               lambda p=period: combined.national_totals(cases, deaths, p))
+
+
+def materialize(cases, covid_data, deaths, tables: TableStore = None):
+    """
+    Computes every report table of the datasets and puts it in a table
+    store, in memory unless one is given. Returns the store.
+    """
+    if tables is None:
+        tables = TableStore()
+    start = time.perf_counter()
+    for name, compute in report_tables(cases, covid_data, deaths):
+        logging.debug(f"materialize(): {name}")
+        tables.put(name, compute())
+    tables.finish()
+
+    logging.info(f"materialize(): {len(tables)} tables in " +
+                 f"{time.perf_counter() - start:.2f}s")
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build every report table and save it for the " +
+                    "command line tools")
+
+    parser.add_argument("-d", "--dir", dest="root", type=str,
+                        default=TABLE_DIR,
+                        help="Folder to save the tables in")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # the hash is taken before the files are read
+    folder = table_folder(root=args.root)
+    covid_data, cases, deaths = combined.load_combined()
+    tables = materialize(cases, covid_data, deaths, TableStore(folder))
+    print(f"Saved {len(tables)} tables in {folder}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+import os
+import csv
+import calendar
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import pandas as pd
+from functools import partial
+from matplotlib.figure import Figure
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import combined
+import compressed
+import covid_cases
+import covid_deaths
+import small_multiples
+from covid_deaths import StateCovidData
+from covid_matrix import (CountyMatrix, read_population, CASES_FILE,
+                          DEATHS_FILE, POPULATION_FILE, FIRST_MONTH,
+                          LAST_MONTH)
+
+OUT_DIR = "pipeline_out"
+STATE_FILE = "pipeline.json"
+AGE_FILE = "state_median_age.csv"
+
+BASE_URL = "https://usafactsstatic.blob.core.windows.net/public/data/covid-19/"
+URLS = {CASES_FILE: BASE_URL + "covid_confirmed_usafacts.csv",
+        DEATHS_FILE: BASE_URL + "covid_deaths_usafacts.csv",
+        POPULATION_FILE: BASE_URL + "covid_county_population_usafacts.csv"}
+
+MONTHS = list(range(FIRST_MONTH, LAST_MONTH + 1))
+
+
+def file_hash(file_name: str) -> str:
+    """
+    sha256 of the contents of a file (or of its compressed copy).
+    """
+    digest = hashlib.sha256()
+    with open(compressed.resolve(file_name), "rb") as data_file:
+        for block in iter(lambda: data_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Stage:
+    """
+    One step of a pipeline. run(inputs, outputs) reads the input files and
+    writes every output file. The key of a stage is a hash of its name, its
+    params and the contents of its inputs; a stage whose key and outputs
+    are the same as on the last run is skipped. always stages, such as
+    downloads, run every time, but the stages after them still skip when
+    their output did not change.
+    """
+
+    def __init__(self, name: str, run, inputs: list, outputs: list,
+                 params=None, always: bool = False):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params
+        self.always = always
+
+    def __repr__(self) -> str:
+        return f"Stage('{self.name}', {self.inputs} -> {self.outputs})"
+
+    def key(self, input_hashes: dict) -> str:
+        text = json.dumps([self.name, self.params, input_hashes],
+                          sort_keys=True, default=str)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Pipeline:
+    """
+    Runs stages in dependency order. A stage depends on the stages that
+    write its inputs, and stages that do not depend on each other run at the
+    same time in a thread pool. The keys and output hashes of the last run
+    are kept in state_file.
+    """
+
+    def __init__(self, stages: list, state_file: str):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_file = state_file
+        self.state = self._read_state()
+
+        producers = {out: stage.name for stage in stages
+                     for out in stage.outputs}
+        self.depends = {stage.name: {producers[i] for i in stage.inputs
+                                     if i in producers}
+                        for stage in stages}
+
+    def __repr__(self) -> str:
+        return f"Pipeline({list(self.stages)})"
+
+    def _read_state(self) -> dict:
+        if not os.path.exists(self.state_file):
+            return dict()
+        with open(self.state_file, "r", encoding="utf-8") as state_file:
+            return json.load(state_file)
+
+    def _write_state(self):
+        folder = os.path.dirname(self.state_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as state_file:
+            json.dump(self.state, state_file, indent=2, sort_keys=True)
+        os.replace(temp_file, self.state_file)
+
+    def _up_to_date(self, stage: Stage, key: str) -> bool:
+        record = self.state.get(stage.name)
+        if stage.always or record is None or record["key"] != key:
+            return False
+        return all(compressed.exists(f) and file_hash(f) == h
+                   for f, h in record["outputs"].items())
+
+    def _run_stage(self, stage: Stage, force: bool) -> str:
+        input_hashes = {f: file_hash(f) for f in stage.inputs}
+        key = stage.key(input_hashes)
+        if not force and self._up_to_date(stage, key):
+            logging.debug(f"Pipeline: {stage.name} is up to date")
+            return "skipped"
+
+        logging.info(f"Pipeline: running {stage.name}")
+        for out in stage.outputs:
+            if os.path.dirname(out):
+                os.makedirs(os.path.dirname(out), exist_ok=True)
+        stage.run(stage.inputs, stage.outputs)
+
+        # one dict entry per stage, so the threads do not clash
+        self.state[stage.name] = {
+            "key": key, "inputs": input_hashes,
+            "outputs": {f: file_hash(f) for f in stage.outputs}}
+        return "ran"
+
+    def run(self, max_workers: int = None, force: bool = False) -> dict:
+        """
+        Runs or skips every stage. Returns {stage: "ran", "skipped",
+        "failed" or "blocked"}; blocked stages depend on a stage that failed.
+        """
+        results = dict()
+        pending = dict(self.stages)
+        running = dict()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or running:
+                for name in list(pending):
+                    states = [results.get(d) for d in self.depends[name]]
+                    if any(s in ("failed", "blocked") for s in states):
+                        results[name] = "blocked"
+                        del pending[name]
+                    elif all(s in ("ran", "skipped") for s in states):
+                        future = pool.submit(self._run_stage,
+                                             pending.pop(name), force)
+                        running[future] = name
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        logging.exception(f"Pipeline: {name} failed")
+                        results[name] = "failed"
+
+        self._write_state()
+        return results
+
+
+def _download(inputs, outputs, url):
+    StateCovidData("no_file.txt", True)._get_web_data(url, outputs[0])
+
+
+def _parse(inputs, outputs, measure="cases"):
+    population_file = inputs[1] if len(inputs) > 1 else None
+    CountyMatrix.from_csv(inputs[0], population_file,
+                          measure=measure).save(outputs[0], compact=True)
+
+
+def _covid_data(deaths_file, population_file, age_file):
+    reader = StateCovidData("no_file.txt", True)
+    return covid_deaths.covid_data_from_matrix(
+        CountyMatrix.load(deaths_file),
+        reader._get_populations(population_file),
+        reader._get_median_age(age_file))
+
+
+def _aggregate_states(inputs, outputs):
+    # infection rates of the 'states' command for every month
+    cases = CountyMatrix.load(inputs[0])
+    rates = {m: covid_cases.state_rates(cases, m) for m in MONTHS}
+
+    with open(outputs[0], "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(["state", "population"] +
+                        [f"case_rate-{m}" for m in MONTHS])
+        for state, pop in rates[MONTHS[0]]:
+            writer.writerow([state, pop] +
+                            [rates[m][(state, pop)] for m in MONTHS])
+
+
+def _aggregate_deaths(inputs, outputs):
+    covid_data = _covid_data(*inputs)
+    df = covid_deaths.deaths_table(covid_data, "all", "state")
+    df[["population"] + MONTHS] = df[["population"] + MONTHS].astype("int64")
+    df["total"] = df[MONTHS].sum(axis=1)
+    df["max"] = df[MONTHS].max(axis=1)
+    df.to_csv(outputs[0], index=False)
+
+
+def _aggregate_combined(inputs, outputs):
+    cases = CountyMatrix.load(inputs[0]).with_population(
+        read_population(inputs[2]))
+    covid_data = _covid_data(*inputs[1:])
+    df = combined.covid_for_states(covid_data, "population", None, cases)
+    df["death_rate"] = combined.calc_death_rate(df["deaths"], df["population"])
+    df["case_rate"] = combined.calc_case_rate(df["cases"], df["population"])
+    df["deaths_to_cases"] = combined.calc_deaths_to_cases(df["deaths"],
+                                                          df["cases"])
+    df.to_csv(outputs[0], index=False)
+
+
+# the charts use Figure objects instead of pyplot, so they can be drawn in
+# several threads at once
+
+def _render_states(inputs, outputs):
+    df = pd.read_csv(inputs[0])
+    fig = Figure(figsize=(8, 5))
+    ax = fig.subplots()
+    for m in MONTHS:
+        ax.scatter(df["population"], df[f"case_rate-{m}"], s=12,
+                   label=calendar.month_name[m])
+    ax.set_title("Infection rates by state")
+    ax.set_xlabel("State population")
+    ax.set_ylabel("Infection rate as a percentage of state population")
+    ax.legend()
+    fig.savefig(outputs[0])
+
+
+def _render_deaths(inputs, outputs):
+    df = pd.read_csv(inputs[0])
+    fig = Figure(figsize=(12, 5))
+    ax = fig.subplots()
+    bottom = None
+    for m in MONTHS:
+        ax.bar(df["state"], df[str(m)], bottom=bottom,
+               label=calendar.month_name[m])
+        bottom = df[str(m)] if bottom is None else bottom + df[str(m)]
+    ax.set_title("Deaths per Month by State")
+    ax.set_ylabel("COVID-19 Deaths")
+    ax.tick_params(axis="x", labelrotation=90)
+    ax.legend()
+    fig.savefig(outputs[0])
+
+
+def _render_combined(inputs, outputs):
+    df = pd.read_csv(inputs[0])
+    fig = Figure(figsize=(12, 5))
+    ax = fig.subplots()
+    ax.scatter(df["state"], df["deaths_to_cases"])
+    ax.set_title("Death rates by state for March - July/2020")
+    ax.set_xlabel("States in order of increasing population")
+    ax.set_ylabel("Ratio of deaths to cases")
+    ax.tick_params(axis="x", labelrotation=90)
+    fig.savefig(outputs[0])
+
+
+def _render_grid(inputs, outputs):
+    fig = small_multiples.draw_grid(CountyMatrix.load(inputs[0]),
+                                    CountyMatrix.load(inputs[1]))
+    fig.savefig(outputs[0])
+
+
+def default_stages(out_dir: str = OUT_DIR, fetch: bool = False,
+                   cases_file: str = CASES_FILE,
+                   deaths_file: str = DEATHS_FILE,
+                   population_file: str = POPULATION_FILE,
+                   age_file: str = AGE_FILE) -> list:
+    """
+    download -> parse -> aggregate -> render for the cases and deaths
+    files. The download stages are only added with fetch.
+    """
+    out = lambda name: os.path.join(out_dir, name)
+    stages = []
+    if fetch:
+        for file_name in (cases_file, deaths_file, population_file):
+            url = URLS[os.path.basename(file_name)]
+            stages.append(Stage(f"download {file_name}",
+                                partial(_download, url=url), [],
+                                [file_name], params=url, always=True))
+
+    stages += [
+        Stage("parse cases", _parse, [cases_file, population_file],
+              [out("cases.npz")]),
+        Stage("parse deaths", partial(_parse, measure="deaths"),
+              [deaths_file], [out("deaths.npz")]),
+        Stage("aggregate states", _aggregate_states, [out("cases.npz")],
+              [out("states.csv")]),
+        Stage("aggregate deaths", _aggregate_deaths,
+              [out("deaths.npz"), population_file, age_file],
+              [out("deaths.csv")]),
+        Stage("aggregate combined", _aggregate_combined,
+              [out("cases.npz"), out("deaths.npz"), population_file,
+               age_file], [out("combined.csv")]),
+        Stage("render states", _render_states, [out("states.csv")],
+              [out("states.png")]),
+        Stage("render deaths", _render_deaths, [out("deaths.csv")],
+              [out("deaths.png")]),
+        Stage("render combined", _render_combined, [out("combined.csv")],
+              [out("combined.png")]),
+        Stage("render grid", _render_grid,
+              [out("cases.npz"), out("deaths.npz")], [out("grid.png")]),
+    ]
+    return stages
+
+
+def main():
+    covid_deaths.setup_logging()
+
+    parser = argparse.ArgumentParser(
+        description="Download, parse, aggregate and chart the data, " +
+                    "skipping every stage whose inputs did not change")
+
+    parser.add_argument("-o", "--out", dest="out_dir", type=str,
+                        default=OUT_DIR,
+                        help="Directory for the stage outputs")
+
+    parser.add_argument("-f", "--fetch", dest="fetch",
+                        action="store_true", default=False,
+                        help="Download the USAFacts files first")
+
+    parser.add_argument("-w", "--workers", dest="workers", type=int,
+                        default=None,
+                        help="Number of stages to run at the same time")
+
+    parser.add_argument("--force", dest="force",
+                        action="store_true", default=False,
+                        help="Run every stage even if nothing changed")
+
+    args = parser.parse_args()
+
+    pipeline = Pipeline(default_stages(args.out_dir, args.fetch),
+                        os.path.join(args.out_dir, STATE_FILE))
+    results = pipeline.run(args.workers, args.force)
+
+    for name in pipeline.stages:
+        print(f"{name}: {results[name]}")
+    if "failed" in results.values():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
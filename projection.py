@@ -0,0 +1,133 @@
+import os
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# days of daily counts each line is fitted to, and days projected ahead
+WINDOW = 14
+HORIZON = 14
+
+# counties per chunk sent to a worker process
+CHUNK_ROWS = 1024
+
+
+def fit_log_linear(daily, window: int = WINDOW):
+    """
+    Least squares fit of log(daily + 1) = intercept + slope * day over the
+    last window columns, for every row at once. Returns (intercept, slope)
+    arrays with the last day of the window as day 0.
+    """
+    y = np.log1p(np.clip(np.asarray(daily, dtype=np.float64)[:, -window:],
+                         0, None))
+    x = np.arange(-y.shape[1] + 1, 1, dtype=np.float64)
+    x_centered = x - x.mean()
+    slope = (y - y.mean(axis=1, keepdims=True)) @ x_centered / \
+        (x_centered ** 2).sum()
+    intercept = y.mean(axis=1) - slope * x.mean()
+    return intercept, slope
+
+
+def project_rows(values, window: int = WINDOW, horizon: int = HORIZON):
+    """
+    Fits every row of a cumulative matrix and projects it horizon days
+    ahead. Returns (slope, projected new count, projected cumulative).
+    """
+    values = np.asarray(values)
+    daily = np.diff(values, axis=1)
+    intercept, slope = fit_log_linear(daily, window)
+
+    days = np.arange(1, horizon + 1, dtype=np.float64)
+    ahead = np.expm1(intercept[:, np.newaxis] +
+                     slope[:, np.newaxis] * days[np.newaxis, :])
+    new = np.clip(ahead, 0, None).sum(axis=1)
+    return slope, new, values[:, -1] + new
+
+
+def _project_chunk(args):
+    return project_rows(*args)
+
+
+def project_matrix(values, window: int = WINDOW, horizon: int = HORIZON,
+                   max_workers: int = None, chunk_rows: int = CHUNK_ROWS):
+    """
+    project_rows for a large matrix, split into chunks of rows that are
+    fitted in a process pool. A single chunk is fitted in this process.
+    """
+    values = np.asarray(values)
+    if values.shape[1] < window + 1:
+        raise ValueError(f"{window} days need {window + 1} date columns, " +
+                         f"got {values.shape[1]}")
+
+    starts = range(0, len(values), chunk_rows)
+    chunks = [(values[s:s + chunk_rows], window, horizon) for s in starts]
+    if len(chunks) <= 1 or max_workers == 1:
+        parts = [_project_chunk(c) for c in chunks]
+    else:
+        workers = min(len(chunks), max_workers or os.cpu_count() or 1)
+        logging.debug(f"project_matrix(): {len(chunks)} chunks on " +
+                      f"{workers} processes")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_project_chunk, chunks))
+
+    if not parts:
+        empty = np.array([], dtype=np.float64)
+        return empty, empty, empty
+    return tuple(np.concatenate(p) for p in zip(*parts))
+
+
+def doubling_days(slope):
+    """
+    Days for the daily count to double at a daily log growth rate, inf when
+    it is not growing.
+    """
+    slope = np.asarray(slope, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        return np.where(slope > 0, np.log(2) / slope, np.inf)
+
+
+class Projection:
+    """
+    Projections of every state, or with counties of every county (only those
+    of state when it is given), from a CountyMatrix that ends on the last day
+    of the fitting window.
+    """
+
+    def __init__(self, matrix, state: str = None, counties: bool = False,
+                 window: int = WINDOW, horizon: int = HORIZON,
+                 max_workers: int = None):
+        self.window = window
+        self.horizon = horizon
+        self.end = matrix.dates[-1]
+
+        if state is None and not counties:
+            rollup = matrix.rollup()
+            self.names = rollup.names["state"]
+            self.states = rollup.names["state"]
+            self.population = rollup.population["state"]
+            self.values = rollup.values["state"]
+        else:
+            rows = np.arange(len(matrix))
+            if state is not None:
+                rows = np.flatnonzero(matrix.state == state)
+            self.names = matrix.county[rows]
+            self.states = matrix.state[rows]
+            self.population = matrix.population[rows]
+            self.values = matrix.values[rows]
+
+        self.slope, self.new, self.total = project_matrix(
+            self.values, window, horizon, max_workers)
+
+    def __repr__(self) -> str:
+        return (f"Projection({len(self.names)} rows, {self.window} day " +
+                f"window, {self.horizon} days ahead from {self.end})")
+
+    def rows(self):
+        doubling = doubling_days(self.slope)
+        for i in range(len(self.names)):
+            yield {"name": str(self.names[i]), "state": str(self.states[i]),
+                   "population": int(self.population[i]),
+                   "last_total": int(self.values[i, -1]),
+                   "daily_growth": round(float(self.slope[i]), 4),
+                   "doubling_days": round(float(doubling[i]), 1),
+                   "projected_new": int(round(self.new[i])),
+                   "projected_total": int(round(self.total[i]))}
@@ -0,0 +1,71 @@
+import copy
+from covid_matrix import CountyMatrix, month_end, CASES_FILE, POPULATION_FILE
+
+
+class CountyQuery:
+    """
+    Lazy query on a county feed in any layout of sources.SOURCES. Filters
+    are collected first and are pushed down into the file scan when load()
+    is called, so counties and date columns that are not asked for are never
+    converted. Every filter returns a new query, so a query can be reused as
+    the base of others.
+
+        CountyQuery("covid_confirmed_usafacts.csv").where(state="TX") \\
+            .for_month(5).load()
+    """
+
+    def __init__(self, file_name: str = CASES_FILE,
+                 population_file: str = POPULATION_FILE,
+                 low_memory: bool = False, measure: str = "cases",
+                 source: str = None):
+        self.file_name = file_name
+        self.measure = measure
+        self.source = source
+        self.population_file = population_file
+        self.low_memory = low_memory
+        self.states = None
+        self.fips = None
+        self.start = None
+        self.end = None
+
+    def __repr__(self) -> str:
+        return (f"CountyQuery('{self.file_name}', states={self.states}, " +
+                f"fips={self.fips}, start={self.start}, end={self.end})")
+
+    def where(self, state: str = None, fips=None):
+        """
+        Keeps only the counties of a state (or list of states) and/or the
+        given FIPS codes.
+        """
+        query = copy.copy(self)
+        if state is not None:
+            query.states = [state] if isinstance(state, str) else list(state)
+        if fips is not None:
+            query.fips = [fips] if isinstance(fips, int) else list(fips)
+        return query
+
+    def between(self, start=None, end=None):
+        """
+        Keeps only the date columns needed for counts after start up to and
+        including end.
+        """
+        query = copy.copy(self)
+        query.start = start
+        query.end = end
+        return query
+
+    def for_month(self, month: int = None):
+        """
+        Keeps only the date columns needed for one month, or for March
+        through July when month is None.
+        """
+        if month is None:
+            return self.between(month_end(2), month_end(7))
+        return self.between(month_end(month - 1), month_end(month))
+
+    def load(self):
+        return CountyMatrix.from_csv(self.file_name, self.population_file,
+                                     states=self.states, fips=self.fips,
+                                     start=self.start, end=self.end,
+                                     low_memory=self.low_memory,
+                                     source=self.source, measure=self.measure)
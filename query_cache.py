@@ -0,0 +1,97 @@
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+MAXSIZE = 256
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class QueryCache:
+    """
+    Size bounded cache of query results with least recently used eviction.
+    Keys are tuples of the query name, the versions of the datasets it reads
+    and its parameters, so a new dataset never gets an old result. Cached
+    results are shared, so callers must not change them.
+    """
+
+    def __init__(self, maxsize: int = MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"QueryCache({self.info()})"
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                old, _ = self._data.popitem(last=False)
+                logging.debug(f"QueryCache.put(): evicted {old}")
+
+    def get_or_compute(self, key, compute):
+        """
+        The cached result for key, or compute() stored under key. compute runs
+        outside the lock, so two threads may both compute a missing result;
+        they get the same answer.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# the cache shared by the command line tools, batch reports and live datasets
+CACHE = QueryCache()
+
+
+def version(dataset):
+    """
+    The version of a dataset for use in a cache key. CountyMatrix and
+    StateCovidData objects get a new version when they are created and when
+    their data is changed; None stands for the data read from the files by
+    the old loaders.
+    """
+    if dataset is None:
+        return None
+    return dataset.version
+
+
+def cached(name: str, datasets, params, compute, cache: QueryCache = None):
+    """
+    Looks a query up in the cache (CACHE by default) by its name, the
+    versions of the datasets it reads and its parameters.
+    """
+    cache = CACHE if cache is None else cache
+    key = (name, tuple(version(d) for d in datasets), tuple(params))
+    return cache.get_or_compute(key, compute)
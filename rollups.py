@@ -0,0 +1,85 @@
+import numpy as np
+import state_registry
+
+LEVELS = ["county", "state", "division", "region", "nation"]
+
+
+def _group_sum(keys, values, population):
+    """
+    Sums rows of values and population that share a key. Returns the sorted
+    unique keys with their totals.
+    """
+    names, inverse = np.unique(keys, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.searchsorted(inverse[order], np.arange(len(names)))
+    # totals are summed in int64 so downcast counties cannot overflow
+    return (names, np.add.reduceat(values[order], starts, axis=0,
+                                   dtype=np.int64),
+            np.add.reduceat(population[order], starts, dtype=np.int64))
+
+
+class Rollup:
+    """
+    Cumulative totals of a CountyMatrix for every level of the geographic
+    hierarchy, county -> state -> census division -> census region -> nation.
+    Every level is summed from the level below it once, when the rollup is
+    built, and kept as arrays with one row per name and one column per date.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.names = {"county": matrix.county}
+        self.values = {"county": matrix.values}
+        self.population = {"county": matrix.population}
+
+        # states are grouped on their int8 registry ids, the other levels on
+        # the registry metadata of the states
+        ids, values, population = _group_sum(matrix.state_id, matrix.values,
+                                             matrix.population)
+        self.state_id = ids
+        self.names["state"] = state_registry.decode(ids)
+        self.values["state"] = values
+        self.population["state"] = population
+
+        known = np.clip(ids, 0, None)
+        keys = {"division": np.where(ids >= 0, state_registry.DIVISIONS[known],
+                                     "Other"),
+                "region": np.where(ids >= 0, state_registry.REGIONS[known],
+                                   "Other"),
+                "nation": np.full(len(ids), "US")}
+        for level in LEVELS[2:]:
+            names, values, population = _group_sum(keys[level],
+                                                   self.values["state"],
+                                                   self.population["state"])
+            self.names[level] = names
+            self.values[level] = values
+            self.population[level] = population
+
+    def __repr__(self) -> str:
+        return "Rollup(" + ", ".join(f"{level}: {len(self.names[level])}"
+                                     for level in LEVELS) + ")"
+
+    def nbytes(self) -> int:
+        return sum(array.nbytes for level in LEVELS[1:]
+                   for array in (self.names[level], self.values[level],
+                                 self.population[level]))
+
+    def period_values(self, level: str, month: int = None, start=None,
+                      end=None):
+        """
+        New counts per name of a level, for the same periods as
+        CountyMatrix.period_values.
+        """
+        first, last = self.matrix.period_columns(month, start, end)
+        values = self.values[level]
+        return values[:, last] - values[:, first]
+
+    def totals(self, level: str, name: str, month: int = None, start=None,
+               end=None):
+        """
+        (population, new count) of one name of a level.
+        """
+        row = int(np.flatnonzero(self.names[level] == name)[0])
+        first, last = self.matrix.period_columns(month, start, end)
+        values = self.values[level][row]
+        return int(self.population[level][row]), int(values[last] - values[first])
@@ -0,0 +1,268 @@
+import cmd
+import shlex
+import logging
+import argparse
+import covid_cases
+import covid_deaths
+import combined
+import covariates
+from sqlite_store import open_store
+from covid_deaths import StateCovidData
+from covid_matrix import load_deaths, DEATHS_FILE
+from live_data import LiveDataset
+
+CASES_COMMANDS = ["states", "months", "project"]
+DEATHS_COMMANDS = ["print", "deaths", "state"]
+
+
+def _parse(parser, words):
+    # argparse exits on bad arguments and on -h, which must not end the
+    # session
+    try:
+        return parser.parse_args(words)
+    except SystemExit:
+        return None
+
+
+def complete_args(parser, text: str, words: list) -> list:
+    """
+    Completions of text from a parser: the choices of the option before it,
+    otherwise the options and the choices of the positional arguments.
+    """
+    previous = words[-1] if words else None
+    for action in parser._actions:
+        if previous in action.option_strings and action.choices:
+            return [str(c) for c in action.choices if str(c).startswith(text)]
+
+    options = []
+    for action in parser._actions:
+        if action.option_strings:
+            options += [o for o in action.option_strings if o != "-h"]
+        elif action.choices:
+            options += [str(c) for c in action.choices]
+    return sorted(o for o in set(options) if o.startswith(text))
+
+
+class Session(cmd.Cmd):
+    """
+    An interactive shell that loads the datasets once and answers the
+    commands of covid_cases.py, covid_deaths.py and combined.py from memory.
+    A line is the command line of one of those scripts, for example
+    'states 5 -p', 'deaths -a max -s median_age' or '-p pie -l TX' (a line
+    that starts with a flag goes to combined.py). 'reload' loads the files
+    again when they changed. The data is loaded once with the loader of
+    combined.py, so a command gives the numbers of its script. How the data
+    is stored (--low-memory) is chosen when the session starts.
+    """
+
+    intro = "COVID-19 data session. Type help or ? to list commands."
+    prompt = "covid> "
+
+    def __init__(self, dataset: LiveDataset = None, materialize: bool = False,
+                 low_memory: bool = False):
+        super().__init__()
+        if dataset is None:
+            logging.info("Loading the datasets...")
+            dataset = LiveDataset(materialize=materialize,
+                                  low_memory=low_memory)
+        self.dataset = dataset
+        self.parsers = {"cases": covid_cases.build_parser(),
+                        "deaths": covid_deaths.build_parser(),
+                        "combined": combined.build_parser()}
+
+    def preloop(self):
+        # flags like --sort must complete as a whole word
+        try:
+            import readline
+            readline.set_completer_delims(" \t\n")
+        except ImportError:
+            pass
+
+    def emptyline(self):
+        # the default repeats the last command
+        return False
+
+    def onecmd(self, line):
+        # a command that gives up with sys.exit() or fails ends the command,
+        # not the session
+        try:
+            return super().onecmd(line)
+        except SystemExit:
+            return False
+        except Exception:
+            logging.exception(f"Session: '{line}' failed")
+            return False
+
+    def check_low_memory(self, args):
+        # the session data is loaded once, so --low-memory cannot change it
+        if args.low_memory and not self.dataset.low_memory:
+            print("--low-memory is ignored: the data is already loaded. " +
+                  "Start the session with --low-memory to use it.")
+
+    def run_cases(self, line: str):
+        args = _parse(self.parsers["cases"], shlex.split(line))
+        if args is None:
+            return None
+        self.check_low_memory(args)
+        if args.cases_file or args.deaths_file or args.source:
+            # other feeds are read like covid_cases.py reads them
+            return covid_cases.arguments(args)
+
+        if args.command != "project" and args.db is not None:
+            store = open_store(args.db)
+            if args.command == "states":
+                return covid_cases.states(args, store=store)
+            if args.which_state is None:
+                print("You must choose a state.")
+                return None
+            return covid_cases.months(args, store=store)
+
+        snapshot = self.dataset.current()
+        if args.command == "project":
+            matrix = snapshot.deaths if args.deaths else snapshot.cases
+            return covid_cases.project(args, matrix)
+        store = covid_cases.table_store(args, snapshot.tables)
+        if args.command == "states":
+            return covid_cases.states(args, snapshot.cases, store)
+        if args.which_state is None:
+            print("You must choose a state.")
+            return None
+        return covid_cases.months(args, snapshot.cases, store)
+
+    def run_deaths(self, line: str):
+        args = _parse(self.parsers["deaths"], shlex.split(line))
+        if args is None:
+            return None
+        self.check_low_memory(args)
+        snapshot = self.dataset.current()
+        # the deaths matrix of the snapshot weights county covariates,
+        # unless other feeds are read
+        tables, deaths_matrix = None, snapshot.deaths
+        if args.db_file is not None:
+            covid_data = open_store(args.db_file).covid_data()
+        elif args.file_name is not None:
+            # like covid_deaths.py, the deaths data is read from that file
+            covid_data = StateCovidData(args.file_name)
+        elif args.deaths_file or args.source:
+            covid_data = covid_deaths.load_covid_data(
+                args.deaths_file or DEATHS_FILE, source=args.source,
+                low_memory=args.low_memory)
+            deaths_matrix = None
+            if covid_deaths.county_covariate(
+                    args.sort_order,
+                    covariates.load_store(args.covariate_files)):
+                deaths_matrix = load_deaths(args.deaths_file or DEATHS_FILE,
+                                            low_memory=args.low_memory,
+                                            source=args.source)
+        else:
+            covid_data, tables = snapshot.covid_data, snapshot.tables
+        return covid_deaths.run_command(covid_data, args.command,
+                                        args.sort_order, args.agg, args.state,
+                                        args.plot, args.outfile,
+                                        args.covariate_files, tables,
+                                        deaths_matrix)
+
+    def run_combined(self, line: str):
+        args = _parse(self.parsers["combined"], shlex.split(line))
+        if args is None:
+            return None
+        self.check_low_memory(args)
+        if args.cases_file or args.deaths_file or args.source:
+            # other feeds are loaded for this command only
+            return combined.run_args(args)
+        snapshot = self.dataset.current()
+        return combined.run_args(args, (snapshot.covid_data, snapshot.cases,
+                                        snapshot.deaths), snapshot.tables)
+
+    # the do_ methods return nothing, since a true value ends the session
+
+    def do_states(self, arg):
+        """states <month> [-p] [-o file]: infection rates of every state"""
+        self.run_cases("states " + arg)
+
+    def do_months(self, arg):
+        """months <month> -s <state> [-p] [-o file]: rates of its counties"""
+        self.run_cases("months " + arg)
+
+    def do_project(self, arg):
+        """project <month> [-s state] [--deaths] [--counties]: projections"""
+        self.run_cases("project " + arg)
+
+    def do_print(self, arg):
+        """print [-a total|max|all] [-s sort] [-o file]: deaths by state"""
+        self.run_deaths("print " + arg)
+
+    def do_deaths(self, arg):
+        """deaths [-a total|max|all] [-s sort] [-p] [-o file]: deaths chart"""
+        self.run_deaths("deaths " + arg)
+
+    def do_state(self, arg):
+        """state -l <state> [-p] [-o file]: deaths of one state by month"""
+        self.run_deaths("state " + arg)
+
+    def do_combined(self, arg):
+        """combined [-m month] [-s sort] [-p pie|scatter|bar] [-l state]:
+        cases and deaths together. The word combined may be left out."""
+        self.run_combined(arg)
+
+    def do_reload(self, arg):
+        """reload [force]: load the data files again if they changed"""
+        if self.dataset.reload(force=arg.strip() == "force"):
+            print(f"Loaded version {self.dataset.version} of the data.")
+        else:
+            print(f"No changes, still on version {self.dataset.version}.")
+
+    def do_quit(self, arg):
+        """quit: end the session"""
+        return True
+
+    do_exit = do_quit
+    do_EOF = do_quit
+
+    def default(self, line):
+        if line.startswith("-"):
+            self.run_combined(line)
+        else:
+            print(f"Unknown command: {line.split()[0]}. Type help for a list.")
+
+    def completedefault(self, text, line, begidx, endidx):
+        words = line[:begidx].split()
+        if not words or words[0].startswith("-") or words[0] == "combined":
+            return complete_args(self.parsers["combined"], text, words)
+        if words[0] in CASES_COMMANDS:
+            return complete_args(self.parsers["cases"], text, words[1:])
+        if words[0] in DEATHS_COMMANDS:
+            return complete_args(self.parsers["deaths"], text, words[1:])
+        return []
+
+    def completenames(self, text, *ignored):
+        # a line can also start with a flag of combined.py
+        if text.startswith("-"):
+            return complete_args(self.parsers["combined"], text, [])
+        return super().completenames(text, *ignored)
+
+
+def main():
+    covid_deaths.setup_logging()
+
+    parser = argparse.ArgumentParser(
+        description="An interactive shell that keeps the data loaded " +
+                    "between commands")
+
+    parser.add_argument("-m", "--materialize", dest="materialize",
+                        action="store_true", default=False,
+                        help="Build every report table when the data is loaded")
+
+    parser.add_argument("--low-memory", dest="low_memory",
+                        action="store_true", default=False,
+                        help="Store counts as int32 and populations as " +
+                             "uint32 to halve the memory used")
+
+    args = parser.parse_args()
+
+    Session(materialize=args.materialize,
+            low_memory=args.low_memory).cmdloop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import os
+import logging
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from covid_matrix import CountyMatrix
+import covid_cases
+import combined
+
+# arrays of a CountyMatrix that are published. county and state are fixed
+# width unicode arrays, so they can be shared like the numbers.
+FIELDS = ["fips", "county", "state", "values", "population"]
+
+
+class SharedDataset:
+    """
+    Publishes named CountyMatrix objects once, either into
+    multiprocessing.shared_memory blocks or into .npy files that are memory
+    mapped. The manifest is a small picklable dictionary that worker
+    processes pass to attach() to get CountyMatrix objects whose arrays are
+    views of the published memory, so nothing is copied per worker.
+    """
+
+    def __init__(self, matrices: dict, path: str = None):
+        self.path = path
+        self.blocks = []
+        self.manifest = {"path": path, "matrices": {}}
+
+        for name, matrix in matrices.items():
+            entry = {"dates": matrix.dates, "arrays": {}}
+            for field in FIELDS:
+                entry["arrays"][field] = self._publish(name, field,
+                                                       getattr(matrix, field))
+            self.manifest["matrices"][name] = entry
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _publish(self, name, field, array):
+        array = np.ascontiguousarray(array)
+        info = {"dtype": array.dtype.str, "shape": array.shape}
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            file_name = os.path.join(self.path, f"{name}.{field}.npy")
+            np.save(file_name, array)
+            info["file"] = file_name
+            return info
+
+        block = shared_memory.SharedMemory(create=True,
+                                           size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        self.blocks.append(block)
+        info["shm"] = block.name
+        return info
+
+    def close(self):
+        """
+        Releases the shared memory blocks. Only the publishing process should
+        call this.
+        """
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+# shared memory handles held by an attached process. They must stay open as
+# long as the arrays that view them are in use.
+_attached_blocks = []
+_attached = {}
+
+
+def attach(manifest: dict) -> dict:
+    """
+    Returns {name: CountyMatrix} built on views of the published arrays.
+    """
+    matrices = {}
+    for name, entry in manifest["matrices"].items():
+        arrays = {}
+        for field, info in entry["arrays"].items():
+            if "file" in info:
+                arrays[field] = np.load(info["file"], mmap_mode="r")
+                continue
+            block = shared_memory.SharedMemory(name=info["shm"])
+            _attached_blocks.append(block)
+            arrays[field] = np.ndarray(info["shape"], np.dtype(info["dtype"]),
+                                       buffer=block.buf)
+        matrices[name] = CountyMatrix(arrays["fips"], arrays["county"],
+                                      arrays["state"], entry["dates"],
+                                      arrays["values"], arrays["population"])
+    return matrices
+
+
+def _init_worker(manifest):
+    logging.debug(f"_init_worker(): attaching in process {os.getpid()}")
+    _attached.update(attach(manifest))
+
+
+def worker_states(which_month):
+    return covid_cases.state_rates(_attached["cases"], which_month)
+
+
+def worker_months(which_month, which_state):
+    return covid_cases.county_rates(_attached["cases"], which_month,
+                                    which_state)
+
+
+def worker_combined(sort_order, period):
+    return combined.rates_for_states(_attached["cases"], _attached["deaths"],
+                                     sort_order, period)
+
+
+def run_in_workers(manifest, jobs, max_workers: int = None):
+    """
+    Runs (function, args) jobs in a process pool whose workers attach to the
+    published dataset once, when they start. Results are returned in the
+    order of the jobs.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(manifest,)) as pool:
+        futures = [pool.submit(func, *args) for func, args in jobs]
+        return [f.result() for f in futures]
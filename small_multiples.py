@@ -0,0 +1,158 @@
+import logging
+import argparse
+import calendar
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+import covid_deaths
+from covid_matrix import load_cases, load_deaths, FIRST_MONTH, LAST_MONTH
+
+MONTHS = list(range(FIRST_MONTH, LAST_MONTH + 1))
+OUT_FILE = "states_grid.png"
+
+# states per row of the grid, and the part of a cell the lines may use
+COLUMNS = 8
+CELL = 0.85
+
+
+def state_series(matrix, daily: bool = False):
+    """
+    (state codes, x, values) of every known state: new counts per month from
+    March to July, or per day over the same period with daily, where x is
+    the day of the period (1 for March 1). values has a row per state and a
+    column per x.
+    """
+    rollup = matrix.rollup()
+    known = rollup.state_id >= 0
+    if daily:
+        # the first column is the total of Feb 29, the base of March 1
+        first, last = matrix.period_columns()
+        totals = rollup.values["state"][known][:, first:last + 1]
+        values = np.clip(np.diff(totals, axis=1), 0, None)
+        x = np.array([(d - matrix.dates[first]).days
+                      for d in matrix.dates[first + 1:last + 1]])
+    else:
+        values = np.column_stack([rollup.period_values("state", m)[known]
+                                  for m in MONTHS])
+        x = np.array(MONTHS)
+    return rollup.names["state"][known], x, values
+
+
+def grid_segments(x, values, columns: int = COLUMNS,
+                  scale: str = "shared"):
+    """
+    The lines of every row of values placed in the cells of a grid, as an
+    (rows, points, 2) array for a LineCollection. Cell i is in column
+    i % columns and row i // columns, one unit wide and high. The lines are
+    scaled to the largest value of all rows, or to their own largest value
+    with scale "state".
+    """
+    values = np.asarray(values, dtype=np.float64)
+    cells = np.arange(len(values))
+    span = max(x[-1] - x[0], 1)
+
+    if scale == "state":
+        peak = values.max(axis=1, keepdims=True)
+    else:
+        peak = np.full((len(values), 1), values.max(initial=0))
+    peak[peak <= 0] = 1
+
+    segments = np.empty(values.shape + (2,))
+    segments[..., 0] = (cells % columns)[:, np.newaxis] + \
+        (1 - CELL) / 2 + (np.asarray(x) - x[0]) / span * CELL
+    segments[..., 1] = -(cells // columns)[:, np.newaxis] + \
+        (1 - CELL) / 2 + values / peak * CELL
+    return segments
+
+
+def draw_grid(cases, deaths, daily: bool = False, scale: str = "shared",
+              columns: int = COLUMNS) -> Figure:
+    """
+    Draws the case and death series of every state in a grid of cells on a
+    single shared axes. Each series is one LineCollection, so the figure is
+    drawn in one pass however many states there are.
+    """
+    names, x, case_values = state_series(cases, daily)
+    death_names, _, death_values = state_series(deaths, daily)
+    # deaths may have a state more or less than cases
+    lookup = dict(zip(death_names, death_values))
+    death_values = np.array([lookup.get(n, np.zeros(len(x))) for n in names])
+
+    rows = -(-len(names) // columns)
+    fig = Figure(figsize=(2 * columns, 1.6 * rows + 1))
+    ax = fig.subplots()
+
+    # cases and deaths have scales of their own, so the legend gives the
+    # count at the top of a cell when every state shares them
+    case_label, death_label = "Cases", "Deaths"
+    if scale != "state":
+        case_label += f" (top of a cell: {case_values.max(initial=0):,})"
+        death_label += f" (top of a cell: {death_values.max(initial=0):,})"
+    ax.add_collection(LineCollection(grid_segments(x, case_values, columns,
+                                                   scale),
+                                     colors="tab:blue", linewidths=1,
+                                     label=case_label))
+    ax.add_collection(LineCollection(grid_segments(x, death_values, columns,
+                                                   scale),
+                                     colors="tab:red", linewidths=1,
+                                     label=death_label))
+
+    # cell borders and state names
+    ax.vlines(np.arange(columns + 1), -rows + 1, 1, colors="lightgrey",
+              linewidths=0.5)
+    ax.hlines(np.arange(-rows + 1, 2), 0, columns, colors="lightgrey",
+              linewidths=0.5)
+    cells = np.arange(len(names))
+    for i, name in enumerate(names):
+        ax.text(cells[i] % columns + 0.05, -(cells[i] // columns) + 0.95,
+                name, va="top", fontsize=8)
+
+    ax.set_xlim(0, columns)
+    ax.set_ylim(-rows + 1, 1)
+    ax.set_axis_off()
+    per = "day" if daily else "month"
+    scaled = "each state's peaks" if scale == "state" \
+        else "the peaks of all states"
+    ax.set_title(f"New cases and deaths per {per}, " +
+                 f"{calendar.month_name[FIRST_MONTH]} - " +
+                 f"{calendar.month_name[LAST_MONTH]} 2020, scaled to " +
+                 f"{scaled}")
+    ax.legend(loc="upper center", bbox_to_anchor=(0.5, 0), ncol=2)
+    return fig
+
+
+def main():
+    covid_deaths.setup_logging()
+
+    parser = argparse.ArgumentParser(
+        description="Cases and deaths of every state in one grid chart")
+
+    parser.add_argument("-o", "--outfile", dest="outfile", type=str,
+                        default=OUT_FILE,
+                        help="The image file to write the chart to")
+
+    parser.add_argument("--daily", dest="daily",
+                        action="store_true", default=False,
+                        help="Draw daily instead of monthly counts")
+
+    parser.add_argument("--scale", dest="scale", type=str,
+                        choices=["shared", "state"], default="shared",
+                        help="Scale every state to the largest state, or " +
+                             "each state to its own peak")
+
+    parser.add_argument("--low-memory", dest="low_memory",
+                        action="store_true", default=False,
+                        help="Store counts as int32 and populations as " +
+                             "uint32 to halve the memory used")
+
+    args = parser.parse_args()
+
+    fig = draw_grid(load_cases(low_memory=args.low_memory),
+                    load_deaths(low_memory=args.low_memory),
+                    args.daily, args.scale)
+    fig.savefig(args.outfile)
+    logging.info(f"Wrote {args.outfile}")
+
+
+if __name__ == '__main__':
+    main()
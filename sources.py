@@ -0,0 +1,340 @@
+import os
+import csv
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import date
+import state_registry
+from compressed import open_text
+from covid_matrix import (CountyMatrix, parse_date, date_window, _scan,
+                          POPULATION_FILE)
+
+# every layout returns its rows in the same form as covid_matrix._scan:
+# (fips, county names, state codes, dates, cumulative values). Rows that do
+# not belong to one county get FIPS 0 and are dropped as unallocated.
+
+MEASURES = ["cases", "deaths"]
+
+# state and territory names of the NYT and JHU files -> two letter codes
+_NAME_CODES = dict(zip(state_registry.NAMES.tolist(),
+                       state_registry.CODES.tolist()))
+
+# JHU gives the out of state and unassigned rows of a state FIPS codes of
+# 80000 and up, and US county FIPS codes are all below this
+MAX_COUNTY_FIPS = 78999
+
+# NYT counts the five boroughs of New York City as one place without a FIPS
+# code. It gets this code, which no county has, and the population of the
+# boroughs
+NYC_FIPS = 36998
+NYC_BOROUGHS = [36005, 36047, 36061, 36081, 36085]
+
+
+def _filters(states, fips):
+    return (None if states is None else set(states),
+            None if fips is None else set(int(f) for f in fips))
+
+
+class Source:
+    """
+    A feed layout. matches() says whether a file header is in the layout
+    and scan() reads a file into the arrays CountyMatrix is built from,
+    applying the states, fips and date filters while it reads. measure picks
+    the column of feeds that hold cases and deaths in the same file.
+    """
+
+    name = None
+
+    def matches(self, file_name: str, header: list) -> bool:
+        raise NotImplementedError
+
+    def scan(self, file_name, states=None, fips=None, start=None, end=None,
+             dtype=np.int64, measure: str = "cases"):
+        raise NotImplementedError
+
+    def populations(self, file_name: str, populations: dict = None):
+        """
+        The {fips: population} dictionary of the file: the populations of
+        a population file (None when none is given), completed with any
+        places of the layout, or the populations a file carries when no
+        population file is given. Feeds have none of their own.
+        """
+        return populations
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}()"
+
+
+class USAFacts(Source):
+    """
+    Wide USAFacts files: countyFIPS, County Name, State, stateFIPS and a
+    column per date.
+    """
+
+    name = "usafacts"
+
+    def matches(self, file_name, header):
+        return [h.strip().lower() for h in header[:4]] == \
+            ["countyfips", "county name", "state", "statefips"]
+
+    def scan(self, file_name, states=None, fips=None, start=None, end=None,
+             dtype=np.int64, measure="cases"):
+        return _scan(file_name, states, fips, start, end, dtype)
+
+
+class JHU(Source):
+    """
+    Wide Johns Hopkins US time series: UID ... FIPS, Admin2, Province_State,
+    ..., Combined_Key, Population (deaths only) and a column per date. Only
+    the quoted Combined_Key needs quote handling, so a line is split into
+    the fields before it and the numbers after it without the csv module.
+    """
+
+    name = "jhu"
+
+    def matches(self, file_name, header):
+        return header[:1] == ["UID"] and "Admin2" in header and \
+            "Combined_Key" in header
+
+    def scan(self, file_name, states=None, fips=None, start=None, end=None,
+             dtype=np.int64, measure="cases"):
+        logging.debug(f"JHU.scan(): Reading {file_name}")
+        states, fips = _filters(states, fips)
+
+        with open_text(file_name, "utf-8-sig") as data_file:
+            header = next(csv.reader([data_file.readline()]))
+            key = header.index("Combined_Key")
+            columns = (header.index("FIPS"), header.index("Admin2"),
+                       header.index("Province_State"))
+            skip = 1 if "Population" in header else 0
+            dates = [parse_date(d) for d in header[key + 1 + skip:]]
+            first, last = date_window(dates, start, end)
+            dates = dates[first:last]
+
+            heads = []
+            rows = []
+            for line in data_file:
+                fields = line.rstrip("\r\n").split(",", key)
+                rest = fields[key] if len(fields) > key else ""
+                close = rest.find('"', 1) + 1 if rest.startswith('"') \
+                    else rest.find(",")
+                if close <= 0 or rest[close:close + 1] != "," or \
+                        any('"' in f for f in fields[:key]):
+                    # quotes the split cannot handle
+                    fields = next(csv.reader([line]))
+                    numbers = fields[key + 1:]
+                else:
+                    numbers = rest[close + 1:].split(",")
+
+                code, county, state = (fields[c] for c in columns)
+                state = _NAME_CODES.get(state)
+                if state is None:
+                    continue
+                code = int(float(code)) if code else 0
+                if code > MAX_COUNTY_FIPS:
+                    code = 0
+                if states is not None and state not in states:
+                    continue
+                if fips is not None and code not in fips:
+                    continue
+
+                heads.append((code, county, state))
+                rows.append(numbers[skip + first:skip + last])
+
+        values = np.array(rows, dtype=dtype).reshape(len(rows), len(dates))
+        return (np.array([h[0] for h in heads], dtype=np.int64),
+                np.array([h[1] for h in heads], dtype=str),
+                np.array([h[2] for h in heads], dtype=str), dates, values)
+
+
+class NYT(Source):
+    """
+    The long New York Times county file: date, county, state, fips, cases,
+    deaths, a row per county per day from the day of its first case. The
+    file is parsed by pandas' C reader, the rows are scattered into the
+    matrix in one step and every county carries its last total forward over
+    days it has no row. New York City gets NYC_FIPS and the population of
+    its boroughs. Other places without a FIPS code (Unknown, Kansas City)
+    become unallocated rows.
+    """
+
+    name = "nyt"
+
+    def matches(self, file_name, header):
+        return [h.strip().lower() for h in header[:4]] == \
+            ["date", "county", "state", "fips"]
+
+    def scan(self, file_name, states=None, fips=None, start=None, end=None,
+             dtype=np.int64, measure="cases"):
+        logging.debug(f"NYT.scan(): Reading {file_name}")
+        with open_text(file_name, "utf-8-sig") as data_file:
+            df = pd.read_csv(data_file, usecols=["date", "county", "state",
+                                                 "fips", measure],
+                             dtype={"date": str, "county": str, "state": str,
+                                    "fips": np.float64, measure: np.float64},
+                             na_values=[""], keep_default_na=False)
+
+        df["state"] = df["state"].map(_NAME_CODES)
+        df = df[df["state"].notna()]
+        code = df["fips"].fillna(0).to_numpy(dtype=np.int64)
+        nyc = ((df["county"] == "New York City") & (df["state"] == "NY")) \
+            .to_numpy()
+        code[nyc & (code == 0)] = NYC_FIPS
+        if states is not None:
+            keep = df["state"].isin(list(states)).to_numpy()
+            df, code = df[keep], code[keep]
+        if fips is not None:
+            keep = np.isin(code, [int(f) for f in fips])
+            df, code = df[keep], code[keep]
+
+        # a place is its FIPS code, or for the few rows without one its
+        # county and state, numbered below zero
+        key = code.copy()
+        unknown = code == 0
+        key[unknown] = -1 - pd.factorize(df["county"][unknown] + "," +
+                                         df["state"][unknown])[0]
+        row, _ = pd.factorize(key)
+        _, first_row = np.unique(row, return_index=True)
+        # ISO dates sort in date order
+        col, day_text = pd.factorize(df["date"], sort=True)
+        counts = df[measure].fillna(0).to_numpy(dtype=np.int64)
+
+        values = np.zeros((len(first_row), len(day_text)), dtype=np.int64)
+        seen = np.zeros(values.shape, dtype=bool)
+        values[row, col] = counts
+        seen[row, col] = True
+        last_seen = np.where(seen, np.arange(values.shape[1]), 0)
+        np.maximum.accumulate(last_seen, axis=1, out=last_seen)
+        values = np.take_along_axis(values, last_seen, axis=1)
+
+        dates = [date.fromisoformat(d) for d in day_text.tolist()]
+        first, last = date_window(dates, start, end)
+        return (code[first_row],
+                df["county"].fillna("").to_numpy(dtype=str)[first_row],
+                df["state"].to_numpy(dtype=str)[first_row],
+                dates[first:last], values[:, first:last].astype(dtype))
+
+    def populations(self, file_name, populations=None):
+        if populations is None or NYC_FIPS in populations:
+            return populations
+        populations = dict(populations)
+        populations[NYC_FIPS] = sum(populations.get(f, 0)
+                                    for f in NYC_BOROUGHS)
+        return populations
+
+
+class Compiled(Source):
+    """
+    A .npz file written by CountyMatrix.save, for example by compile_feed().
+    Reading it skips parsing altogether.
+    """
+
+    name = "npz"
+
+    def matches(self, file_name, header):
+        return file_name.endswith(".npz")
+
+    def scan(self, file_name, states=None, fips=None, start=None, end=None,
+             dtype=np.int64, measure="cases"):
+        matrix = CountyMatrix.load(file_name)
+        keep = np.ones(len(matrix), dtype=bool)
+        if states is not None:
+            keep &= np.isin(matrix.state, list(states))
+        if fips is not None:
+            keep &= np.isin(matrix.fips, [int(f) for f in fips])
+        first, last = date_window(matrix.dates, start, end)
+        return (matrix.fips[keep], matrix.county[keep], matrix.state[keep],
+                matrix.dates[first:last],
+                matrix.values[keep, first:last].astype(dtype, copy=False))
+
+    def populations(self, file_name, populations=None):
+        if populations is not None:
+            return populations
+        with np.load(file_name) as data:
+            return dict(zip(data["fips"].tolist(),
+                            data["population"].tolist()))
+
+
+SOURCES = dict()
+
+
+def register(source: Source) -> Source:
+    """
+    Adds a layout. Files are matched against the layouts in the order they
+    were registered.
+    """
+    SOURCES[source.name] = source
+    return source
+
+
+for _source in (USAFacts(), JHU(), NYT(), Compiled()):
+    register(_source)
+
+
+def find(file_name: str, name: str = None) -> Source:
+    """
+    The layout called name, or the first layout whose header matches the
+    file when name is None.
+    """
+    if name is not None:
+        return SOURCES[name]
+
+    header = []
+    if not file_name.endswith(".npz"):
+        with open_text(file_name, "utf-8-sig") as data_file:
+            header = next(csv.reader([data_file.readline()]), [])
+    for source in SOURCES.values():
+        if source.matches(file_name, header):
+            logging.debug(f"find(): {file_name} is a {source.name} file")
+            return source
+    raise ValueError(f"{file_name} is not in a known layout. Known " +
+                     f"layouts: {', '.join(SOURCES)}")
+
+
+def compile_feed(file_name: str, out_file: str, measure: str = "cases",
+                 population_file: str = POPULATION_FILE, source: str = None):
+    """
+    Reads a feed in any layout and saves it as a compact .npz that every
+    loader reads straight back (see Compiled).
+    """
+    matrix = CountyMatrix.from_csv(file_name, population_file, source=source,
+                                   measure=measure)
+    matrix.save(out_file, compact=True)
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a USAFacts, JHU or NYT county feed to the " +
+                    "compact county x date arrays")
+
+    parser.add_argument("file_name", metavar="<file_name>", type=str,
+                        help="The feed to convert")
+
+    parser.add_argument("-o", "--outfile", dest="outfile", type=str,
+                        default=None,
+                        help="The .npz file to write, by default the feed " +
+                             "name with .npz")
+
+    parser.add_argument("-m", "--measure", dest="measure", type=str,
+                        choices=MEASURES, default="cases",
+                        help="The column to read from feeds that hold both")
+
+    parser.add_argument("-s", "--source", dest="source", type=str,
+                        choices=list(SOURCES), default=None,
+                        help="The layout of the feed, found from its header " +
+                             "when not given")
+
+    args = parser.parse_args()
+
+    outfile = args.outfile
+    if outfile is None:
+        outfile = os.path.splitext(args.file_name)[0] + ".npz"
+    matrix = compile_feed(args.file_name, outfile, args.measure,
+                          source=args.source)
+    print(f"{matrix} written to {outfile}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+import pandas as pd
+import compressed
+from covid_matrix import (CountyMatrix, month_end, CASES_FILE,
+                          DEATHS_FILE, POPULATION_FILE)
+from covid_deaths import StateCovid, StateCovidData
+
+DB_FILE = "covid.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counties (
+    fips INTEGER PRIMARY KEY,
+    county TEXT,
+    state TEXT,
+    population INTEGER
+);
+CREATE TABLE IF NOT EXISTS states (
+    state TEXT PRIMARY KEY,
+    median_age REAL
+);
+CREATE TABLE IF NOT EXISTS series (
+    metric TEXT,
+    fips INTEGER,
+    state TEXT,
+    date TEXT,
+    value INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+AGE_FILE = "state_median_age.csv"
+
+# the indexes are built after a bulk load, which is faster than keeping them
+# up to date row by row
+INDEXES = """
+CREATE INDEX IF NOT EXISTS series_fips_date ON series (metric, fips, date);
+CREATE INDEX IF NOT EXISTS series_state_date ON series (metric, state, date);
+"""
+
+# new counts of a period per county: the cumulative value on the end date
+# minus the value on the start date
+PERIOD_SQL = """
+SELECT e.fips, e.state, e.value - COALESCE(s.value, 0) AS new
+FROM series e LEFT JOIN series s
+    ON s.metric = e.metric AND s.fips = e.fips AND s.date = :start
+WHERE e.metric = :metric AND e.date = :end
+"""
+
+
+class SqliteStore:
+    """
+    Optional SQLite backend. The county x date series are kept in long
+    format (one row per metric, county and date) with indexes on
+    (fips, date) and (state, date), so reports and other tools can
+    aggregate in SQL without the Python loaders.
+    """
+
+    def __init__(self, db_file: str = DB_FILE):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.executescript(SCHEMA + INDEXES)
+
+    def __repr__(self) -> str:
+        return f"SqliteStore('{self.db_file}')"
+
+    def close(self):
+        self.conn.close()
+
+    def load(self, cases_matrix, deaths_matrix, median_age: dict):
+        """
+        Replaces the stored data in one transaction with executemany.
+        """
+        logging.debug(f"SqliteStore.load(): loading {self.db_file}")
+        with self.conn:
+            self.conn.execute("DELETE FROM counties")
+            self.conn.execute("DELETE FROM states")
+            self.conn.execute("DROP INDEX IF EXISTS series_fips_date")
+            self.conn.execute("DROP INDEX IF EXISTS series_state_date")
+            self.conn.execute("DELETE FROM series")
+            self.conn.executemany(
+                "INSERT INTO counties VALUES (?, ?, ?, ?)",
+                zip(cases_matrix.fips.tolist(), cases_matrix.county.tolist(),
+                    cases_matrix.state.tolist(),
+                    cases_matrix.population.tolist()))
+            self.conn.executemany("INSERT INTO states VALUES (?, ?)",
+                                  median_age.items())
+            for metric, matrix in (("cases", cases_matrix),
+                                   ("deaths", deaths_matrix)):
+                self.conn.executemany("INSERT INTO series VALUES (?, ?, ?, ?, ?)",
+                                      _series_rows(metric, matrix))
+        self.conn.executescript(INDEXES)
+
+    def inputs(self):
+        """
+        The signature of the files the data was loaded from, see
+        file_signature(), or None when it is not known.
+        """
+        row = self.conn.execute("SELECT value FROM meta " +
+                                "WHERE key = 'inputs'").fetchone()
+        return None if row is None else row[0]
+
+    def set_inputs(self, signature: str):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES " +
+                              "('inputs', ?)", (signature,))
+
+    def _date(self, day):
+        # the last stored date on or before day, like CountyMatrix.date_column
+        row = self.conn.execute("SELECT MAX(date) FROM series " +
+                                "WHERE metric = 'cases' AND date <= ?",
+                                (day.isoformat(),)).fetchone()
+        return row[0]
+
+    def _period(self, month):
+        if month is None:
+            return self._date(month_end(2)), self._date(month_end(7))
+        return self._date(month_end(month - 1)), self._date(month_end(month))
+
+    def state_rates(self, which_month):
+        """
+        The rate dictionary of the covid_cases 'states' command.
+        """
+        start, end = self._period(int(which_month))
+        sql = f"""
+            SELECT p.state, c.population, p.new FROM
+            (SELECT state, SUM(new) AS new FROM ({PERIOD_SQL})
+             WHERE fips IN (SELECT fips FROM counties) GROUP BY state) p
+            JOIN (SELECT state, SUM(population) AS population FROM counties
+                  GROUP BY state) c ON c.state = p.state
+            ORDER BY p.state"""
+        rows = self.conn.execute(sql, {"metric": "cases", "start": start,
+                                       "end": end})
+        return {(state, pop): (new * 100) / pop for state, pop, new in rows}
+
+    def county_rates(self, which_month, which_state):
+        """
+        The rate dictionary of the covid_cases 'months' command.
+        """
+        start, end = self._period(int(which_month))
+        sql = f"""
+            SELECT c.county, c.population, p.new FROM ({PERIOD_SQL}) p
+            JOIN counties c ON c.fips = p.fips
+            WHERE c.state = :state AND c.population > 0
+            ORDER BY c.population, c.county"""
+        rows = self.conn.execute(sql, {"metric": "cases", "start": start,
+                                       "end": end, "state": which_state})
+        return {(county, pop): (new * 100) / pop for county, pop, new in rows}
+
+    def state_month_totals(self, metric: str, months=range(3, 8)) -> dict:
+        """
+        {state: {month: new count}} summed in SQL.
+        """
+        totals = dict()
+        for month in months:
+            start, end = self._period(month)
+            sql = f"SELECT state, SUM(new) FROM ({PERIOD_SQL}) GROUP BY state"
+            for state, new in self.conn.execute(sql, {"metric": metric,
+                                                      "start": start,
+                                                      "end": end}):
+                totals.setdefault(state, dict())[month] = new
+        return totals
+
+    def covid_data(self):
+        """
+        A StateCovidData with monthly deaths, population and median age of
+        every state, all aggregated in SQL.
+        """
+        data = StateCovidData("no_file.txt", True)
+        info = self.conn.execute("""
+            SELECT s.state, COALESCE(SUM(c.population), 0), s.median_age
+            FROM states s LEFT JOIN counties c ON c.state = s.state
+            GROUP BY s.state""")
+        info = {state: (pop, age) for state, pop, age in info}
+
+        for state, months in sorted(self.state_month_totals("deaths").items()):
+            pop, age = info.get(state, (0, 0))
+            state_covid = StateCovid(state, pop, age)
+            for month, deaths in months.items():
+                state_covid.add_deaths(month, deaths)
+            data.add_state_data(state_covid)
+        return data
+
+    def cases_by_state(self, period):
+        """
+        {state: cases} for a month, or March - July when period is None.
+        """
+        start, end = self._period(period)
+        sql = f"SELECT state, SUM(new) FROM ({PERIOD_SQL}) " + \
+              "WHERE fips IN (SELECT fips FROM counties) GROUP BY state"
+        return dict(self.conn.execute(sql, {"metric": "cases", "start": start,
+                                            "end": end}))
+
+    def rates_for_states(self, sort_order, period):
+        """
+        The frame of combined.covid_for_states, aggregated in SQL.
+        """
+        data = self.covid_data()
+        cases = self.cases_by_state(period)
+        rows = []
+        for state, sdata in data.data.items():
+            if period is None:
+                deaths = sum(sdata.state_data.values())
+            else:
+                deaths = sdata.state_data.get(int(period), 0)
+            rows.append((state, sdata.population, sdata.median_age,
+                         cases.get(state, 0), deaths))
+        df = pd.DataFrame(rows, columns=["state", "population", "median_age",
+                                         "cases", "deaths"])
+        return df.sort_values(by=sort_order)
+
+
+def _series_rows(metric, matrix):
+    dates = [d.isoformat() for d in matrix.dates]
+    for fips, state, values in zip(matrix.fips.tolist(),
+                                   matrix.state.tolist(),
+                                   matrix.values.tolist()):
+        for day, value in zip(dates, values):
+            yield (metric, fips, state, day, value)
+
+
+def file_signature(files) -> str:
+    """
+    The name, modification time and size of every input file as JSON. It is
+    kept in the database, so open_store() can tell when the files changed.
+    """
+    signature = []
+    for file_name in files:
+        try:
+            stat = os.stat(compressed.resolve(file_name))
+            signature.append([file_name, stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            signature.append([file_name, None, None])
+    return json.dumps(signature)
+
+
+def build(db_file: str = DB_FILE, cases_file: str = CASES_FILE,
+          deaths_file: str = DEATHS_FILE,
+          population_file: str = POPULATION_FILE,
+          age_file: str = AGE_FILE):
+    """
+    Creates or refreshes the database from the case and death files.
+    """
+    files = (cases_file, deaths_file, population_file, age_file)
+    signature = file_signature(files)
+    cases = CountyMatrix.from_csv(cases_file, population_file)
+    deaths = CountyMatrix.from_csv(deaths_file, measure="deaths")
+    median_age = StateCovidData("no_file.txt", True)._get_median_age(age_file)
+
+    store = SqliteStore(db_file)
+    store.load(cases, deaths, median_age)
+    store.set_inputs(signature)
+    return store
+
+
+def open_store(db_file: str = DB_FILE, cases_file: str = CASES_FILE,
+               deaths_file: str = DEATHS_FILE,
+               population_file: str = POPULATION_FILE,
+               age_file: str = AGE_FILE):
+    """
+    Opens the database. It is built first when it does not exist, and built
+    again when the input files changed since it was loaded, for example
+    after the daily download.
+    """
+    files = (cases_file, deaths_file, population_file, age_file)
+    if not os.path.exists(db_file):
+        return build(db_file, *files)
+    store = SqliteStore(db_file)
+    if store.inputs() != file_signature(files):
+        logging.info("open_store(): the data files changed, rebuilding " +
+                     f"{db_file}")
+        store.close()
+        return build(db_file, *files)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load the USAFacts files into SQLite")
+
+    parser.add_argument("-d", "--db", dest="db_file", type=str,
+                        default=DB_FILE, help="SQLite database file")
+
+    args = parser.parse_args()
+
+    build(args.db_file).close()
+    print(f"Loaded {args.db_file}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import logging
+import numpy as np
+
+# code: (state FIPS, name, census division)
+STATES = {
+    "AK": (2, "Alaska", "Pacific"),
+    "AL": (1, "Alabama", "East South Central"),
+    "AR": (5, "Arkansas", "West South Central"),
+    "AS": (60, "American Samoa", "Other"),
+    "AZ": (4, "Arizona", "Mountain"),
+    "CA": (6, "California", "Pacific"),
+    "CO": (8, "Colorado", "Mountain"),
+    "CT": (9, "Connecticut", "New England"),
+    "DC": (11, "District of Columbia", "South Atlantic"),
+    "DE": (10, "Delaware", "South Atlantic"),
+    "FL": (12, "Florida", "South Atlantic"),
+    "GA": (13, "Georgia", "South Atlantic"),
+    "GU": (66, "Guam", "Other"),
+    "HI": (15, "Hawaii", "Pacific"),
+    "IA": (19, "Iowa", "West North Central"),
+    "ID": (16, "Idaho", "Mountain"),
+    "IL": (17, "Illinois", "East North Central"),
+    "IN": (18, "Indiana", "East North Central"),
+    "KS": (20, "Kansas", "West North Central"),
+    "KY": (21, "Kentucky", "East South Central"),
+    "LA": (22, "Louisiana", "West South Central"),
+    "MA": (25, "Massachusetts", "New England"),
+    "MD": (24, "Maryland", "South Atlantic"),
+    "ME": (23, "Maine", "New England"),
+    "MI": (26, "Michigan", "East North Central"),
+    "MN": (27, "Minnesota", "West North Central"),
+    "MO": (29, "Missouri", "West North Central"),
+    "MP": (69, "Northern Mariana Islands", "Other"),
+    "MS": (28, "Mississippi", "East South Central"),
+    "MT": (30, "Montana", "Mountain"),
+    "NC": (37, "North Carolina", "South Atlantic"),
+    "ND": (38, "North Dakota", "West North Central"),
+    "NE": (31, "Nebraska", "West North Central"),
+    "NH": (33, "New Hampshire", "New England"),
+    "NJ": (34, "New Jersey", "Middle Atlantic"),
+    "NM": (35, "New Mexico", "Mountain"),
+    "NV": (32, "Nevada", "Mountain"),
+    "NY": (36, "New York", "Middle Atlantic"),
+    "OH": (39, "Ohio", "East North Central"),
+    "OK": (40, "Oklahoma", "West South Central"),
+    "OR": (41, "Oregon", "Pacific"),
+    "PA": (42, "Pennsylvania", "Middle Atlantic"),
+    "PR": (72, "Puerto Rico", "Other"),
+    "RI": (44, "Rhode Island", "New England"),
+    "SC": (45, "South Carolina", "South Atlantic"),
+    "SD": (46, "South Dakota", "West North Central"),
+    "TN": (47, "Tennessee", "East South Central"),
+    "TX": (48, "Texas", "West South Central"),
+    "UT": (49, "Utah", "Mountain"),
+    "VA": (51, "Virginia", "South Atlantic"),
+    "VI": (78, "U.S. Virgin Islands", "Other"),
+    "VT": (50, "Vermont", "New England"),
+    "WA": (53, "Washington", "Pacific"),
+    "WI": (55, "Wisconsin", "East North Central"),
+    "WV": (54, "West Virginia", "South Atlantic"),
+    "WY": (56, "Wyoming", "Mountain"),
+}
+
+DIVISION_REGION = {
+    "New England": "Northeast",
+    "Middle Atlantic": "Northeast",
+    "East North Central": "Midwest",
+    "West North Central": "Midwest",
+    "South Atlantic": "South",
+    "East South Central": "South",
+    "West South Central": "South",
+    "Mountain": "West",
+    "Pacific": "West",
+    "Other": "Other",
+}
+
+# the ids are positions in the alphabetical list of codes, so sorting by id
+# is the same as sorting by code
+CODES = np.array(sorted(STATES), dtype=str)
+FIPS = np.array([STATES[c][0] for c in CODES], dtype=np.int8)
+NAMES = np.array([STATES[c][1] for c in CODES], dtype=str)
+DIVISIONS = np.array([STATES[c][2] for c in CODES], dtype=str)
+REGIONS = np.array([DIVISION_REGION[d] for d in DIVISIONS], dtype=str)
+
+# the 50 states and DC, the codes the command line tools accept
+CHOICES = [c for c in CODES.tolist() if STATES[c][2] != "Other"]
+
+UNKNOWN = -1
+
+
+def state_id(code: str) -> int:
+    """
+    The small integer id of a state code, or UNKNOWN.
+    """
+    pos = int(np.searchsorted(CODES, code))
+    if pos < len(CODES) and CODES[pos] == code:
+        return pos
+    return UNKNOWN
+
+
+def encode(codes):
+    """
+    Converts an array of state codes to an int8 array of ids. Codes that are
+    not in the registry become UNKNOWN.
+    """
+    codes = np.asarray(codes, dtype=str)
+    pos = np.clip(np.searchsorted(CODES, codes), 0, len(CODES) - 1)
+    ids = np.where(CODES[pos] == codes, pos, UNKNOWN).astype(np.int8)
+    if (ids == UNKNOWN).any():
+        logging.debug("encode(): unknown state codes " +
+                      f"{sorted(set(codes[ids == UNKNOWN].tolist()))}")
+    return ids
+
+
+def decode(ids):
+    """
+    Converts ids back to state codes. UNKNOWN becomes an empty string.
+    """
+    ids = np.asarray(ids)
+    return np.where(ids >= 0, CODES[np.clip(ids, 0, None)], "")
+
+
+def bincount(ids, weights=None):
+    """
+    Sums weights (or counts rows) per state id. The result has one entry for
+    every code in the registry; rows with an UNKNOWN id are left out.
+    """
+    ids = np.asarray(ids)
+    known = ids >= 0
+    if weights is not None:
+        weights = np.asarray(weights)[known]
+    return np.bincount(ids[known], weights=weights, minlength=len(CODES))
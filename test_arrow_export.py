@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from datetime import date
+import numpy as np
+import arrow_export
+from covid_deaths import StateCovidData
+from covid_matrix import CountyMatrix
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestArrowExport(unittest.TestCase):
+    def setUp(self):
+        self.matrix = CountyMatrix.from_csv("test_deaths.csv")
+
+    def test_matrix_table(self):
+        table = arrow_export.matrix_table(self.matrix)
+        self.assertEqual(table.num_rows, 6)
+        self.assertEqual(table.column_names[4], "2020-02-29")
+        column = arrow_export.numpy_column(table, "2020-03-31")
+        self.assertEqual(list(column), [1, 1, 1, 10, 10, 10])
+        self.assertFalse(column.flags.writeable)
+
+    def test_long_table(self):
+        table = arrow_export.long_table(self.matrix, self.matrix)
+        self.assertEqual(table.num_rows, 6 * 16)
+        df = table.to_pandas()
+        row = df[(df.fips == 1001) & (df.date == date(2020, 7, 31))]
+        self.assertEqual(int(row["cases"].iloc[0]), 100)
+        county = df[df.fips == 1001]
+        self.assertEqual(int(county["new_cases"].sum()),
+                         int(county["cases"].iloc[-1]))
+
+    def test_state_table(self):
+        data = StateCovidData("no_file.txt", True)
+        data._get_covid_data("test_deaths.csv", "http://google.com")
+        table = arrow_export.state_table(data)
+        self.assertEqual(table.column("state").to_pylist(), ["AL", "CO"])
+        self.assertEqual(table.column("7").to_pylist(), [150, 300])
+
+    def test_write_parquet(self):
+        table = arrow_export.long_table(self.matrix, self.matrix)
+        with tempfile.TemporaryDirectory() as path:
+            arrow_export.write_parquet(table, path)
+            self.assertTrue(os.path.isdir(os.path.join(path, "state=AL",
+                                                       "month=5")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import io
+import os
+import sys
+import json
+import tempfile
+import unittest
+import matplotlib
+import batch
+from contextlib import redirect_stdout
+from covid_deaths import StateCovidData
+from covid_matrix import CountyMatrix
+
+matplotlib.use("Agg")
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        deaths = CountyMatrix.from_csv("test_deaths.csv")
+        deaths.population = deaths.join({1001: 100, 1003: 100, 1005: 200,
+                                         8079: 1000, 8081: 1000, 8083: 1000})
+        covid_data = StateCovidData("no_file.txt", True)
+        covid_data._get_covid_data("test_deaths.csv", "http://google.com")
+        self.data = batch.BatchData(deaths, deaths, covid_data)
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def out(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_read_specs(self):
+        spec_file = self.out("specs.json")
+        with open(spec_file, "w") as f:
+            json.dump({"reports": [{"command": "states", "month": 5}]}, f)
+        self.assertEqual(batch.read_specs(spec_file)[0]["month"], 5)
+
+        with open(spec_file, "w") as f:
+            json.dump([{"command": "combined", "month": "6"}], f)
+        self.assertEqual(batch.read_specs(spec_file)[0]["month"], 6)
+
+        with open(spec_file, "w") as f:
+            json.dump([{"command": "combined", "month": "June"}], f)
+        with self.assertRaises(ValueError):
+            batch.read_specs(spec_file)
+
+        with open(spec_file, "w") as f:
+            json.dump([{"command": "nothing"}], f)
+        with self.assertRaises(ValueError):
+            batch.read_specs(spec_file)
+
+    def test_printed_in_order(self):
+        specs = [{"command": "states", "month": 5},
+                 {"command": "months", "month": 5, "state": "CO"},
+                 {"command": "print"},
+                 {"command": "states", "month": 6}]
+        out = io.StringIO()
+        with redirect_stdout(out):
+            batch.run_batch(specs, self.data, max_workers=4)
+            # stdout is given back
+            self.assertIs(sys.stdout, out)
+        text = out.getvalue()
+        # every table is whole and in the order of the specs
+        lines = text.splitlines()
+        self.assertEqual(len(lines), 3 + 4 + 3 + 3)
+        self.assertTrue(lines[0].endswith("in May 2020 (percentage)"))
+        self.assertTrue(lines[3].endswith("for CO"))
+        self.assertTrue(lines[7].endswith("num_deaths"))
+        self.assertTrue(lines[10].endswith("in June 2020 (percentage)"))
+
+    def test_run_batch(self):
+        specs = [{"command": "states", "month": 7, "output": self.out("s.csv")},
+                 {"command": "months", "month": 7, "state": "AL",
+                  "output": self.out("m.csv"), "plot": True},
+                 {"command": "deaths", "agg": "max",
+                  "output": self.out("d.csv")},
+                 {"command": "combined", "sort": "state",
+                  "output": self.out("c.csv"), "plot": "bar"}]
+        results = batch.run_batch(specs, self.data, max_workers=4)
+
+        self.assertEqual(results[0][("AL", 400)], 37.5)
+        self.assertEqual(list(results[3]["deaths"]), [300, 1497])
+        for name in ["s.csv", "m.csv", "m.png", "d.csv", "c.csv", "c.png"]:
+            self.assertTrue(os.path.exists(self.out(name)))
+
+if __name__ == '__main__':
+    unittest.main()
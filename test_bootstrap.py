@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+import pandas as pd
+import bootstrap
+from covid_matrix import CountyMatrix
+
+
+class TestBootstrap(unittest.TestCase):
+    def setUp(self):
+        self.matrix = CountyMatrix.from_csv("test_deaths.csv")
+        self.matrix.population = self.matrix.join(
+            {1001: 100, 1003: 100, 1005: 200,
+             8079: 1000, 8081: 1000, 8083: 1000})
+
+    def test_county_counts(self):
+        states, cases, deaths, population, starts = bootstrap.county_counts(
+            self.matrix, self.matrix)
+        self.assertEqual(list(states), ["AL", "CO"])
+        self.assertEqual(list(starts), [0, 3])
+        self.assertEqual(population.sum(), 3400)
+
+    def test_same_for_any_workers(self):
+        inline = bootstrap.bootstrap(self.matrix, self.matrix, resamples=250,
+                                     batch=50, max_workers=1)
+        pooled = bootstrap.bootstrap(self.matrix, self.matrix, resamples=250,
+                                     batch=50, max_workers=2)
+        pd.testing.assert_frame_equal(inline, pooled)
+
+    def test_interval_contains_point(self):
+        df = bootstrap.bootstrap(self.matrix, self.matrix, 5, resamples=200)
+        for metric in ("death_rate", "case_rate"):
+            self.assertTrue((df[metric + "_low"] <= df[metric]).all())
+            self.assertTrue((df[metric] <= df[metric + "_high"]).all())
+
+    def test_error_bars(self):
+        intervals = bootstrap.bootstrap(self.matrix, self.matrix,
+                                        resamples=100)
+        frame = pd.DataFrame({"state": ["CO", "AL", "TX"]})
+        bars = bootstrap.error_bars(frame, intervals, "death_rate")
+        self.assertEqual(bars.shape, (2, 3))
+        self.assertTrue((bars >= 0).all())
+        self.assertEqual(list(bars[:, 2]), [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import combined
+import covid_deaths
 from covid_deaths import StateCovidData, StateCovid
 from covid_cases import StateCountyData, StateCounty
 
@@ -33,5 +34,29 @@ class TestStateCovid(unittest.TestCase):
         self.assertEqual(t["deaths"][0], 150)
         self.assertEqual(t["deaths"][1], 300)
 
+    def test_load_combined(self):
+        covid_data, cases, deaths = combined.load_combined(
+            "test_deaths.csv", "test_deaths.csv", "test_population.csv",
+            "state_median_age.csv", max_workers=2)
+
+        legacy = StateCovidData("no_file.txt", True)
+        legacy._get_covid_data("test_deaths.csv", "http://google.com")
+        # covid_deaths gets the same data from its own loader
+        loaded = covid_deaths.load_covid_data("test_deaths.csv",
+                                              "test_population.csv")
+        for state in ["AL", "CO"]:
+            self.assertEqual(covid_data.get_state_data(state).state_data,
+                             legacy.get_state_data(state).state_data)
+            self.assertEqual(covid_data.get_state_data(state).state_data,
+                             loaded.get_state_data(state).state_data)
+        self.assertEqual(covid_data.get_state_data("AL").population, 400)
+        self.assertEqual(covid_data.get_state_data("AL").median_age, 39.4)
+        self.assertEqual(list(cases.population), [100, 100, 200])
+        self.assertEqual(len(deaths), 3)
+
+    def test_help(self):
+        # a % in a help text breaks -h
+        self.assertIn("95% intervals", combined.build_parser().format_help())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,56 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import compressed
+from covid_deaths import StateCovidData
+from covid_matrix import CountyMatrix
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TestCompressed(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.gz = os.path.join(self.dir.name, "deaths.csv.gz")
+        with open("test_deaths.csv", "rb") as src, gzip.open(self.gz, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        self.plain = CountyMatrix.from_csv("test_deaths.csv",
+                                           "test_population.csv")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_gzip(self):
+        matrix = CountyMatrix.from_csv(self.gz, "test_population.csv")
+        self.assertTrue(np.array_equal(matrix.values, self.plain.values))
+        self.assertEqual(matrix.dates, self.plain.dates)
+
+    def test_resolve(self):
+        name = os.path.join(self.dir.name, "deaths.csv")
+        self.assertEqual(compressed.resolve(name), self.gz)
+        self.assertTrue(compressed.exists(name))
+        self.assertFalse(compressed.exists(name + ".missing"))
+
+        data = StateCovidData("no_file.txt", True)
+        data._get_covid_data(name, "http://google.com")
+        legacy = StateCovidData("no_file.txt", True)
+        legacy._get_covid_data("test_deaths.csv", "http://google.com")
+        self.assertEqual(data.get_state_data("CO").state_data,
+                         legacy.get_state_data("CO").state_data)
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        zst = os.path.join(self.dir.name, "deaths.csv.zst")
+        with open("test_deaths.csv", "rb") as src, open(zst, "wb") as dst:
+            dst.write(zstandard.ZstdCompressor().compress(src.read()))
+        matrix = CountyMatrix.from_csv(zst, "test_population.csv")
+        self.assertTrue(np.array_equal(matrix.values, self.plain.values))
+
+if __name__ == '__main__':
+    unittest.main()
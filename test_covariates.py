@@ -0,0 +1,189 @@
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+import numpy as np
+import pandas as pd
+import combined
+import covariates
+import covid_deaths
+import state_registry
+from covid_matrix import CountyMatrix
+
+
+class TestCovariates(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.income = os.path.join(self.folder.name, "state_income.csv")
+        with open(self.income, "w", encoding="utf-8-sig") as f:
+            f.write('State,Median Household Income,Density,Note\n' +
+                    'AL,"51,734",96.9,low\n' +
+                    'Colorado,"77,127",56.4,\n' +
+                    'Atlantis,1,1,\n' +
+                    'TX,,108,high\n')
+        self.matrix = CountyMatrix.from_csv("test_deaths.csv")
+        self.matrix.population = self.matrix.join({1001: 100, 1003: 100,
+                                                   1005: 200, 8079: 1000,
+                                                   8081: 1000, 8083: 1000})
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_median_age(self):
+        table = covariates.read_table("state_median_age.csv")
+        self.assertEqual(table.level, "state")
+        self.assertEqual(table.names(), ["median_age"])
+        self.assertEqual(table.as_dict()["CO"], 37.1)
+        ages = table.align(state_registry.encode(["CO", "TX", "XX"]))
+        self.assertEqual(list(ages[:2]), [37.1, 35])
+        self.assertTrue(np.isnan(ages[2]))
+
+    def test_state_file(self):
+        table = covariates.read_table(self.income)
+        self.assertEqual(table.names(), ["median_household_income",
+                                         "density"])
+        # Atlantis is not a state, and TX has no income
+        self.assertEqual(len(table), 3)
+        income = table.as_dict("median_household_income")
+        self.assertEqual(income, {"AL": 51734, "CO": 77127})
+
+    def test_county_file(self):
+        table = covariates.read_table("test_population.csv")
+        self.assertEqual(table.level, "county")
+        self.assertEqual(table.names(), ["population"])
+        values = table.align([8003, 1001, 9999], "population")
+        self.assertEqual(list(values[:2]), [2000, 100])
+        self.assertTrue(np.isnan(values[2]))
+
+    def test_usafacts_county_file(self):
+        county = os.path.join(self.folder.name, "county_income.csv")
+        with open(county, "w", encoding="utf-8-sig") as f:
+            f.write("countyFIPS,County Name,State,stateFIPS,income\n" +
+                    "1001,Autauga County,AL,1,10\n" +
+                    "8079,Mineral County,CO,8,50\n")
+        table = covariates.read_table(county)
+        self.assertEqual(table.level, "county")
+        self.assertEqual(table.names(), ["income"])
+
+    def test_store(self):
+        store = covariates.load_store([self.income])
+        self.assertEqual(store.names(), ["density", "median_age",
+                                         "median_household_income"])
+        ages = store.for_states(np.array(["TX", "AL", "XX"]), "median_age")
+        self.assertEqual(list(ages[:2]), [35, 39.4])
+        self.assertTrue(np.isnan(ages[2]))
+
+        # a state covariate lines up with the counties of the state
+        density = store.for_counties(self.matrix, "density")
+        self.assertEqual(list(density), [96.9] * 3 + [56.4] * 3)
+
+        with self.assertRaises(ValueError):
+            store.for_states(["AL"], "unknown")
+
+    def test_county_to_state(self):
+        county = os.path.join(self.folder.name, "county_income.csv")
+        pd.DataFrame({"countyFIPS": [1001, 1003, 1005, 8079],
+                      "County Name": ["A", "B", "C", "D"],
+                      "income": [10, 20, 40, 50]}).to_csv(county, index=False)
+        store = covariates.load_store([county])
+        self.assertEqual(store.level("income"), "county")
+        with self.assertRaises(ValueError):
+            store.for_states(["AL"], "income")
+
+        # weighted by population: (10 * 100 + 20 * 100 + 40 * 200) / 400
+        values = store.for_states(["AL", "CO", "TX"], "income", self.matrix)
+        self.assertAlmostEqual(values[0], 27.5)
+        self.assertEqual(values[1], 50)
+        self.assertTrue(np.isnan(values[2]))
+
+    def test_quantile_groups(self):
+        ids, edges = covariates.quantile_groups([4, 1, np.nan, 3, 2], 2)
+        self.assertEqual(list(ids), [1, 0, -1, 1, 0])
+        self.assertEqual(list(edges), [1, 2.5, 4])
+
+    def test_correlation(self):
+        x = np.array([1, 2, 3, 4, np.nan])
+        self.assertAlmostEqual(covariates.correlation(x, [2, 4, 6, 8, 0]), 1)
+        self.assertAlmostEqual(covariates.correlation(x, [1, 8, 27, 64, 0],
+                                                      "spearman"), 1)
+        self.assertTrue(np.isnan(covariates.correlation([1, 1], [1, 2])))
+
+    def test_combined(self):
+        df = pd.DataFrame({"state": ["AL", "CO", "TX"],
+                           "population": [100, 200, 300],
+                           "cases": [10, 10, 60], "deaths": [1, 4, 3]})
+        store = covariates.load_store([self.income])
+
+        ordered = combined.sort_states(df, "density", store)
+        self.assertEqual(list(ordered["state"]), ["CO", "AL", "TX"])
+
+        grouped = combined.group_by_covariate(df, "density", store, 2)
+        # the median, AL's 96.9, starts the upper group
+        self.assertEqual(list(grouped["states"]), [1, 2])
+        self.assertEqual(list(grouped["cases"]), [10, 70])
+        self.assertEqual(list(grouped["deaths_to_cases"]), [0.4, 0.0571])
+
+        table = combined.correlate_covariates(df, ["median_age"], store)
+        self.assertEqual(list(table["rate"]), ["case_rate", "death_rate",
+                                               "deaths_to_cases"])
+        self.assertEqual(list(table["states"]), [3, 3, 3])
+
+    def test_deaths_table(self):
+        covid_data = covid_deaths.StateCovidData("no_file.txt", True)
+        covid_data._get_covid_data("test_deaths.csv", None)
+        store = covariates.load_store([self.income])
+        df = covid_deaths.deaths_table(covid_data, "total",
+                                       "median_household_income", store)
+        self.assertEqual(list(df["state"]), ["AL", "CO"])
+        self.assertEqual(list(df["median_household_income"]),
+                         [51734, 77127])
+
+        # every period, sorted by a covariate
+        df = covid_deaths.deaths_table(covid_data, "all", "density", store)
+        self.assertEqual(list(df["state"]), ["CO", "AL"])
+        self.assertEqual(list(df["density"]), [56.4, 96.9])
+
+        # an edited file is read again and gives a new table
+        self.assertIs(covariates.load_store([self.income]).tables["density"],
+                      store.tables["density"])
+        with open(self.income, "w", encoding="utf-8") as f:
+            f.write("State,Median Household Income,Density\n" +
+                    "AL,1,96.9\nCO,2,1000\n")
+        edited = covariates.load_store([self.income])
+        self.assertNotEqual(edited.version, store.version)
+        df = covid_deaths.deaths_table(covid_data, "all", "density", edited)
+        self.assertEqual(list(df["density"]), [96.9, 1000])
+
+    def test_deaths_county_covariate(self):
+        county = os.path.join(self.folder.name, "county_income.csv")
+        pd.DataFrame({"countyFIPS": [1001, 1003, 1005, 8079],
+                      "County Name": ["A", "B", "C", "D"],
+                      "income": [10, 20, 40, 50]}).to_csv(county, index=False)
+        covid_data = covid_deaths.StateCovidData("no_file.txt", True)
+        covid_data._get_covid_data("test_deaths.csv", None)
+        store = covariates.load_store([county])
+        df = covid_deaths.deaths_table(covid_data, "total", "income", store,
+                                       self.matrix)
+        self.assertEqual(list(df["state"]), ["AL", "CO"])
+        self.assertEqual(list(df["income"]), [27.5, 50])
+
+        output = os.path.join(self.folder.name, "deaths.csv")
+        covid_deaths.run_command(covid_data, "print", "income", "total", None,
+                                 False, output, [county],
+                                 deaths_matrix=self.matrix)
+        self.assertEqual(pd.read_csv(output)["income"].tolist(), [27.5, 50])
+
+        # without the matrix, or with an unknown sort order, it is a usage
+        # error
+        for sort_order, matrix in [("income", None), ("nope", self.matrix)]:
+            with redirect_stderr(io.StringIO()):
+                with self.assertRaises(SystemExit) as exit:
+                    covid_deaths.run_command(covid_data, "print", sort_order,
+                                             "total", None, False, output,
+                                             [county], deaths_matrix=matrix)
+            self.assertEqual(exit.exception.code, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from covid_deaths import StateCovid, StateCovidData
+import numpy as np
+from covid_deaths import StateCovid, StateCovidData, load_covid_data
 
 
 class TestStateCovid(unittest.TestCase):
@@ -159,5 +160,17 @@ class TestStateCovidData(unittest.TestCase):
         ts = data_dict.get_state_data("CO")
         self.assertEqual(ts.state_data[3], 27)
         self.assertEqual(ts.state_data[7], 300)
+
+    def test_low_memory_columns(self):
+        data = load_covid_data("test_deaths.csv", "test_population.csv")
+        self.assertEqual(data.columns()["median_age"].dtype, np.float64)
+
+        small = load_covid_data("test_deaths.csv", "test_population.csv",
+                                low_memory=True)
+        columns = small.columns()
+        self.assertEqual(columns["median_age"].dtype, np.float32)
+        self.assertAlmostEqual(float(columns["median_age"][0]), 39.4,
+                               places=5)
+        self.assertEqual(list(columns[7]), list(data.columns()[7]))
         
 
@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+from covid_matrix import CountyMatrix, footprint
+
+
+class TestLowMemory(unittest.TestCase):
+    def setUp(self):
+        self.matrix = CountyMatrix.from_csv("test_deaths.csv",
+                                            "test_population.csv")
+        self.small = CountyMatrix.from_csv("test_deaths.csv",
+                                           "test_population.csv",
+                                           low_memory=True)
+
+    def test_dtypes(self):
+        self.assertEqual(self.small.values.dtype, np.int32)
+        self.assertEqual(self.small.population.dtype, np.uint32)
+        self.assertEqual(self.small.fips.dtype, np.int32)
+        self.assertTrue(self.small.low_memory)
+        self.assertFalse(self.matrix.low_memory)
+        # row selections keep the small dtypes
+        self.assertEqual(self.small.take([0]).values.dtype, np.int32)
+
+    def test_same_results(self):
+        self.assertTrue(np.array_equal(self.small.period_values(7),
+                                       self.matrix.period_values(7)))
+        self.assertTrue(np.array_equal(
+            self.small.rollup().values["state"],
+            self.matrix.rollup().values["state"]))
+
+    def test_downcast_overflow(self):
+        matrix = CountyMatrix([1001], ["A"], ["AL"], self.matrix.dates[:1],
+                              [[2 ** 40]], [100])
+        with self.assertLogs(level="WARNING"):
+            small = matrix.downcast()
+        self.assertEqual(small.values.dtype, np.int64)
+        self.assertEqual(small.population.dtype, np.uint32)
+
+    def test_footprint(self):
+        sizes = self.small.nbytes()
+        self.assertEqual(sizes["values"] * 2, self.matrix.nbytes()["values"])
+        report = footprint({"deaths": self.small})
+        self.assertIn("values      int32", report)
+        self.assertTrue(report.splitlines()[-1].startswith("total"))
+
+if __name__ == '__main__':
+    unittest.main()
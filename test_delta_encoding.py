@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import delta_encoding
+from covid_matrix import CountyMatrix
+
+
+class TestDeltaEncoding(unittest.TestCase):
+    def setUp(self):
+        self.values = np.array([[0, 0, 0, 0, 0],
+                                [0, 0, 3, 5, 4],
+                                [1, 2, 100000, 100001, 100002],
+                                [0, -2, -2, 0, 0]], dtype=np.int64)
+
+    def test_round_trip(self):
+        encoded = delta_encoding.encode(self.values)
+        self.assertEqual(list(encoded.start), [5, 2, 0, 1])
+        # only the columns from the first non-zero value are stored
+        self.assertEqual(len(encoded.deltas), 0 + 3 + 5 + 4)
+        self.assertEqual(list(encoded.patch), [99998])
+        decoded = encoded.decode()
+        self.assertEqual(decoded.dtype, np.int64)
+        self.assertTrue((decoded == self.values).all())
+
+    def test_keeps_dtype(self):
+        values = self.values.astype(np.int32)
+        decoded = delta_encoding.encode(values).decode()
+        self.assertEqual(decoded.dtype, np.int32)
+        self.assertTrue((decoded == values).all())
+
+    def test_random(self):
+        rng = np.random.default_rng(1)
+        daily = rng.integers(-5, 50, size=(200, 120))
+        daily[:, :40] = 0
+        daily[rng.random(daily.shape) < 0.001] = 70000
+        values = np.cumsum(daily, axis=1)
+        encoded = delta_encoding.encode(values)
+        self.assertTrue((encoded.decode() == values).all())
+        self.assertLess(encoded.nbytes(), values.nbytes / 4)
+
+    def test_compact_file(self):
+        matrix = CountyMatrix.from_csv("test_deaths.csv", "test_population.csv")
+        with tempfile.TemporaryDirectory() as folder:
+            name = os.path.join(folder, "deaths.npz")
+            matrix.save(name, compact=True)
+            loaded = CountyMatrix.load(name)
+        self.assertTrue((loaded.values == matrix.values).all())
+        self.assertTrue((loaded.population == matrix.population).all())
+        self.assertEqual(loaded.dates, matrix.dates)
+        self.assertEqual(list(loaded.county), list(matrix.county))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import io
+import unittest
+import numpy as np
+import hotspots
+from contextlib import redirect_stderr
+from covid_matrix import CountyMatrix
+
+
+class TestHotspots(unittest.TestCase):
+    def test_top_k(self):
+        values = np.array([5, 1, np.nan, 9, 3, 7])
+        self.assertEqual(list(hotspots.top_k(values, 3)), [3, 5, 0])
+        self.assertEqual(list(hotspots.top_k(values, 10)), [3, 5, 0, 4, 1])
+        self.assertEqual(len(hotspots.top_k(values, 0)), 0)
+
+    def test_top_k_per_group(self):
+        values = np.array([5, 1, 9, 3, 7, np.nan])
+        groups = np.array(["TX", "AL", "TX", "AL", "TX", "AL"])
+        rows = hotspots.top_k_per_group(values, groups, 2)
+        self.assertEqual(list(rows), [3, 1, 2, 4])
+
+    def test_metric_values(self):
+        rate = hotspots.metric_values("deaths_to_cases", [100, 0], [10, 5],
+                                      [1000, 1000])
+        self.assertEqual(rate[0], .1)
+        self.assertTrue(np.isnan(rate[1]))
+
+    def test_rank_hotspots(self):
+        deaths = CountyMatrix.from_csv("test_deaths.csv")
+        cases = CountyMatrix(deaths.fips, deaths.county, deaths.state,
+                             deaths.dates, deaths.values * 10,
+                             [100, 100, 200, 1000, 1000, 1000])
+
+        ranking = hotspots.rank_hotspots(cases, deaths, "case_rate", 2,
+                                         month=7)
+        self.assertEqual(ranking[0][0], "Autauga County")
+        self.assertEqual(ranking[0][3], 500)
+        self.assertEqual(ranking[0][5], 5.0)
+
+        ranking = hotspots.rank_hotspots(cases, deaths, "death_rate", 5,
+                                         level="state")
+        self.assertEqual([r[0] for r in ranking], ["AL", "CO"])
+        self.assertEqual(ranking[0][4], 300)
+
+        ranking = hotspots.rank_hotspots(cases, deaths, "case_rate", 1,
+                                         per_state=True)
+        self.assertEqual([r[1] for r in ranking], ["AL", "CO"])
+
+    def test_arguments(self):
+        args = hotspots.parse_my_args(["top", "-l", "TX", "--per-state"])
+        self.assertTrue(args.per_state)
+        # the county options are refused at other levels
+        for words in (["-g", "state", "--per-state"],
+                      ["-g", "region", "-l", "TX"]):
+            with redirect_stderr(io.StringIO()), \
+                    self.assertRaises(SystemExit):
+                hotspots.parse_my_args(["top"] + words)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+import numpy as np
+from datetime import date, timedelta
+import lag_analysis
+from covid_matrix import CountyMatrix
+
+
+class TestLagAnalysis(unittest.TestCase):
+    def setUp(self):
+        dates = [date(2020, 1, 22) + timedelta(days=n) for n in range(200)]
+        rng = np.random.default_rng(7)
+        daily = rng.integers(0, 1000, size=(2, 200))
+        cases = np.cumsum(daily, axis=1)
+        # deaths are 10% of the cases 12 days earlier
+        deaths = np.zeros_like(cases)
+        deaths[:, 12:] = cases[:, :-12] // 10
+        self.cases = CountyMatrix([1001, 48001], ["A", "B"], ["AL", "TX"],
+                                  dates, cases, [1000, 1000])
+        self.deaths = CountyMatrix([1001, 48001], ["A", "B"], ["AL", "TX"],
+                                   dates, deaths, [1000, 1000])
+
+    def test_lagged_ratios(self):
+        cases = np.array([[0, 10, 20, 30, 40]])
+        deaths = np.array([[0, 0, 1, 2, 3]])
+        ratios = lag_analysis.lagged_ratios(cases, deaths, 2, 4, 2)
+        self.assertEqual(list(ratios[0]), [.1, .1, .1])
+
+    def test_analyze(self):
+        result = lag_analysis.analyze(self.cases, self.deaths, 5, 20)
+        self.assertEqual(list(result.states), ["AL", "TX"])
+        self.assertEqual(list(result.best_lag), [12, 12])
+        self.assertAlmostEqual(result.best_ratios()["AL"], .1, 2)
+        self.assertEqual(result.ratios.shape, (2, 21))
+
+if __name__ == '__main__':
+    unittest.main()
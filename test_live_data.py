@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+import live_data
+
+
+class TestLiveData(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.deaths = os.path.join(self.dir.name, "deaths.csv")
+        shutil.copy("test_deaths.csv", self.deaths)
+        self.live = live_data.LiveDataset(self.deaths, self.deaths,
+                                          "test_population.csv",
+                                          "state_median_age.csv")
+
+    def tearDown(self):
+        self.live.stop()
+        self.dir.cleanup()
+
+    def test_snapshot(self):
+        snapshot = self.live.current()
+        self.assertEqual(snapshot.version, 1)
+        self.assertFalse(snapshot.cases.values.flags.writeable)
+        self.assertFalse(snapshot.deaths.rollup().values["state"]
+                         .flags.writeable)
+        with self.assertRaises(TypeError):
+            snapshot.covid_data.get_state_data("AL").add_deaths(7, 1)
+        with self.assertRaises(TypeError):
+            snapshot.covid_data.data["XX"] = None
+        self.assertEqual(snapshot.covid_data.get_state_data("AL")
+                         .get_population(), 400)
+        self.assertFalse(self.live.reload())
+        self.assertIs(self.live.current(), snapshot)
+
+    def test_reload_swaps(self):
+        before = self.live.current()
+        with open(self.deaths, "r") as f:
+            text = f.read()
+        with open(self.deaths, "w") as f:
+            f.write(text.replace("1001,Autauga County,AL,1,0,1,1,5,10,10,",
+                                 "1001,Autauga County,AL,1,0,1,1,5,10,15,"))
+        os.utime(self.deaths, ns=(0, 0))
+
+        self.assertTrue(self.live.reload())
+        after = self.live.current()
+        self.assertEqual(after.version, 2)
+        self.assertEqual(after.cases.values[0, 5], 15)
+        self.assertEqual(before.cases.values[0, 5], 10)
+
+    def test_failed_reload_keeps_snapshot(self):
+        before = self.live.current()
+        with open(self.deaths, "w") as f:
+            f.write("not a usafacts file\n1,2\n")
+        with self.assertLogs(level="ERROR"):
+            self.assertFalse(self.live.reload())
+        self.assertIs(self.live.current(), before)
+
+if __name__ == '__main__':
+    unittest.main()
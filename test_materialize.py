@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+import batch
+import covid_cases
+import materialize
+from query_cache import CACHE
+from covid_deaths import StateCovidData
+from covid_matrix import CountyMatrix
+
+
+class TestMaterialize(unittest.TestCase):
+    def setUp(self):
+        self.cases = CountyMatrix.from_csv("test_deaths.csv")
+        self.cases.population = self.cases.join(
+            {1001: 100, 1003: 100, 1005: 200, 8079: 1000, 8081: 1000,
+             8083: 1000})
+        self.covid_data = StateCovidData("no_file.txt", True)
+        self.covid_data._get_covid_data("test_deaths.csv", "http://google.com")
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def assertTables(self, tables):
+        # 5 'states' tables, 2 states x 5 'months' tables, 9 deaths tables,
+        # 18 combined frames and 6 national totals
+        self.assertEqual(len(tables), 5 + 10 + 9 + 18 + 6)
+        args = SimpleNamespace(which_month="7", which_state="CO",
+                               o_file="/dev/null", plot=False)
+        rates = covid_cases.months(args, store=tables)
+        df = tables.get(materialize.combined_name(7, "state"))
+        deaths = tables.get(materialize.deaths_name("max", "state"))
+
+        self.assertEqual(list(rates.values()), [10.0, 10.0, 10.0])
+        self.assertEqual(list(df["deaths"]), [150, 300])
+        self.assertEqual(list(deaths["num_deaths"]), [150, 450])
+        self.assertIsNone(tables.get(materialize.deaths_name("max", "income")))
+
+    def test_materialize(self):
+        maxsize = CACHE.maxsize
+        tables = materialize.materialize(self.cases, self.covid_data,
+                                         self.cases)
+        self.assertTables(tables)
+        self.assertEqual(CACHE.maxsize, maxsize)
+
+    def test_saved_tables(self):
+        files = [os.path.join(self.folder.name, f)
+                 for f in ("test_deaths.csv", "test_population.csv")]
+        for file_name in files:
+            shutil.copy(os.path.basename(file_name), file_name)
+        root = os.path.join(self.folder.name, "tables")
+        self.assertIsNone(materialize.open_tables(files, root))
+
+        folder = materialize.table_folder(files, root)
+        materialize.materialize(self.cases, self.covid_data, self.cases,
+                                materialize.TableStore(folder))
+        self.assertTables(materialize.open_tables(files, root))
+
+        # the tables of an edited file are not found
+        with open(files[1], "a") as f:
+            f.write("1001,Autauga County,AL,1\n")
+        self.assertIsNone(materialize.open_tables(files, root))
+
+    def test_batch_materialize(self):
+        data = batch.BatchData(self.cases, self.cases, self.covid_data)
+        results = batch.run_batch([{"command": "states", "month": 7,
+                                    "output": "/dev/null"}], data,
+                                  materialize=True)
+        self.assertEqual(results[0][("AL", 400)], 37.5)
+        self.assertIsNotNone(data.tables)
+
+if __name__ == '__main__':
+    unittest.main()
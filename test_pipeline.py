@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pipeline
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cases = self.path("cases.csv")
+        self.deaths = self.path("deaths.csv")
+        self.population = self.path("population.csv")
+        shutil.copy("test_deaths.csv", self.cases)
+        shutil.copy("test_deaths.csv", self.deaths)
+        with open(self.population, "w") as f:
+            f.write("countyFIPS,County Name,State,population\n")
+            for fips, state, pop in [(1001, "AL", 100), (1003, "AL", 100),
+                                     (1005, "AL", 200), (8079, "CO", 1000),
+                                     (8081, "CO", 1000), (8083, "CO", 1000)]:
+                f.write(f"{fips},County,{state},{pop}\n")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def run_pipeline(self):
+        stages = pipeline.default_stages(self.path("out"),
+                                         cases_file=self.cases,
+                                         deaths_file=self.deaths,
+                                         population_file=self.population,
+                                         age_file="state_median_age.csv")
+        return pipeline.Pipeline(stages, self.path("out/state.json")).run(4)
+
+    def test_skip_unchanged(self):
+        first = self.run_pipeline()
+        self.assertEqual(set(first.values()), {"ran"})
+        self.assertTrue(os.path.exists(self.path("out/combined.png")))
+
+        second = self.run_pipeline()
+        self.assertEqual(set(second.values()), {"skipped"})
+
+        # only the stages that read the deaths file run again
+        with open(self.deaths, "a") as f:
+            f.write("8085,New County,CO,8,0,0,0,0,0,0,0,0,0,0,5,5,5,5,5,5\n")
+        third = self.run_pipeline()
+        ran = {name for name, result in third.items() if result == "ran"}
+        self.assertEqual(ran, {"parse deaths", "aggregate deaths",
+                               "aggregate combined", "render deaths",
+                               "render combined", "render grid"})
+
+    def test_unchanged_output_stops_reruns(self):
+        self.run_pipeline()
+        # a new file with the same contents changes nothing downstream
+        shutil.copy(self.deaths, self.deaths + ".new")
+        os.replace(self.deaths + ".new", self.deaths)
+        self.assertEqual(set(self.run_pipeline().values()), {"skipped"})
+
+    def test_failed_stage_blocks_dependents(self):
+        def fail(inputs, outputs):
+            raise ValueError("broken")
+
+        def write(inputs, outputs):
+            with open(outputs[0], "w") as f:
+                f.write("x")
+
+        stages = [pipeline.Stage("a", fail, [self.cases], [self.path("a")]),
+                  pipeline.Stage("b", write, [self.path("a")],
+                                 [self.path("b")]),
+                  pipeline.Stage("c", write, [self.cases], [self.path("c")])]
+        with self.assertLogs(level="ERROR"):
+            results = pipeline.Pipeline(stages, self.path("s.json")).run()
+        self.assertEqual(results, {"a": "failed", "b": "blocked",
+                                   "c": "ran"})
+
+if __name__ == '__main__':
+    unittest.main()
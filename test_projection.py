@@ -0,0 +1,69 @@
+import io
+import unittest
+from contextlib import redirect_stderr
+from datetime import date, timedelta
+from types import SimpleNamespace
+import numpy as np
+import covid_cases
+import projection
+from covid_matrix import CountyMatrix
+
+
+class TestProjection(unittest.TestCase):
+    def setUp(self):
+        # daily counts of exp(0.1 * day) - 1 and a flat county
+        days = np.arange(-20, 1)
+        daily = np.vstack([np.expm1(0.1 * (days + 30)), np.full(21, 5.0)])
+        self.values = np.cumsum(daily, axis=1)
+
+    def test_fit(self):
+        intercept, slope = projection.fit_log_linear(
+            np.diff(self.values, axis=1), 14)
+        self.assertAlmostEqual(slope[0], 0.1)
+        self.assertAlmostEqual(intercept[0], 3.0)
+        self.assertAlmostEqual(slope[1], 0.0)
+
+    def test_project_rows(self):
+        slope, new, total = projection.project_rows(self.values, 14, 7)
+        expected = np.expm1(0.1 * (np.arange(1, 8) + 30)).sum()
+        self.assertAlmostEqual(new[0], expected, places=4)
+        self.assertAlmostEqual(new[1], 35.0)
+        self.assertAlmostEqual(total[1], self.values[1, -1] + 35.0)
+        self.assertEqual(projection.doubling_days(slope)[1], np.inf)
+
+    def test_process_pool(self):
+        values = np.tile(self.values, (50, 1))
+        inline = projection.project_matrix(values, max_workers=1)
+        pooled = projection.project_matrix(values, max_workers=2,
+                                           chunk_rows=16)
+        for a, b in zip(inline, pooled):
+            self.assertTrue(np.allclose(a, b))
+
+    def test_project_command(self):
+        dates = [date(2020, 5, 1) + timedelta(days=i) for i in range(31)]
+        values = np.cumsum(np.vstack([np.full(31, 10), np.full(31, 2)]),
+                           axis=1)
+        matrix = CountyMatrix([1001, 1003], ["A County", "B County"],
+                              ["AL", "AL"], dates, values, [100, 200])
+        args = SimpleNamespace(which_month="5", which_state=None,
+                               counties=False, window=14, horizon=10,
+                               deaths=False, o_file="/dev/null", plot=False)
+        result = covid_cases.project(args, matrix)
+        self.assertEqual(list(result.names), ["AL"])
+        self.assertAlmostEqual(result.new[0], 120.0)
+
+        args.which_state = "AL"
+        rows = list(covid_cases.project(args, matrix).rows())
+        self.assertEqual(rows[1]["projected_new"], 20)
+        self.assertEqual(rows[1]["projected_total"], 82)
+
+        # a window longer than the data is a usage error, not a traceback
+        args.window = 31
+        with redirect_stderr(io.StringIO()) as err:
+            with self.assertRaises(SystemExit) as exit:
+                covid_cases.project(args, matrix)
+        self.assertEqual(exit.exception.code, 2)
+        self.assertIn("--window 31 needs 32 days", err.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from datetime import date
+from query import CountyQuery
+
+
+class TestCountyQuery(unittest.TestCase):
+    def test_where_state(self):
+        matrix = CountyQuery("test_deaths.csv", "test_population.csv") \
+            .where(state="AL").load()
+        self.assertEqual(list(matrix.fips), [1001, 1003, 1005])
+        self.assertEqual(list(matrix.population), [100, 100, 200])
+
+    def test_where_fips(self):
+        matrix = CountyQuery("test_deaths.csv", None) \
+            .where(fips=[8081, 1003]).load()
+        self.assertEqual(list(matrix.fips), [1003, 8081])
+
+    def test_for_month(self):
+        matrix = CountyQuery("test_deaths.csv", None).for_month(5).load()
+        self.assertEqual(matrix.dates, [date(2020, 4, 30), date(2020, 5, 1),
+                                        date(2020, 5, 31)])
+        self.assertEqual(list(matrix.period_values(5)), [10, 10, 10, 150, 150, 150])
+
+        # months outside the loaded window are errors on both sides
+        for month in (4, 6):
+            with self.assertRaises(KeyError):
+                matrix.period_values(month)
+
+    def test_reuse(self):
+        base = CountyQuery("test_deaths.csv", None)
+        al = base.where(state="AL")
+        base.where(state="CO").for_month(5)
+        self.assertIsNone(base.states)
+        self.assertIsNone(base.start)
+        self.assertEqual(al.states, ["AL"])
+
+    def test_no_match(self):
+        matrix = CountyQuery("test_deaths.csv", None).where(state="TX") \
+            .for_month(5).load()
+        self.assertEqual(matrix.values.shape, (0, 3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from types import SimpleNamespace
+import covid_cases
+import query_cache
+from covid_deaths import StateCovid, StateCovidData
+from covid_matrix import CountyMatrix
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_lru(self):
+        cache = query_cache.QueryCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.info(), (1, 1, 2, 2))
+
+    def test_get_or_compute(self):
+        cache = query_cache.QueryCache()
+        calls = []
+        compute = lambda: calls.append(1) or len(calls)
+        self.assertEqual(cache.get_or_compute("k", compute), 1)
+        self.assertEqual(cache.get_or_compute("k", compute), 1)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_versions(self):
+        deaths = CountyMatrix.from_csv("test_deaths.csv",
+                                       "test_population.csv")
+        args = SimpleNamespace(which_month="7", o_file="/dev/null",
+                               plot=False)
+        before = query_cache.CACHE.info()
+        first = covid_cases.states(args, deaths)
+        self.assertIs(covid_cases.states(args, deaths), first)
+        after = query_cache.CACHE.info()
+        self.assertEqual(after.hits - before.hits, 1)
+        self.assertEqual(after.misses - before.misses, 1)
+
+        other = deaths.take([0, 1, 2])
+        self.assertNotEqual(other.version, deaths.version)
+        covid_cases.states(args, other)
+        self.assertEqual(query_cache.CACHE.info().misses - after.misses, 1)
+
+        # a changed dataset is not answered from the old results
+        version = deaths.version
+        deaths.population = deaths.population * 2
+        self.assertNotEqual(deaths.version, version)
+        self.assertIsNot(covid_cases.states(args, deaths), first)
+        with self.assertRaises(AttributeError):
+            deaths.values = deaths.values * 2
+
+    def test_state_data_versions(self):
+        data = StateCovidData("no_file.txt", True)
+        state = StateCovid("AL", 100, 39.4)
+        data.add_state_data(state)
+        version = data.version
+        state.add_deaths(3, 1)
+        self.assertNotEqual(data.version, version)
+        version = data.version
+        data.add_state_data(StateCovid("CO"))
+        self.assertNotEqual(data.version, version)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import numpy as np
+from covid_matrix import CountyMatrix
+
+
+class TestRollup(unittest.TestCase):
+    def setUp(self):
+        self.matrix = CountyMatrix.from_csv("test_deaths.csv")
+        self.matrix.population = np.array([100, 100, 200, 1000, 1000, 1000])
+
+    def test_levels(self):
+        rollup = self.matrix.rollup()
+        self.assertEqual(list(rollup.names["state"]), ["AL", "CO"])
+        self.assertEqual(list(rollup.names["division"]),
+                         ["East South Central", "Mountain"])
+        self.assertEqual(list(rollup.names["region"]), ["South", "West"])
+        self.assertEqual(list(rollup.population["state"]), [400, 3000])
+        self.assertEqual(list(rollup.period_values("state", 7)), [150, 300])
+        self.assertIs(rollup, self.matrix.rollup())
+
+    def test_nation(self):
+        rollup = self.matrix.rollup()
+        self.assertEqual(rollup.totals("nation", "US"), (3400, 300 + 1497))
+        self.assertEqual(rollup.totals("region", "West", 3), (3000, 27))
+        self.assertTrue(np.array_equal(rollup.values["nation"][0],
+                                       self.matrix.values.sum(axis=0)))
+
+    def test_new_population(self):
+        self.matrix.rollup()
+        self.matrix.population = self.matrix.population * 2
+        self.assertEqual(self.matrix.rollup().totals("nation", "US")[0], 6800)
+
+if __name__ == '__main__':
+    unittest.main()
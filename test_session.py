@@ -0,0 +1,66 @@
+import io
+import unittest
+import matplotlib
+from contextlib import redirect_stdout
+import live_data
+import session
+
+matplotlib.use("Agg")
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.live = live_data.LiveDataset("test_deaths.csv", "test_deaths.csv",
+                                          "test_population.csv",
+                                          "state_median_age.csv")
+        self.shell = session.Session(self.live)
+
+    def run_line(self, line):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            stop = self.shell.onecmd(line)
+        self.assertFalse(stop)
+        return out.getvalue()
+
+    def test_states(self):
+        out = self.run_line("states 5")
+        self.assertIn("infection rate in May 2020", out)
+        self.assertIn("AL", out)
+
+    def test_deaths(self):
+        out = self.run_line("print -a max -s state")
+        self.assertIn("num_deaths", out)
+
+    def test_options(self):
+        # the deaths data of -f is read like covid_deaths.py reads it
+        self.assertNotIn("GA", self.run_line("print -a max -s state"))
+        self.assertIn("GA", self.run_line("print -a max -s state " +
+                                          "-f covid.data.txt"))
+        self.assertIn("--low-memory is ignored",
+                      self.run_line("states 5 --low-memory"))
+        self.assertIn("--low-memory is ignored",
+                      self.run_line("print --low-memory"))
+
+    def test_bad_arguments_keep_session(self):
+        with redirect_stdout(io.StringIO()):
+            self.run_line("states 9")
+            self.run_line("months 5")
+            self.run_line("state")
+        self.assertIn("Unknown command", self.run_line("bogus"))
+        self.assertTrue(self.shell.onecmd("quit"))
+
+    def test_reload(self):
+        self.assertIn("version 1", self.run_line("reload"))
+        self.assertIn("version 2", self.run_line("reload force"))
+
+    def test_complete(self):
+        self.assertEqual(self.shell.completedefault("--so", "deaths --so", 7,
+                                                    11), ["--sort", "--source"])
+        self.assertEqual(self.shell.completedefault("m", "deaths -a m", 10, 11),
+                         ["max"])
+        self.assertIn("-l", self.shell.completenames("-"))
+        self.assertIn("reload", self.shell.completenames("re"))
+
+
+if __name__ == '__main__':
+    unittest.main()
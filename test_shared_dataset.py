@@ -0,0 +1,44 @@
+import unittest
+import tempfile
+import numpy as np
+import shared_dataset
+from covid_matrix import CountyMatrix
+
+
+class TestSharedDataset(unittest.TestCase):
+    def setUp(self):
+        self.deaths = CountyMatrix.from_csv("test_deaths.csv",
+                                            "test_population.csv")
+
+    def test_attach_shared_memory(self):
+        with shared_dataset.SharedDataset({"deaths": self.deaths}) as shared:
+            attached = shared_dataset.attach(shared.manifest)["deaths"]
+            self.assertTrue(np.array_equal(attached.values, self.deaths.values))
+            self.assertEqual(list(attached.state), list(self.deaths.state))
+            self.assertEqual(attached.dates, self.deaths.dates)
+            self.assertFalse(attached.values.flags.owndata)
+
+    def test_attach_mmap(self):
+        with tempfile.TemporaryDirectory() as path:
+            shared = shared_dataset.SharedDataset({"deaths": self.deaths}, path)
+            attached = shared_dataset.attach(shared.manifest)["deaths"]
+            self.assertTrue(np.array_equal(attached.period_values(7),
+                                           self.deaths.period_values(7)))
+            del attached
+
+    def test_run_in_workers(self):
+        matrices = {"cases": self.deaths, "deaths": self.deaths}
+        with shared_dataset.SharedDataset(matrices) as shared:
+            results = shared_dataset.run_in_workers(
+                shared.manifest,
+                [(shared_dataset.worker_states, ("7",)),
+                 (shared_dataset.worker_months, ("7", "AL")),
+                 (shared_dataset.worker_combined, ("state", None))],
+                max_workers=2)
+
+        self.assertEqual(results[0][("AL", 400)], 150 * 100 / 400)
+        self.assertEqual(list(results[1].values()), [50.0, 50.0, 25.0])
+        self.assertEqual(list(results[2]["deaths"]), [300])
+
+if __name__ == '__main__':
+    unittest.main()
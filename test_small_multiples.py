@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import small_multiples
+from covid_matrix import CountyMatrix
+
+
+class TestSmallMultiples(unittest.TestCase):
+    def setUp(self):
+        self.deaths = CountyMatrix.from_csv("test_deaths.csv")
+
+    def test_state_series(self):
+        names, x, values = small_multiples.state_series(self.deaths)
+        self.assertEqual(list(names), ["AL", "CO"])
+        self.assertEqual(list(x), [3, 4, 5, 6, 7])
+        self.assertEqual(values.shape, (2, 5))
+
+        names, x, daily = small_multiples.state_series(self.deaths, True)
+        self.assertEqual(daily.shape[1], len(x))
+        self.assertTrue((daily >= 0).all())
+        # the days start with March 1 and add up to the months
+        self.assertEqual(x[0], 1)
+        self.assertTrue((daily.sum(axis=1) == values.sum(axis=1)).all())
+
+    def test_grid_segments(self):
+        x = np.arange(3)
+        values = np.array([[0, 5, 10], [0, 1, 2], [0, 4, 4]])
+        segments = small_multiples.grid_segments(x, values, columns=2)
+        self.assertEqual(segments.shape, (3, 3, 2))
+        # the third state starts the second row
+        self.assertAlmostEqual(segments[2, 0, 0], segments[0, 0, 0])
+        self.assertAlmostEqual(segments[2, 0, 1] - segments[0, 0, 1], -1.0)
+        # every line stays inside its cell
+        self.assertTrue((segments[1, :, 0] > 1).all())
+        self.assertTrue((segments[1, :, 0] < 2).all())
+
+        shared = small_multiples.grid_segments(x, values, 2)
+        own = small_multiples.grid_segments(x, values, 2, "state")
+        self.assertAlmostEqual(shared[1, 2, 1], own[1, 2, 1] - 0.8 * 0.85)
+
+    def test_draw_grid(self):
+        fig = small_multiples.draw_grid(self.deaths, self.deaths, daily=True)
+        self.assertEqual(len(fig.axes[0].collections), 4)
+        # the shared scales are in the legend
+        labels = [t.get_text() for t in fig.axes[0].get_legend().get_texts()]
+        self.assertTrue(all("top of a cell" in l for l in labels))
+        with tempfile.TemporaryDirectory() as folder:
+            name = os.path.join(folder, "grid.png")
+            fig.savefig(name)
+            self.assertTrue(os.path.getsize(name) > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
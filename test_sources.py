@@ -0,0 +1,162 @@
+import os
+import csv
+import tempfile
+import unittest
+from datetime import date
+import numpy as np
+import sources
+import covid_deaths
+import state_registry
+from covid_matrix import CountyMatrix
+
+NAMES = dict(zip(state_registry.CODES.tolist(),
+                 state_registry.NAMES.tolist()))
+
+
+class TestSources(unittest.TestCase):
+    """
+    The test deaths file written out again in the JHU and NYT layouts must
+    read back as the same matrix.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.usafacts = CountyMatrix.from_csv("test_deaths.csv",
+                                              "test_population.csv")
+        self.jhu = os.path.join(self.folder.name, "jhu.csv")
+        self.nyt = os.path.join(self.folder.name, "nyt.csv")
+        m = CountyMatrix.from_csv("test_deaths.csv")
+
+        with open(self.jhu, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["UID", "iso2", "FIPS", "Admin2", "Province_State",
+                             "Country_Region", "Combined_Key", "Population"] +
+                            [f"{d.month}/{d.day}/{d.year % 100}"
+                             for d in m.dates])
+            for i in range(len(m)):
+                state = NAMES[m.state[i]]
+                writer.writerow([84000000 + m.fips[i], "US",
+                                 f"{m.fips[i]}.0", m.county[i], state, "US",
+                                 f"{m.county[i]}, {state}, US", 100] +
+                                m.values[i].tolist())
+            # out of state rows have FIPS codes above any county
+            writer.writerow([84080001, "US", "80001.0", "Out of AL", "Alabama",
+                             "US", "\"Out of AL, Alabama\", US", 0] +
+                            [7] * len(m.dates))
+
+        with open(self.nyt, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["date", "county", "state", "fips", "cases",
+                             "deaths"])
+            for j, day in enumerate(m.dates):
+                for i in range(len(m)):
+                    # a county has no rows before its first count
+                    if m.values[i, :j + 1].any():
+                        writer.writerow([day.isoformat(), m.county[i],
+                                         NAMES[m.state[i]], m.fips[i],
+                                         m.values[i, j] * 2, m.values[i, j]])
+                writer.writerow([day.isoformat(), "Unknown", "Colorado", "",
+                                 3, 1])
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def assertSameMatrix(self, matrix, expected):
+        self.assertEqual(list(matrix.fips), list(expected.fips))
+        self.assertEqual(list(matrix.state), list(expected.state))
+        self.assertEqual(list(matrix.county), list(expected.county))
+        self.assertEqual(matrix.dates, expected.dates)
+        self.assertTrue((matrix.values == expected.values).all())
+        self.assertTrue((matrix.population == expected.population).all())
+
+    def test_find(self):
+        self.assertIsInstance(sources.find("test_deaths.csv"), sources.USAFacts)
+        self.assertIsInstance(sources.find(self.jhu), sources.JHU)
+        self.assertIsInstance(sources.find(self.nyt), sources.NYT)
+        self.assertIsInstance(sources.find(self.nyt, "nyt"), sources.NYT)
+        self.assertIsInstance(sources.find("deaths.npz"), sources.Compiled)
+
+        other = os.path.join(self.folder.name, "other.csv")
+        with open(other, "w") as f:
+            f.write("a,b,c\n1,2,3\n")
+        with self.assertRaises(ValueError):
+            sources.find(other)
+
+    def test_jhu(self):
+        matrix = CountyMatrix.from_csv(self.jhu, "test_population.csv")
+        self.assertSameMatrix(matrix, self.usafacts)
+
+        # the out of state row is unallocated
+        kept = CountyMatrix.from_csv(self.jhu, drop_unallocated=False,
+                                     states=["AL"])
+        self.assertEqual(list(kept.fips), [1001, 1003, 1005, 0])
+        self.assertEqual(list(kept.values[-1]), [7] * len(kept.dates))
+
+    def test_nyt(self):
+        deaths = CountyMatrix.from_csv(self.nyt, "test_population.csv",
+                                       measure="deaths")
+        self.assertSameMatrix(deaths.align_to(self.usafacts.fips),
+                              self.usafacts)
+        cases = CountyMatrix.from_csv(self.nyt, "test_population.csv")
+        self.assertTrue((cases.align_to(self.usafacts.fips).values ==
+                         self.usafacts.values * 2).all())
+
+        unknown = CountyMatrix.from_csv(self.nyt, drop_unallocated=False,
+                                        states=["CO"], measure="deaths")
+        self.assertEqual(list(unknown.fips[unknown.fips == 0]), [0])
+
+    def test_nyc(self):
+        # NYT has one row a day for the five boroughs of New York City
+        nyt = os.path.join(self.folder.name, "nyc.csv")
+        population = os.path.join(self.folder.name, "population.csv")
+        with open(nyt, "w") as f:
+            f.write("date,county,state,fips,cases,deaths\n" +
+                    "2020-02-29,New York City,New York,,1,0\n" +
+                    "2020-03-31,New York City,New York,,100,10\n" +
+                    "2020-03-31,Albany,New York,36001,20,2\n" +
+                    "2020-07-31,New York City,New York,,150,20\n")
+        with open(population, "w") as f:
+            f.write("countyFIPS,County Name,State,population\n" +
+                    "36001,Albany County,NY,300\n" +
+                    "".join(f"{fips},Borough,NY,1000\n"
+                            for fips in sources.NYC_BOROUGHS))
+
+        deaths = CountyMatrix.from_csv(nyt, population, measure="deaths")
+        self.assertEqual(list(deaths.fips), [sources.NYC_FIPS, 36001])
+        self.assertEqual(list(deaths.population), [5000, 300])
+        self.assertEqual(list(deaths.values[:, -1]), [20, 2])
+
+        covid_data = covid_deaths.load_covid_data(nyt, population,
+                                                  source="nyt")
+        # March: 10 in New York City and 2 in Albany
+        self.assertEqual(covid_data.columns()[3].tolist(), [12])
+
+    def test_filters(self):
+        start, end = date(2020, 4, 1), date(2020, 6, 30)
+        expected = CountyMatrix.from_csv("test_deaths.csv", states=["CO"],
+                                         start=start, end=end)
+        for file_name in (self.jhu, self.nyt):
+            matrix = CountyMatrix.from_csv(file_name, states=["CO"],
+                                           start=start, end=end,
+                                           measure="deaths")
+            self.assertEqual(matrix.dates, expected.dates)
+            self.assertTrue((matrix.align_to(expected.fips).values ==
+                             expected.values).all())
+
+    def test_compile(self):
+        out_file = os.path.join(self.folder.name, "nyt.npz")
+        sources.compile_feed(self.nyt, out_file, "deaths",
+                             "test_population.csv")
+        matrix = CountyMatrix.from_csv(out_file)
+        self.assertSameMatrix(matrix.align_to(self.usafacts.fips),
+                              self.usafacts)
+
+        al = CountyMatrix.from_csv(out_file, states=["AL"],
+                                   start=date(2020, 7, 1))
+        self.assertEqual(list(al.fips), [1001, 1003, 1005])
+        self.assertEqual(al.dates[0], date(2020, 7, 1))
+        self.assertTrue(np.all(al.values[:, -1] == 100000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+from covid_matrix import CountyMatrix
+from sqlite_store import SqliteStore, open_store
+
+
+class TestSqliteStore(unittest.TestCase):
+    def setUp(self):
+        deaths = CountyMatrix.from_csv("test_deaths.csv")
+        cases = CountyMatrix.from_csv("test_deaths.csv", "test_population.csv")
+        self.store = SqliteStore(":memory:")
+        self.store.load(cases, deaths, {"AL": 39.4, "CO": 37.1})
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_state_rates(self):
+        rates = self.store.state_rates("7")
+        self.assertEqual(rates, {("AL", 400): 37.5})
+
+    def test_county_rates(self):
+        rates = self.store.county_rates("7", "AL")
+        self.assertEqual(list(rates.values()), [50.0, 50.0, 25.0])
+        self.assertEqual(list(rates)[2], ("Barbour County", 200))
+
+    def test_covid_data(self):
+        data = self.store.covid_data()
+        al_str = "State: AL, Population: 400, Median Age: 39.4, " + \
+                 "State Data: {3: 3, 4: 27, 5: 30, 6: 90, 7: 150}"
+        self.assertEqual(str(data.data["AL"]), al_str)
+        self.assertEqual(data.data["CO"].get_total_deaths(), 1497)
+
+    def test_rates_for_states(self):
+        df = self.store.rates_for_states("state", None)
+        self.assertEqual(list(df["deaths"]), [300, 1497])
+        self.assertEqual(list(df["cases"]), [300, 0])
+
+    def test_open_store(self):
+        with tempfile.TemporaryDirectory() as folder:
+            files = [os.path.join(folder, f) for f in
+                     ("cases.csv", "deaths.csv", "population.csv", "age.csv")]
+            for name, source in zip(files, ["test_deaths.csv",
+                                            "test_deaths.csv",
+                                            "test_population.csv",
+                                            "state_median_age.csv"]):
+                shutil.copy(source, name)
+            db_file = os.path.join(folder, "covid.db")
+
+            store = open_store(db_file, *files)
+            self.assertEqual(store.state_rates("7"), {("AL", 400): 37.5})
+            signature = store.inputs()
+            store.close()
+
+            # unchanged files keep the database
+            store = open_store(db_file, *files)
+            self.assertEqual(store.inputs(), signature)
+            store.close()
+
+            # a refreshed file builds it again
+            with open(files[2], "w") as f:
+                f.write("countyFIPS,County Name,State,population\n" +
+                        "1001,Autauga County,AL,100\n" +
+                        "1003,Baldwin County,AL,100\n" +
+                        "1005,Barbour County,AL,400\n")
+            store = open_store(db_file, *files)
+            self.assertNotEqual(store.inputs(), signature)
+            self.assertEqual(store.state_rates("7"), {("AL", 600): 25.0})
+            store.close()
+
+if __name__ == '__main__':
+    unittest.main()
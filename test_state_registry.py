@@ -0,0 +1,35 @@
+import unittest
+import numpy as np
+import state_registry
+
+
+class TestStateRegistry(unittest.TestCase):
+    def test_choices(self):
+        self.assertEqual(len(state_registry.CHOICES), 51)
+        self.assertIn("DC", state_registry.CHOICES)
+        self.assertNotIn("PR", state_registry.CHOICES)
+
+    def test_encode_decode(self):
+        ids = state_registry.encode(["TX", "AL", "XX", "AK"])
+        self.assertEqual(ids.dtype, np.int8)
+        self.assertEqual(ids[3], state_registry.state_id("AK"))
+        self.assertLess(ids[3], ids[1])
+        self.assertEqual(ids[2], state_registry.UNKNOWN)
+        self.assertEqual(list(state_registry.decode(ids)),
+                         ["TX", "AL", "", "AK"])
+
+    def test_metadata(self):
+        tx = state_registry.state_id("TX")
+        self.assertEqual(state_registry.FIPS[tx], 48)
+        self.assertEqual(state_registry.NAMES[tx], "Texas")
+        self.assertEqual(state_registry.REGIONS[tx], "South")
+
+    def test_bincount(self):
+        ids = state_registry.encode(["TX", "AL", "TX", "XX"])
+        totals = state_registry.bincount(ids, [1, 2, 3, 4])
+        self.assertEqual(len(totals), len(state_registry.CODES))
+        self.assertEqual(totals[state_registry.state_id("TX")], 4)
+        self.assertEqual(totals.sum(), 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import argparse
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+import timelapse
+from covid_matrix import CountyMatrix
+
+
+class TestTimelapse(unittest.TestCase):
+    def setUp(self):
+        self.matrix = CountyMatrix.from_csv("test_deaths.csv")
+        self.matrix.population = self.matrix.join(
+            {1001: 100, 1003: 100, 1005: 200,
+             8079: 1000, 8081: 1000, 8083: 1000})
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_rate_frames(self):
+        names, population, dates, rates = timelapse.rate_frames(self.matrix)
+        self.assertEqual(list(names), ["AL", "CO"])
+        self.assertEqual(rates.shape, (2, len(dates)))
+        self.assertEqual(str(dates[-1]), "2020-07-31")
+        self.assertAlmostEqual(rates[0, -1], self.matrix.rollup().values[
+            "state"][0, self.matrix.period_columns()[1]] * 100 / 400)
+
+        names, population, dates, rates = timelapse.rate_frames(self.matrix,
+                                                                "CO")
+        self.assertEqual(len(names), 3)
+
+    def test_ratio_frames(self):
+        states, dates, ratios = timelapse.ratio_frames(self.matrix,
+                                                       self.matrix)
+        # deaths over deaths is 1 once a state has MIN_CASES
+        enough = ~np.isnan(ratios)
+        self.assertTrue(enough.any())
+        self.assertTrue(np.allclose(ratios[enough], 1.0))
+
+    def test_save_gif(self):
+        movie = timelapse.animate_rates(*timelapse.rate_frames(self.matrix),
+                                        "test")
+        name = os.path.join(self.dir.name, "rates.gif")
+        movie.save(name, fps=5)
+
+        with Image.open(name) as gif:
+            self.assertEqual(gif.n_frames, len(movie.frames))
+        # the points were moved to the last frame in place
+        points = movie.artists[0]
+        self.assertTrue(points.get_animated())
+        self.assertTrue(np.allclose(points.get_offsets()[:, 1],
+                                    timelapse.rate_frames(self.matrix)[3][:, -1]))
+
+    def test_mp4_needs_ffmpeg(self):
+        if timelapse.animation.writers.is_available("ffmpeg"):
+            self.skipTest("ffmpeg is installed")
+        with self.assertRaises(RuntimeError):
+            timelapse.writer_for("rates.mp4")
+
+    def test_positive_int(self):
+        self.assertEqual(timelapse.positive_int("3"), 3)
+        for text in ["0", "-2"]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                timelapse.positive_int(text)
+
+if __name__ == '__main__':
+    unittest.main()
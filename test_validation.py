@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+import validation
+from covid_matrix import CountyMatrix, parse_date
+
+
+class TestValidation(unittest.TestCase):
+    def setUp(self):
+        dates = [parse_date(d) for d in
+                 ["2/29/20", "3/31/20", "4/30/20", "5/31/20"]]
+        self.matrix = CountyMatrix([0, 1001, 1003], ["Statewide Unallocated",
+                                   "Autauga County", "Baldwin County"],
+                                   ["AL", "AL", "AL"], dates,
+                                   [[0, 1, 2, 3], [1, 5, 4, 6], [0, 2, 2, 9]])
+
+    def test_check(self):
+        report = validation.check(self.matrix, {0: 0, 1001: 100}, range(3, 6))
+        self.assertEqual(report.decreasing, [1001])
+        self.assertEqual(report.decreasing_cells, 1)
+        self.assertEqual(report.negative_months, {4: 1})
+        self.assertEqual(report.unallocated, [0])
+        self.assertEqual(report.missing_population, [1003])
+        self.assertFalse(report.ok)
+
+        # the checks that found nothing are left out of the log
+        self.assertNotIn("population of 0", "\n".join(report.findings()))
+        with self.assertLogs(level="DEBUG") as logs:
+            validation.log_report(report, "test.csv")
+        self.assertEqual(len(logs.output), 5)
+        # only the missing population record is logged at INFO
+        info = [line for line in logs.output if line.startswith("INFO")]
+        self.assertEqual(len(info), 1)
+        self.assertIn("1 counties have no population record", info[0])
+
+    def test_repair(self):
+        carried = validation.repair(self.matrix, "carry")
+        self.assertEqual(list(carried.values[1]), [1, 5, 5, 6])
+
+        lowered = validation.repair(self.matrix, "lower")
+        self.assertEqual(list(lowered.values[1]), [1, 4, 4, 6])
+
+        dropped = validation.repair(self.matrix, "drop")
+        self.assertEqual(list(dropped.fips), [0, 1003])
+
+        with self.assertRaises(ValueError):
+            validation.repair(self.matrix, "nothing")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,298 @@
+import os
+import sys
+import logging
+import argparse
+import numpy as np
+from matplotlib import animation
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image, GifImagePlugin
+import covid_deaths
+from state_registry import CHOICES
+from covid_matrix import load_cases, load_deaths
+
+OUT_FILE = "timelapse.gif"
+FPS = 10
+
+# points with more rows than this are not labelled
+MAX_LABELS = 60
+
+# ratios of states with fewer cases than this are too noisy to show
+MIN_CASES = 100
+
+
+def rate_frames(matrix, state: str = None):
+    """
+    (names, population, dates, rates) for a time-lapse of infection rates:
+    the cumulative count since the end of February as a percentage of the
+    population, with a row per state (or per county of state) and a column
+    per day from March 1 to July 31.
+    """
+    first, last = matrix.period_columns()
+    if state is None:
+        rollup = matrix.rollup()
+        rows = np.flatnonzero((rollup.state_id >= 0) &
+                              (rollup.population["state"] > 0))
+        names = rollup.names["state"][rows]
+        population = rollup.population["state"][rows]
+        values = rollup.values["state"][rows]
+    else:
+        rows = np.flatnonzero((matrix.state == state) &
+                              (matrix.population > 0))
+        names = matrix.county[rows]
+        population = matrix.population[rows]
+        values = matrix.values[rows]
+
+    counts = values[:, first + 1:last + 1] - values[:, first, np.newaxis]
+    rates = counts * 100 / population[:, np.newaxis].astype(np.float64)
+    return names, population, matrix.dates[first + 1:last + 1], rates
+
+
+def ratio_frames(cases, deaths):
+    """
+    (states, dates, ratios) for a time-lapse of the ratio of deaths to cases
+    of every state, both counted from the end of February. States are in
+    order of increasing population, as in combined.py. A ratio is nan until
+    a state has MIN_CASES cases.
+    """
+    names, population, dates, _ = rate_frames(cases)
+    first, last = cases.period_columns()
+    case_rollup = cases.rollup()
+    death_rollup = deaths.rollup()
+
+    def counts(rollup, matrix):
+        lookup = dict(zip(rollup.names["state"], rollup.values["state"]))
+        start, end = matrix.period_columns()
+        return np.array([lookup[n][start + 1:end + 1] - lookup[n][start]
+                         if n in lookup else np.zeros(end - start)
+                         for n in names], dtype=np.float64)
+
+    case_counts = counts(case_rollup, cases)
+    death_counts = counts(death_rollup, deaths)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.where(case_counts >= MIN_CASES, death_counts / case_counts,
+                          np.nan)
+
+    order = np.argsort(population, kind="stable")
+    return names[order], dates, ratios[order]
+
+
+def _canvas_image(writer):
+    # the frame as it is on the canvas, without drawing the figure again
+    return Image.frombuffer("RGBA", writer.frame_size,
+                            writer.fig.canvas.buffer_rgba(), "raw", "RGBA",
+                            0, 1).convert("RGB")
+
+
+class _GifStream(animation.AbstractMovieWriter):
+    # writes a GIF with Pillow's encoder one frame at a time. Each frame has
+    # its own colour table, so it can be written as soon as it is grabbed;
+    # PillowWriter keeps all the frames in memory until the end
+    def setup(self, fig, outfile, dpi=None):
+        super().setup(fig, outfile, dpi=dpi)
+        self._file = open(outfile, "wb")
+        self._started = False
+
+    def grab_frame(self, **savefig_kwargs):
+        frame = _canvas_image(self).quantize(
+            method=Image.Quantize.FASTOCTREE)
+        if not self._started:
+            header, _ = GifImagePlugin.getheader(
+                frame, info={"loop": 0, "optimize": False})
+            self._file.write(b"".join(header))
+            self._started = True
+        for data in GifImagePlugin.getdata(frame, include_color_table=True,
+                                           duration=int(1000 / self.fps)):
+            self._file.write(data)
+
+    def finish(self):
+        self._file.write(b";")
+        self._file.close()
+
+
+class _FFMpegFrames(animation.FFMpegWriter):
+    # pipes each frame from the canvas to ffmpeg as it is, so no frame is
+    # kept in memory
+    frame_format = "rgba"
+
+    def grab_frame(self, **savefig_kwargs):
+        self._proc.stdin.write(self.fig.canvas.buffer_rgba())
+
+
+def writer_for(file_name: str, fps: int = FPS):
+    """
+    The animation writer for a file: Pillow's GIF encoder for .gif, ffmpeg
+    for anything else such as .mp4. Both write each frame as it comes.
+    """
+    if file_name.lower().endswith(".gif"):
+        return _GifStream(fps=fps)
+    if not animation.writers.is_available("ffmpeg"):
+        raise RuntimeError(f"Writing {os.path.basename(file_name)} needs " +
+                           "ffmpeg. Install it or write a .gif instead.")
+    return _FFMpegFrames(fps=fps)
+
+
+class Timelapse:
+    """
+    An animation whose artists are made once and changed in place by
+    update(frame). save() draws the parts that do not change (axes, ticks,
+    titles) once and keeps a copy of them. Each frame restores that copy,
+    draws only the changed artists over it and hands the canvas to the
+    writer, so every frame costs the same however many there are.
+    """
+
+    def __init__(self, fig, artists: list, update, frames):
+        self.fig = fig
+        self.artists = artists
+        self.update = update
+        self.frames = frames
+
+    def __repr__(self) -> str:
+        return f"Timelapse({len(self.frames)} frames)"
+
+    def save(self, file_name: str, fps: int = FPS, writer=None):
+        if writer is None:
+            writer = writer_for(file_name, fps)
+        canvas = self.fig.canvas
+        for artist in self.artists:
+            artist.set_animated(True)
+        canvas.draw()
+        background = canvas.copy_from_bbox(self.fig.bbox)
+
+        with writer.saving(self.fig, file_name, dpi=self.fig.dpi):
+            for frame in self.frames:
+                self.update(frame)
+                canvas.restore_region(background)
+                for artist in self.artists:
+                    self.fig.draw_artist(artist)
+                writer.grab_frame()
+        logging.debug(f"Timelapse.save(): {len(self.frames)} frames " +
+                      f"written to {file_name}")
+
+
+def animate_rates(names, population, dates, rates, title: str,
+                  step: int = 1) -> Timelapse:
+    """
+    A scatter of rate against population whose points are moved each frame
+    with set_offsets.
+    """
+    fig = Figure(figsize=(9, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.set_xscale("log")
+    ax.set_xlim(population.min() * 0.8, population.max() * 1.25)
+    ax.set_ylim(0, max(np.nanmax(rates, initial=0) * 1.1, 0.01))
+    ax.set_title(title)
+    ax.set_xlabel("Population")
+    ax.set_ylabel("Infection rate as a percentage of population")
+
+    x = population.astype(np.float64)
+    points = ax.scatter(x, rates[:, 0], c="green")
+    labels = []
+    if len(names) <= MAX_LABELS:
+        labels = [ax.text(x[i], rates[i, 0], str(n), fontsize=7)
+                  for i, n in enumerate(names)]
+    day = ax.text(0.02, 0.95, "", transform=ax.transAxes)
+
+    def update(column):
+        y = rates[:, column]
+        points.set_offsets(np.column_stack([x, y]))
+        for i, label in enumerate(labels):
+            label.set_position((x[i], y[i]))
+        day.set_text(str(dates[column]))
+
+    return Timelapse(fig, [points, day] + labels, update,
+                     range(0, rates.shape[1], step))
+
+
+def animate_ratios(states, dates, ratios, step: int = 1) -> Timelapse:
+    """
+    The deaths to cases ratio of every state, one marker line whose data is
+    replaced each frame with set_data.
+    """
+    fig = Figure(figsize=(12, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    x = np.arange(len(states))
+    ax.set_xticks(x)
+    ax.set_xticklabels(states, rotation=90)
+    ax.set_xlim(-1, len(states))
+    ax.set_ylim(0, max(np.nanmax(ratios, initial=0) * 1.1, 0.01))
+    ax.set_title("Death rates by state for March - July/2020")
+    ax.set_xlabel("States in order of increasing population")
+    ax.set_ylabel("Ratio of deaths to cases")
+
+    line, = ax.plot(x, ratios[:, 0], "o")
+    day = ax.text(0.02, 0.92, "", transform=ax.transAxes)
+
+    def update(column):
+        line.set_data(x, ratios[:, column])
+        day.set_text(str(dates[column]))
+
+    return Timelapse(fig, [line, day], update,
+                     range(0, ratios.shape[1], step))
+
+
+def positive_int(text: str) -> int:
+    # argparse type of --fps and --step, which must be at least 1
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+
+def main():
+    covid_deaths.setup_logging()
+
+    parser = argparse.ArgumentParser(
+        description="Day by day animations of infection rates and death " +
+                    "ratios from March to July 2020")
+
+    parser.add_argument("command", metavar="<command>", type=str,
+                        choices=["rates", "ratios"],
+                        help="rates: infection rate against population, " +
+                             "ratios: deaths to cases of every state")
+
+    parser.add_argument("-l", "--location", dest="state",
+                        choices=CHOICES, type=str, default=None,
+                        help="Animate the counties of a state (rates only)")
+
+    parser.add_argument("-o", "--outfile", dest="outfile", type=str,
+                        default=OUT_FILE,
+                        help="A .gif, or a .mp4 when ffmpeg is installed")
+
+    parser.add_argument("--fps", dest="fps", type=positive_int, default=FPS,
+                        help="Frames per second")
+
+    parser.add_argument("--step", dest="step", type=positive_int, default=1,
+                        help="Days between frames")
+
+    parser.add_argument("--low-memory", dest="low_memory",
+                        action="store_true", default=False,
+                        help="Store counts as int32 and populations as " +
+                             "uint32 to halve the memory used")
+
+    args = parser.parse_args()
+
+    try:
+        writer = writer_for(args.outfile, args.fps)
+    except RuntimeError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+    cases = load_cases(low_memory=args.low_memory)
+    if args.command == "rates":
+        where = "state" if args.state is None else f"county of {args.state}"
+        timelapse = animate_rates(*rate_frames(cases, args.state),
+                             f"Infection rates of every {where}, 2020",
+                             args.step)
+    else:
+        deaths = load_deaths(low_memory=args.low_memory)
+        timelapse = animate_ratios(*ratio_frames(cases, deaths), args.step)
+
+    timelapse.save(args.outfile, writer=writer)
+    logging.info(f"Wrote {args.outfile}")
+
+
+if __name__ == '__main__':
+    main()
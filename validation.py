@@ -0,0 +1,181 @@
+import sys
+import logging
+import argparse
+import numpy as np
+
+# what to do with cumulative series that go down after a correction
+#   none  - only report the problem
+#   carry - keep the highest value seen so far (running maximum)
+#   lower - lower the earlier values to the corrected one (running minimum
+#           taken from the last date backwards)
+#   drop  - drop the counties whose series go down
+POLICIES = ["none", "carry", "lower", "drop"]
+
+
+class ValidationReport:
+    """
+    Problems found in a cumulative county matrix. Every list holds FIPS
+    codes, negative_months maps a month to the number of counties whose
+    count for that month is negative.
+    """
+
+    def __init__(self):
+        self.decreasing_cells = 0
+        self.decreasing = []
+        self.negative_months = dict()
+        self.missing_population = []
+        self.zero_population = []
+        self.unallocated = []
+
+    def __repr__(self) -> str:
+        return (f"ValidationReport(decreasing_cells={self.decreasing_cells}, " +
+                f"decreasing={len(self.decreasing)}, " +
+                f"negative_months={self.negative_months}, " +
+                f"missing_population={len(self.missing_population)}, " +
+                f"zero_population={len(self.zero_population)}, " +
+                f"unallocated={len(self.unallocated)})")
+
+    def _lines(self):
+        # (count, line) for every check
+        yield (len(self.decreasing),
+               f"Counties with decreasing totals: {len(self.decreasing)} " +
+               f"({self.decreasing_cells} days)")
+        for month, count in self.negative_months.items():
+            yield (count, f"Counties with negative counts in month {month}: " +
+                   f"{count}")
+        yield (len(self.missing_population),
+               "Counties without a population record: " +
+               f"{len(self.missing_population)}")
+        yield (len(self.zero_population),
+               f"Counties with a population of 0: {len(self.zero_population)}")
+        yield len(self.unallocated), f"Unallocated rows: {len(self.unallocated)}"
+
+    def __str__(self) -> str:
+        return "\n".join(line for count, line in self._lines())
+
+    def findings(self) -> list:
+        """
+        The lines of the report for the checks that found something.
+        """
+        return [line for count, line in self._lines() if count]
+
+    @property
+    def ok(self) -> bool:
+        # zero populations and unallocated rows are expected in the USAFacts
+        # files, so they are reported but do not count as problems
+        return not (self.decreasing or self.negative_months or
+                    self.missing_population)
+
+
+def unallocated_rows(matrix):
+    """
+    Mask of the rows that are not a county: the Statewide Unallocated rows,
+    which have FIPS 0, and rows such as New York City Unallocated/Probable
+    that have a FIPS code of their own.
+    """
+    return (matrix.fips == 0) | \
+        (np.char.find(matrix.county, "Unallocated") >= 0)
+
+
+def check(matrix, populations: dict = None, months=range(3, 8)):
+    """
+    Checks a CountyMatrix in one pass over the whole values matrix and
+    returns a ValidationReport. populations is the {fips: population}
+    dictionary the matrix was joined with, used to find counties without a
+    record.
+    """
+    report = ValidationReport()
+
+    drops = np.diff(matrix.values, axis=1) < 0
+    report.decreasing_cells = int(drops.sum())
+    report.decreasing = matrix.fips[drops.any(axis=1)].tolist()
+
+    for month in months:
+        try:
+            negative = matrix.period_values(month) < 0
+        except KeyError:
+            # the month is not in the loaded date window
+            continue
+        if negative.any():
+            report.negative_months[month] = int(negative.sum())
+
+    unallocated = unallocated_rows(matrix)
+    report.unallocated = matrix.fips[unallocated].tolist()
+
+    if populations is not None:
+        population = matrix.join(populations, default=-1)
+        report.missing_population = \
+            matrix.fips[(population < 0) & ~unallocated].tolist()
+        report.zero_population = \
+            matrix.fips[(population == 0) & ~unallocated].tolist()
+
+    return report
+
+
+def repair(matrix, policy: str):
+    """
+    Returns a CountyMatrix whose cumulative series never go down, repaired
+    with one of POLICIES.
+    """
+    if policy == "none":
+        return matrix
+    if policy == "carry":
+        return _with_values(matrix, np.maximum.accumulate(matrix.values, axis=1))
+    if policy == "lower":
+        lowered = np.minimum.accumulate(matrix.values[:, ::-1], axis=1)[:, ::-1]
+        return _with_values(matrix, lowered)
+    if policy == "drop":
+        keep = ~(np.diff(matrix.values, axis=1) < 0).any(axis=1)
+        return matrix.take(np.flatnonzero(keep))
+    raise ValueError(f"Unknown repair policy: {policy}")
+
+
+def _with_values(matrix, values):
+    return type(matrix)(matrix.fips, matrix.county, matrix.state,
+                        matrix.dates, values, matrix.population)
+
+
+def log_report(report, file_name):
+    """
+    Logs the checks that found something at DEBUG. Totals that go down after
+    a correction, zero populations and unallocated rows are in every
+    USAFacts download, so they are expected. Only counties without a
+    population record, which the loaders leave out, get a line at INFO.
+    The validation command prints the whole report.
+    """
+    findings = report.findings()
+    if not findings:
+        logging.debug(f"{file_name}: no data problems found")
+    for line in findings:
+        logging.debug(f"{file_name}: {line}")
+    if report.missing_population:
+        logging.info(f"{file_name}: {len(report.missing_population)} " +
+                     "counties have no population record and are left out")
+
+
+def main():
+    from covid_matrix import CountyMatrix, POPULATION_FILE, read_population
+
+    parser = argparse.ArgumentParser(
+        description="Check a cumulative USAFacts county file")
+
+    parser.add_argument("file_name", metavar="<file_name>", type=str,
+                        help="cases or deaths file to check")
+
+    parser.add_argument("-n", "--population", dest="population_file",
+                        type=str, default=POPULATION_FILE,
+                        help="county population file")
+
+    args = parser.parse_args()
+
+    matrix = CountyMatrix.from_csv(args.file_name, drop_unallocated=False,
+                                   policy=None)
+    report = check(matrix, read_population(args.population_file))
+    print(report)
+
+    if not report.ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()